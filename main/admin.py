@@ -3,7 +3,8 @@ from datetime import timedelta
 
 from django.contrib import admin
 from django.db.models import Count, F, Max, Min, Q, QuerySet, Sum
-from django.urls import reverse
+from django.shortcuts import redirect
+from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils.timezone import now
 
@@ -11,12 +12,19 @@ from main.constants import (
     CATEGORY_GAMES,
     CATEGORY_MOVIES,
     CATEGORY_TV_SHOWS,
+    JOB_QUEUED,
+    JOB_RUNNING,
     STATUS_FINISHED,
     STATUS_NEW,
     STATUS_SKIPPED,
 )
-from main.models import Title, Torrent
-from main.parsing import parse_title
+from main.jobs import cancel_jobs, enqueue
+from main.models import Job, Title, Torrent
+from main.pagination import KeysetPaginationMixin
+from main.parsing import parse_titles
+from main.search import FullTextSearchMixin
+from main.selectors import invalidate_dashboard_stats
+from main.services import mark_titles, refresh_title_stats
 
 logger = logging.getLogger(__name__)
 
@@ -25,56 +33,53 @@ logger = logging.getLogger(__name__)
 def parse_title_cmd(modeladmin, request, queryset):
     """Parse title command."""
     logger.info('Parsing titles of torrents...')
-    torrents = set(t for t in queryset)
-    for torrent in torrents:
-        parse_title(torrent)
+    count = parse_titles(queryset)
+    invalidate_dashboard_stats()
+    modeladmin.message_user(request, f'Parsed titles of {count} torrents.')
 
 
 @admin.action(description='Mark as new')
 def mark_as_new_cmd(modeladmin, request, queryset):
     """Mark as new command."""
     logger.info('Marking as new...')
-    titles = set(t for t in queryset)
-    for title in titles:
-        title.status = STATUS_NEW
-        title.status_at = now()
-        title.save()
+    count = mark_titles(queryset, STATUS_NEW)
+    modeladmin.message_user(request, f'Marked {count} titles as new.')
 
 
 @admin.action(description='Mark as skipped')
 def mark_as_skipped_cmd(modeladmin, request, queryset):
     """Mark as skipped command."""
     logger.info('Marking as skipped...')
-    titles = set(t for t in queryset)
-    for title in titles:
-        title.status = STATUS_SKIPPED
-        title.status_at = now()
-        title.save()
+    count = mark_titles(queryset, STATUS_SKIPPED)
+    modeladmin.message_user(request, f'Marked {count} titles as skipped.')
 
 
 @admin.action(description='Mark as finished')
 def mark_as_finished_cmd(modeladmin, request, queryset):
     """Mark as finished command."""
     logger.info('Marking as finished...')
-    titles = set(t for t in queryset)
-    for title in titles:
-        title.status = STATUS_FINISHED
-        title.status_at = now()
-        title.save()
+    count = mark_titles(queryset, STATUS_FINISHED)
+    modeladmin.message_user(request, f'Marked {count} titles as finished.')
 
 
 @admin.action(description='Update torrent stats')
 def update_stats_cmd(modeladmin, request, queryset):
     """Update stats command."""
     logger.info('Updating stats...')
-    titles = set(t for t in queryset)
-    for title in titles:
-        title.update_stats()
-        title.save()
+    count = refresh_title_stats(queryset)
+    modeladmin.message_user(request, f'Updated stats of {count} titles.')
+
+
+@admin.action(description='Cancel jobs')
+def cancel_jobs_cmd(modeladmin, request, queryset):
+    """Cancel jobs command."""
+    logger.info('Cancelling jobs...')
+    count = cancel_jobs(queryset)
+    modeladmin.message_user(request, f'Cancelled {count} jobs.')
 
 
 @admin.register(Torrent)
-class TorrentAdmin(admin.ModelAdmin):
+class TorrentAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'title',
@@ -103,11 +108,13 @@ class TorrentAdmin(admin.ModelAdmin):
             obj.title.status = STATUS_NEW
             obj.title.status_at = now()
             obj.title.save()
-        return super().save_model(request, obj, form, change)
+        result = super().save_model(request, obj, form, change)
+        invalidate_dashboard_stats()
+        return result
 
 
 @admin.register(Title)
-class TitleAdmin(admin.ModelAdmin):
+class TitleAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = (
         'text',
         'status',
@@ -162,7 +169,7 @@ class PcGames(Title):
 
 
 @admin.register(PcGames)
-class PcGamesAdmin(admin.ModelAdmin):
+class PcGamesAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = (
         'text',
         'priority',
@@ -247,7 +254,7 @@ class TvShows(Title):
 
 
 @admin.register(TvShows)
-class TVShowsAdmin(admin.ModelAdmin):
+class TVShowsAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = (
         'seeders',
         'earliest_uploaded_at',
@@ -323,7 +330,7 @@ class Movies(Title):
 
 
 @admin.register(Movies)
-class MoviesAdmin(admin.ModelAdmin):
+class MoviesAdmin(FullTextSearchMixin, KeysetPaginationMixin, admin.ModelAdmin):
     list_display = ('seeders', 'earliest_uploaded_at', 'status', 'text', 'torrents', 'last_name')
     # ordering = ('earliest_uploaded_at',)
     actions = [mark_as_skipped_cmd, mark_as_finished_cmd, mark_as_new_cmd]
@@ -365,3 +372,59 @@ class MoviesAdmin(admin.ModelAdmin):
         if last_torrent := title.torrents.order_by('uploaded_at').last():
             url = reverse('admin:main_torrent_changelist')
             return format_html(f'<a href="{url}?title={title.text}&o=-11">{last_torrent.name}</a>')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'name',
+        'status',
+        'progress',
+        'cancel_requested',
+        'worker',
+        'created_at',
+        'started_at',
+        'finished_at',
+    )
+    list_filter = ('name', 'status')
+    ordering = ['-created_at']
+    actions = [cancel_jobs_cmd]
+    readonly_fields = [field.name for field in Job._meta.fields]
+
+    change_list_template = 'main/job_change_list.html'
+
+    @admin.display(description='Progress')
+    def progress(self, job: Job) -> str:
+        """Progress field."""
+        return job.progress_fmt()
+
+    def has_add_permission(self, request):
+        """Jobs are queued through the enqueue links."""
+        return False
+
+    def get_urls(self):
+        """Add the enqueue links."""
+        urls = [
+            path(
+                'enqueue/<str:name>/',
+                self.admin_site.admin_view(self.enqueue_view),
+                name='main_job_enqueue',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def enqueue_view(self, request, name):
+        """Queue a job and go back to the list."""
+        job = enqueue(name)
+        self.message_user(request, f'Queued {job.get_name_display().lower()} as job {job.pk}.')
+        return redirect(reverse('admin:main_job_changelist'))
+
+    def changelist_view(self, request, extra_context=None):
+        """Add the job names and refresh while jobs are active."""
+        extra_context = {
+            'job_names': Job.NAMES,
+            'jobs_active': Job.objects.filter(status__in=[JOB_QUEUED, JOB_RUNNING]).exists(),
+            **(extra_context or {}),
+        }
+        return super().changelist_view(request, extra_context)
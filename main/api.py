@@ -0,0 +1,318 @@
+"""Read only JSON API over titles and torrents.
+
+The views are async and use the async ORM, so under an ASGI server waiting clients do
+not each hold a worker thread, Django still runs the queries in a thread of its own.
+Rows are read with values() to skip building models.
+
+Lists are filtered by query parameters and paged by a keyset cursor: follow ``next``
+until it is null. The export views stream every matching row as NDJSON or CSV. The
+postcode views answer from the in-memory spatial index without querying the database.
+"""
+
+import csv
+import json
+import math
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from datetime import datetime, time
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, QuerySet
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from django.views.decorators.http import require_GET
+
+from main.constants import COUNTRY_ZA
+from main.models import Title, Torrent
+from main.pagination import KeysetPaginator, decode_cursor, encode_cursor
+from main.selectors import list_nearest_postcodes, list_postcodes_within
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+EXPORT_CHUNK_SIZE = 2_000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+TITLE_FIELDS = (
+    'text',
+    'status',
+    'status_at',
+    'year',
+    'series',
+    'season',
+    'episode',
+    'earliest_upload_at',
+    'latest_upload_at',
+    'priority',
+)
+TITLE_ORDERING = ('text',)
+TORRENT_FIELDS = (
+    'id',
+    'site',
+    'category',
+    'subcategory',
+    'name',
+    'url',
+    'seeders',
+    'leechers',
+    'uploaded_at',
+    'size',
+    'uploader',
+    'title',
+)
+TORRENT_ORDERING = ('-seeders', 'id')
+
+
+class BadRequestError(Exception):
+    """Invalid query parameter."""
+
+
+def parse_limit(request) -> int:
+    """Get the number of rows asked for."""
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError as exc:
+        raise BadRequestError('limit must be a number') from exc
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def parse_number(request, name: str, low: float, high: float, default=None) -> float:
+    """Get a number parameter between low and high."""
+    value = request.GET.get(name, default)
+    if value is None:
+        raise BadRequestError(f'{name} is required')
+    try:
+        number = float(value)
+    except ValueError as exc:
+        raise BadRequestError(f'{name} must be a number') from exc
+    if not (math.isfinite(number) and low <= number <= high):
+        raise BadRequestError(f'{name} must be between {low} and {high}')
+    return number
+
+
+def parse_moment(request, name: str) -> datetime | None:
+    """Get a date or datetime parameter as an aware datetime."""
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None and (day := parse_date(value)):
+            moment = datetime.combine(day, time.min)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise BadRequestError(f'{name} must be a date or datetime')
+    return make_aware(moment) if is_naive(moment) else moment
+
+
+def bad_request(exc: BadRequestError) -> JsonResponse:
+    """Respond with the error."""
+    return JsonResponse({'error': str(exc)}, status=400)
+
+
+def filter_titles(request) -> QuerySet[Title]:
+    """Filter titles by status, torrent category and latest upload."""
+    titles = Title.objects.all()
+    if status := request.GET.get('status'):
+        if not status.isdigit():
+            raise BadRequestError('status must be a number')
+        titles = titles.filter(status=status)
+    if category := request.GET.get('category'):
+        torrents = Torrent.objects.filter(title=OuterRef('pk'), category=category)
+        titles = titles.filter(Exists(torrents))
+    if after := parse_moment(request, 'uploaded_after'):
+        titles = titles.filter(latest_upload_at__gte=after)
+    if before := parse_moment(request, 'uploaded_before'):
+        titles = titles.filter(latest_upload_at__lt=before)
+    return titles
+
+
+def filter_torrents(request) -> QuerySet[Torrent]:
+    """Filter torrents by category, subcategory, title and upload."""
+    torrents = Torrent.objects.all()
+    for name in ('category', 'subcategory', 'title'):
+        if value := request.GET.get(name):
+            torrents = torrents.filter(**{name: value})
+    if after := parse_moment(request, 'uploaded_after'):
+        torrents = torrents.filter(uploaded_at__gte=after)
+    if before := parse_moment(request, 'uploaded_before'):
+        torrents = torrents.filter(uploaded_at__lt=before)
+    return torrents
+
+
+async def keyset_page(request, queryset: QuerySet, ordering: tuple, fields: tuple) -> dict:
+    """Get the page after the request's cursor with the url of the next one."""
+    limit = parse_limit(request)
+    paginator = KeysetPaginator(queryset.order_by(*ordering), limit)
+    number, values = 1, None
+    if cursor := request.GET.get('cursor'):
+        decoded = decode_cursor(cursor)
+        # a cursor made for another ordering, or tampered with, has no usable sort key
+        if decoded is None or (values := paginator.clean_values(decoded[1])) is None:
+            raise BadRequestError('cursor is invalid')
+        number = decoded[0]
+    rows = paginator.seek(values) if values is not None else paginator.object_list
+    # one row more than the page, to tell whether there is a next page
+    results = [row async for row in rows.values(*fields)[: limit + 1]]
+    has_next = len(results) > limit
+    results = results[:limit]
+
+    next_url = None
+    if has_next:
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor(
+            number + 1, [results[-1][name] for name, _, _ in paginator.sort_keys]
+        )
+        next_url = f'{request.path}?{params.urlencode()}'
+    return {'results': results, 'next': next_url}
+
+
+@require_GET
+async def titles_view(request):
+    """List titles."""
+    try:
+        page = await keyset_page(request, filter_titles(request), TITLE_ORDERING, TITLE_FIELDS)
+    except BadRequestError as exc:
+        return bad_request(exc)
+    return JsonResponse(page)
+
+
+@require_GET
+async def title_view(request, text):
+    """Get a title with its best seeded torrents."""
+    title = await Title.objects.filter(pk=text).values(*TITLE_FIELDS).afirst()
+    if title is None:
+        return JsonResponse({'error': 'No such title'}, status=404)
+    torrents = Torrent.objects.filter(title=text).order_by('-seeders').values(*TORRENT_FIELDS)
+    title['torrents'] = [torrent async for torrent in torrents[:MAX_LIMIT]]
+    return JsonResponse(title)
+
+
+@require_GET
+async def torrents_view(request):
+    """List torrents, best seeded first."""
+    try:
+        page = await keyset_page(
+            request, filter_torrents(request), TORRENT_ORDERING, TORRENT_FIELDS
+        )
+    except BadRequestError as exc:
+        return bad_request(exc)
+    return JsonResponse(page)
+
+
+##########################################################################################
+# Export
+##########################################################################################
+
+
+class Echo:
+    """File-like object handing back what is written, for csv.writer."""
+
+    def write(self, value: str) -> str:
+        """Return the value."""
+        return value
+
+
+def row_formatter(fields: tuple, fmt: str) -> tuple[str, Callable[[dict], str]]:
+    """Get the header and the line formatter of the export format."""
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        return writer.writerow(fields), lambda row: writer.writerow(row.values())
+    return '', lambda row: json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_lines(rows: Iterable[dict], header: str, line: Callable) -> Iterator[str]:
+    """Format rows in chunks."""
+    chunk = [header]
+    for row in rows:
+        chunk.append(line(row))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+async def aexport_lines(rows: QuerySet, header: str, line: Callable) -> AsyncIterator[str]:
+    """Format rows from the async ORM in chunks."""
+    chunk = [header]
+    async for row in rows.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        chunk.append(line(row))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+def stream_export(request, queryset: QuerySet, fields: tuple, name: str):
+    """Stream every row of the queryset in the requested format.
+
+    The rows are read from a database cursor a chunk at a time, so memory stays flat
+    however many rows match. ASGI servers are handed an async iterator and WSGI servers
+    a sync one, since Django buffers the whole response to adapt either to the other.
+    """
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return bad_request(BadRequestError(f'format must be one of {", ".join(EXPORT_FORMATS)}'))
+    header, line = row_formatter(fields, fmt)
+    rows = queryset.values(*fields)
+    if isinstance(request, ASGIRequest):
+        content = aexport_lines(rows, header, line)
+    else:
+        content = export_lines(rows.iterator(chunk_size=EXPORT_CHUNK_SIZE), header, line)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+
+@require_GET
+def titles_export_view(request):
+    """Export the filtered titles."""
+    try:
+        titles = filter_titles(request).order_by(*TITLE_ORDERING)
+    except BadRequestError as exc:
+        return bad_request(exc)
+    return stream_export(request, titles, TITLE_FIELDS, 'titles')
+
+
+@require_GET
+def torrents_export_view(request):
+    """Export the filtered torrents."""
+    try:
+        torrents = filter_torrents(request).order_by('id')
+    except BadRequestError as exc:
+        return bad_request(exc)
+    return stream_export(request, torrents, TORRENT_FIELDS, 'torrents')
+
+
+##########################################################################################
+# Postcodes
+##########################################################################################
+
+
+@require_GET
+def postcodes_nearest_view(request):
+    """List the k postcodes nearest to lat and lon."""
+    try:
+        lat = parse_number(request, 'lat', -90, 90)
+        lon = parse_number(request, 'lon', -180, 180)
+        k = int(parse_number(request, 'k', 1, MAX_LIMIT, default=1))
+    except BadRequestError as exc:
+        return bad_request(exc)
+    return JsonResponse({'results': list_nearest_postcodes(lat, lon, k)})
+
+
+@require_GET
+def postcodes_within_view(request, code):
+    """List the postcodes within km of a postcode of the country, ZA by default."""
+    try:
+        km = parse_number(request, 'km', 0, 20_000)
+    except BadRequestError as exc:
+        return bad_request(exc)
+    postcodes = list_postcodes_within(code, km, request.GET.get('country', COUNTRY_ZA).upper())
+    if postcodes is None:
+        return JsonResponse({'error': 'No such postcode'}, status=404)
+    return JsonResponse({'results': postcodes})
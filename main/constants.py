@@ -25,6 +25,18 @@ SUBCATEGORY_HEVC_TV = 'hevc/x265'
 SUBCATEGORY_PCGAMES = 'pcgames'
 SUBCATEGORY_SWITCH = 'switch'
 
+COUNTRY_ZA = 'ZA'
+
 STATUS_NEW = 10
 STATUS_SKIPPED = 20
 STATUS_FINISHED = 30
+
+JOB_SCRAPE = 'scrape'
+JOB_REFRESH_STATS = 'refresh stats'
+JOB_PRUNE = 'prune'
+
+JOB_QUEUED = 10
+JOB_RUNNING = 20
+JOB_FINISHED = 30
+JOB_FAILED = 40
+JOB_CANCELLED = 50
@@ -0,0 +1,308 @@
+"""Great circle distances between postcodes.
+
+``haversine`` measures one pair. ``pairwise_blocks`` measures every pair of a set of
+points with NumPy, a tile of rows against all later points at a time, so memory stays
+bounded by the tile size rather than growing with the square of the number of points.
+``measure_tiles`` spreads the tiles over worker processes. ``nearby_pairs`` finds only
+the pairs within a radius, bucketing the points into a grid so that far apart pairs are
+never measured. ``PairBitmap`` marks pairs by their condensed index, one bit each.
+``SpatialIndex`` answers nearest and radius queries about a fixed set of points.
+
+The module does not use Django, so worker processes can import it whichever way they
+are started.
+"""
+
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from math import asin, cos, degrees, radians, sin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+# pairs measured per tile, the temporary arrays of a tile hold up to twice this many
+TILE_PAIRS = 1_000_000
+# tiles submitted per worker ahead of the one being consumed
+TILES_AHEAD = 2
+# edge of the cubes the spatial index buckets points into
+INDEX_CELL_KM = 10
+# number of bits set in each byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Get the km between two points."""
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * asin(sqrt(a))
+
+
+def haversine_matrix(
+    lat_a: np.ndarray, lon_a: np.ndarray, lat_b: np.ndarray, lon_b: np.ndarray
+) -> np.ndarray:
+    """Get the km from each point a (rows) to each point b (columns)."""
+    dlat = np.radians(lat_b[np.newaxis, :] - lat_a[:, np.newaxis])
+    dlon = np.radians(lon_b[np.newaxis, :] - lon_a[:, np.newaxis])
+    cos_a = np.cos(np.radians(lat_a))[:, np.newaxis]
+    cos_b = np.cos(np.radians(lat_b))[np.newaxis, :]
+    a = np.sin(dlat / 2) ** 2 + cos_a * cos_b * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
+
+def tiles(n: int, tile_pairs: int = TILE_PAIRS) -> list[tuple[int, int]]:
+    """Split the rows of the pairs of n points into (start, stop) runs of about tile_pairs."""
+    runs = []
+    start = 0
+    while start < n - 1:
+        stop, pairs = start + 1, n - start - 1
+        while stop < n - 1 and pairs + n - stop - 1 <= tile_pairs:
+            pairs += n - stop - 1
+            stop += 1
+        runs.append((start, stop))
+        start = stop
+    return runs
+
+
+def tile_indices(n: int, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+    """Get the (i, j) indices of the pairs of rows start to stop, in condensed order."""
+    # row r of the tile is point start + r against points start + 1 onwards, keep the
+    # columns after the diagonal
+    rows, cols = np.triu_indices(stop - start, m=n - start - 1)
+    return rows + start, cols + start + 1
+
+
+def tile_distances(lat: np.ndarray, lon: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Get the km of the pairs of rows start to stop, in condensed order."""
+    km = haversine_matrix(lat[start:stop], lon[start:stop], lat[start + 1 :], lon[start + 1 :])
+    return km[np.triu_indices(stop - start, m=len(lat) - start - 1)]
+
+
+def pairwise_blocks(
+    lat: np.ndarray, lon: np.ndarray, tile_pairs: int = TILE_PAIRS
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (i, j, km) arrays for every pair i < j of the points, a tile at a time.
+
+    Pairs come in the order of the condensed distance matrix: by i, then by j.
+    """
+    for start, stop in tiles(len(lat), tile_pairs):
+        yield *tile_indices(len(lat), start, stop), tile_distances(lat, lon, start, stop)
+
+
+_points: tuple[np.ndarray, np.ndarray] | None = None
+
+
+def _init_worker(lat: np.ndarray, lon: np.ndarray):
+    """Keep the points in the worker process, so each tile sends only its bounds."""
+    global _points  # noqa PLW0603
+    _points = (lat, lon)
+
+
+def _measure_tile(tile: tuple[int, int]) -> np.ndarray:
+    """Get the km of the tile's pairs in a worker process."""
+    return tile_distances(*_points, *tile)
+
+
+def measure_tiles(
+    lat: np.ndarray, lon: np.ndarray, workers: int = 1, tile_pairs: int = TILE_PAIRS
+) -> Iterator[tuple[int, int, np.ndarray]]:
+    """Yield (start, stop, km) for each tile in order, measured by worker processes.
+
+    A few tiles per worker are in flight at a time, so a slow consumer holds back the
+    workers instead of piling up results in memory.
+    """
+    runs = tiles(len(lat), tile_pairs)
+    if workers <= 1:
+        for start, stop in runs:
+            yield start, stop, tile_distances(lat, lon, start, stop)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(lat, lon)) as pool:
+        pending = deque()
+        for run in runs:
+            pending.append((run, pool.submit(_measure_tile, run)))
+            if len(pending) >= workers * TILES_AHEAD:
+                (start, stop), future = pending.popleft()
+                yield start, stop, future.result()
+        while pending:
+            (start, stop), future = pending.popleft()
+            yield start, stop, future.result()
+
+
+def grid_cells(lat: np.ndarray, lon: np.ndarray, max_km: float) -> dict[tuple, np.ndarray]:
+    """Bucket the points into cells at least max_km across, keyed by (row, column).
+
+    Any two points within max_km of each other are then in the same or adjacent cells.
+    """
+    lat_size = degrees(max_km / EARTH_RADIUS_KM)
+    # a degree of longitude is shortest furthest from the equator, and the great circle
+    # between two points is shorter than the parallel, so bound it with the haversine
+    widest = cos(radians(min(float(np.abs(lat).max()), 89.9)))
+    ratio = sin(max_km / EARTH_RADIUS_KM / 2) / widest
+    lon_size = degrees(2 * asin(ratio)) if ratio < 1 else 360.0
+    return group_cells(np.stack([np.floor(lat / lat_size), np.floor(lon / lon_size)], axis=1))
+
+
+def group_cells(keys: np.ndarray) -> dict[tuple, np.ndarray]:
+    """Get the indices of the rows of each distinct cell key."""
+    if not len(keys):
+        return {}
+    unique, inverse = np.unique(keys.astype(np.int64), axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(unique)))[:-1]
+    return {
+        tuple(key): members
+        for key, members in zip(unique.tolist(), np.split(order, bounds), strict=True)
+    }
+
+
+def nearby_pairs(
+    lat: np.ndarray, lon: np.ndarray, max_km: float
+) -> Iterator[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (points, i, j, km) for the pairs i < j within max_km, a grid cell at a time.
+
+    Each cell's points are measured against the points of the cell and the eight around
+    it. points is the number of points in the cell, for reporting progress. Longitudes
+    are not wrapped, pairs across the antimeridian are missed.
+    """
+    if not len(lat):
+        return
+    cells = grid_cells(lat, lon, max_km)
+    for (row, col), members in cells.items():
+        neighbours = np.concatenate(
+            [
+                cells[(row + d_row, col + d_col)]
+                for d_row in (-1, 0, 1)
+                for d_col in (-1, 0, 1)
+                if (row + d_row, col + d_col) in cells
+            ]
+        )
+        km = haversine_matrix(lat[members], lon[members], lat[neighbours], lon[neighbours])
+        i, j = np.meshgrid(members, neighbours, indexing='ij')
+        near = (i < j) & (km <= max_km)
+        yield len(members), i[near], j[near], km[near]
+
+
+def unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Get the points as (x, y, z) on the unit sphere."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+class SpatialIndex:
+    """Points bucketed into a grid of cubes over their unit vectors.
+
+    The straight line between two unit vectors, the chord, grows with the great circle
+    distance, so a radius query only looks at the cubes around the chord radius, and
+    there is no seam at the antimeridian or the poles.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_km: float = INDEX_CELL_KM):
+        """Index the points."""
+        self.vectors = unit_vectors(np.asarray(lat, float), np.asarray(lon, float))
+        self.cell = self.chord(cell_km)
+        self.cells = group_cells(np.floor(self.vectors / self.cell))
+
+    def __len__(self) -> int:
+        """Get the number of points."""
+        return len(self.vectors)
+
+    @staticmethod
+    def chord(km: float) -> float:
+        """Get the chord of the unit sphere spanning km of great circle."""
+        return 2 * sin(min(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+    def candidates(self, vector: np.ndarray, radius: float) -> np.ndarray:
+        """Get the points in the cubes overlapping the sphere of radius around the vector."""
+        low = np.floor((vector - radius) / self.cell).astype(np.int64)
+        high = np.floor((vector + radius) / self.cell).astype(np.int64)
+        if np.prod(high - low + 1) > len(self.cells):
+            return np.arange(len(self))
+        members = [
+            self.cells[key]
+            for key in product(*(range(a, b + 1) for a, b in zip(low, high, strict=True)))
+            if key in self.cells
+        ]
+        return np.concatenate(members) if members else np.empty(0, dtype=np.int64)
+
+    def measure(self, vector: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """Get the chords from the vector to the points."""
+        return np.linalg.norm(self.vectors[indices] - vector, axis=1)
+
+    @staticmethod
+    def to_km(chords: np.ndarray) -> np.ndarray:
+        """Get the great circle km spanned by the chords."""
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chords / 2, 0, 1))
+
+    def within(self, lat: float, lon: float, km: float) -> tuple[np.ndarray, np.ndarray]:
+        """Get the (indices, km) of the points within km of a point, nearest first."""
+        vector = unit_vectors(np.array(lat, float), np.array(lon, float))
+        radius = self.chord(km)
+        indices = self.candidates(vector, radius)
+        chords = self.measure(vector, indices)
+        near = chords <= radius
+        indices, chords = indices[near], chords[near]
+        order = np.argsort(chords, kind='stable')
+        return indices[order], self.to_km(chords[order])
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """Get the (indices, km) of the k points nearest to a point, nearest first."""
+        vector = unit_vectors(np.array(lat, float), np.array(lon, float))
+        k = min(k, len(self))
+        if k < 1:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        # widen the search until the k nearest candidates are inside the searched sphere,
+        # any point outside the candidates is then further away
+        radius = self.cell
+        while True:
+            indices = self.candidates(vector, radius)
+            chords = self.measure(vector, indices)
+            if len(indices) == len(self) or (
+                len(indices) >= k and np.partition(chords, k - 1)[k - 1] <= radius
+            ):
+                break
+            radius *= 2
+        order = np.argsort(chords, kind='stable')[:k]
+        return indices[order], self.to_km(chords[order])
+
+
+def condensed_distances(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Get the km of every pair i < j as a condensed matrix, like scipy's pdist."""
+    blocks = [km for _, _, km in pairwise_blocks(lat, lon)]
+    return np.concatenate(blocks) if blocks else np.empty(0)
+
+
+def condensed_index(i: np.ndarray, j: np.ndarray, n: int) -> np.ndarray:
+    """Get the position of each pair i < j of n points in the condensed matrix."""
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+class PairBitmap:
+    """One bit per pair i < j of n points, in condensed matrix order."""
+
+    def __init__(self, n: int):
+        """Start with no pair marked."""
+        self.n = n
+        self.bits = np.zeros((n * (n - 1) // 2 + 7) // 8, dtype=np.uint8)
+
+    def add(self, i: np.ndarray, j: np.ndarray):
+        """Mark the pairs."""
+        index = condensed_index(np.asarray(i, np.int64), np.asarray(j, np.int64), self.n)
+        np.bitwise_or.at(self.bits, index >> 3, (1 << (index & 7)).astype(np.uint8))
+
+    def contains(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        """Get whether each pair is marked."""
+        index = condensed_index(np.asarray(i, np.int64), np.asarray(j, np.int64), self.n)
+        return ((self.bits[index >> 3] >> (index & 7)) & 1).astype(bool)
+
+    def count(self) -> int:
+        """Get the number of pairs marked."""
+        return int(POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def slice(self, start: int, count: int) -> np.ndarray:
+        """Get whether each of count pairs from position start is marked."""
+        first = start >> 3
+        bits = np.unpackbits(self.bits[first : (start + count + 7) >> 3], bitorder='little')
+        offset = start - (first << 3)
+        return bits[offset : offset + count].astype(bool)
@@ -0,0 +1,298 @@
+"""Concurrent OpenCage lookups of the postcodes not looked up yet.
+
+The codes still missing are worked out with one query up front, then requested from a
+few threads sharing a requests per second budget. A 429 pushes the whole budget back by
+the Retry-After, a 402 means the day's quota is spent and ends the run, any other error
+only fails its code. Every response, with or without a result, is kept in the
+GeocodeCache table by query, so a code is only ever asked for once and the choice of
+result can be made again offline.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import requests
+from django.db import transaction
+from retry import retry
+
+from main.constants import COUNTRY_ZA
+from main.metrics import Metrics
+from main.models import GeocodeCache, Postcode
+from main.selectors import invalidate_postcode_index
+
+logger = logging.getLogger(__name__)
+
+OPENCAGE_URL = 'https://api.opencagedata.com/geocode/v1/json'
+FIRST_CODE, LAST_CODE = 1, 9_998
+REQUESTS_AHEAD = 2  # requests in flight per worker
+WRITE_BATCH_SIZE = 100
+CACHE_READ_SIZE = 500  # queries looked up in the cache at a time
+# the most specific component of a result names the area
+LEVELS = [
+    'suburb',
+    'neighbourhood',
+    'town',
+    'village',
+    'city_district',
+    'city',
+    'municipality',
+    'county',
+    'state_district',
+    'state',
+    'region',
+    'province',
+    'country',
+]
+UPDATE_FIELDS = ['area', 'level', 'latitude', 'longitude', 'opencage', 'updated_at']
+
+_local = threading.local()
+
+
+class RetryLookupError(Exception):
+    """Error indicating to retry the lookup."""
+
+
+class QuotaExceededError(Exception):
+    """The requests quota of the key is spent."""
+
+
+class RateLimiter:
+    """Space out calls from any thread to at most rate a second."""
+
+    def __init__(self, rate: float):
+        """Allow the first call straight away."""
+        self.interval = 1 / rate
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Sleep until this call's slot."""
+        with self.lock:
+            at = max(time.monotonic(), self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(max(at - time.monotonic(), 0))
+
+    def pause(self, seconds: float):
+        """Hold back every call for a while."""
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+def latlng_precision(result: dict) -> int:
+    """Count the decimals of a result's position, more is a more exact match."""
+    try:
+        lat = result['geometry']['lat']
+        lng = result['geometry']['lng']
+        lat_prec = len(str(lat).split('.')[1]) if '.' in str(lat) else 0
+        lng_prec = len(str(lng).split('.')[1]) if '.' in str(lng) else 0
+        return lat_prec + lng_prec
+    except Exception:
+        return 0
+
+
+def pick_result(data: dict) -> tuple[float, float, str, str] | None:
+    """Get (latitude, longitude, area, level) of the most exact postcode result."""
+    results = [
+        r for r in data.get('results', []) if r.get('components', {}).get('_type') == 'postcode'
+    ]
+    if not results:
+        return None
+    result = max(results, key=latlng_precision)
+    geometry = result.get('geometry', {})
+    lat, lng = geometry.get('lat'), geometry.get('lng')
+    if lat is None or lng is None:
+        return None
+    components = result.get('components', {})
+    level = next((level for level in LEVELS if components.get(level)), '')
+    return lat, lng, components.get(level, ''), level
+
+
+def query_for(code: int) -> str:
+    """Get the geocoder query of a code."""
+    return f'{code:04d}, south africa'
+
+
+def missing_codes(
+    first: int = FIRST_CODE, last: int = LAST_CODE, country: str = COUNTRY_ZA
+) -> list[int]:
+    """Get the codes in the range not looked up yet, in one query."""
+    done = set(
+        Postcode.objects.filter(
+            country=country, opencage=True, code__range=(first, last)
+        ).values_list('code', flat=True)
+    )
+    return [code for code in range(first, last + 1) if code not in done]
+
+
+def cached_responses(queries: Iterable[str]) -> dict[str, dict]:
+    """Get the cached responses of the queries that have one."""
+    return dict(
+        GeocodeCache.objects.filter(query__in=list(queries)).values_list('query', 'response')
+    )
+
+
+def session() -> requests.Session:
+    """Get this thread's session, reusing its connections."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+@retry((RetryLookupError,), tries=5, delay=1, backoff=2, jitter=(0, 1))
+def lookup(code: int, key: str, url: str, limiter: RateLimiter) -> dict:
+    """Request the results for a code within the budget, with backoff."""
+    limiter.wait()
+    params = {
+        'q': query_for(code),
+        'key': key,
+        'language': 'en',
+        'no_annotations': 1,
+        'pretty': 0,
+    }
+    try:
+        res = session().get(url, params=params, timeout=10)
+    except requests.RequestException as exc:
+        logger.warning(f'Connection error for {code:04d}! {exc}')
+        raise RetryLookupError() from exc
+    if res.status_code == requests.codes.payment_required:
+        raise QuotaExceededError(f'Quota spent at {code:04d}')
+    if res.status_code == requests.codes.too_many:
+        retry_after = float(res.headers.get('Retry-After', 1))
+        logger.warning(f'Too many requests at {code:04d}, pausing {retry_after}s')
+        limiter.pause(retry_after)
+        raise RetryLookupError()
+    if res.status_code >= requests.codes.server_error:
+        logger.warning(f'Server error for {code:04d}!')
+        raise RetryLookupError()
+    res.raise_for_status()
+    return res.json()
+
+
+def save_results(results: dict[int, tuple], responses: dict[str, dict], country: str = COUNTRY_ZA):
+    """Upsert the looked up postcodes and cache the responses in one transaction."""
+    postcodes = [
+        Postcode(
+            country=country,
+            code=code,
+            latitude=lat,
+            longitude=lng,
+            area=area,
+            level=level,
+            opencage=True,
+        )
+        for code, (lat, lng, area, level) in results.items()
+    ]
+    cached = [GeocodeCache(query=query, response=data) for query, data in responses.items()]
+    with transaction.atomic():
+        Postcode.objects.bulk_create(
+            postcodes,
+            update_conflicts=True,
+            unique_fields=['country', 'code'],
+            update_fields=UPDATE_FIELDS,
+        )
+        GeocodeCache.objects.bulk_create(
+            cached,
+            update_conflicts=True,
+            unique_fields=['query'],
+            update_fields=['response', 'updated_at'],
+        )
+
+
+class Batch:
+    """Results and fresh responses waiting to be written."""
+
+    def __init__(self, metrics: Metrics, size: int = WRITE_BATCH_SIZE):
+        """Start empty."""
+        self.metrics = metrics
+        self.size = size
+        self.results = {}
+        self.responses = {}
+
+    def take(self, code: int, data: dict, fresh: bool = False) -> tuple | None:
+        """Pick the result of a response, writing the batch once full."""
+        if fresh:
+            self.responses[query_for(code)] = data
+        result = pick_result(data)
+        if result:
+            self.results[code] = result
+        else:
+            self.metrics.count('empty')
+        if len(self.results) >= self.size or len(self.responses) >= self.size:
+            self.flush()
+        return result
+
+    def flush(self):
+        """Write the results and cache the responses."""
+        with self.metrics.stage('write'):
+            save_results(self.results, self.responses)
+        self.metrics.count('written', len(self.results))
+        self.results.clear()
+        self.responses.clear()
+
+
+def lookup_postcodes(
+    codes: Iterable[int],
+    key: str | None,
+    url: str = OPENCAGE_URL,
+    rate: float = 1,
+    workers: int = 4,
+    batch_size: int = WRITE_BATCH_SIZE,
+    offline: bool = False,
+    retry_empty: bool = False,
+) -> Metrics:
+    """Look up the codes, from the cache or concurrently, and store the results in batches.
+
+    Offline only the cached responses are used. With retry_empty the cached responses
+    without a result are asked for again.
+    """
+    metrics = Metrics('opencage')
+    limiter = RateLimiter(rate)
+    batch = Batch(metrics, batch_size)
+
+    def receive(code: int, future):
+        try:
+            data = future.result()
+        except (RetryLookupError, requests.RequestException) as exc:
+            # given up on after the retries, or refused, asked for again on the next run
+            logger.warning(f'Lookup of {code:04d} failed: {exc!r}')
+            metrics.count('failed')
+            return
+        metrics.count('requested')
+        if result := batch.take(code, data, fresh=True):
+            logger.info(f'Found postcode {code:04d} {result[2]} at {result[0]},{result[1]}')
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        remaining = iter(codes)
+        try:
+            while chunk := list(islice(remaining, CACHE_READ_SIZE)):
+                with metrics.stage('cache'):
+                    cached = cached_responses(query_for(code) for code in chunk)
+                for code in chunk:
+                    data = cached.get(query_for(code))
+                    if data is not None and not (retry_empty and pick_result(data) is None):
+                        metrics.count('cached')
+                        batch.take(code, data)
+                    elif offline:
+                        metrics.count('uncached')
+                    else:
+                        pending.append((code, pool.submit(lookup, code, key, url, limiter)))
+                        if len(pending) >= workers * REQUESTS_AHEAD:
+                            receive(*pending.popleft())
+            while pending:
+                receive(*pending.popleft())
+        except QuotaExceededError as exc:
+            logger.warning(f'{exc}, stopping')
+            metrics.count('quota_spent')
+        finally:
+            for _, future in pending:
+                future.cancel()
+            batch.flush()
+    # bulk upserts send no signals
+    invalidate_postcode_index()
+    return metrics
@@ -0,0 +1,139 @@
+"""Streaming import of GeoNames postal code dumps.
+
+The dumps from https://download.geonames.org/export/zip/ are tab separated lines of
+country, postal code, place name, three levels of admin name and code, latitude,
+longitude and accuracy, as a plain .txt or a .zip of one. They are read a chunk of lines
+at a time and each chunk is upserted in its own transaction, so memory stays bounded
+however large the dump.
+
+Postcode codes are integers, so the countries whose postal codes have letters, spaces or
+dashes cannot be imported: asking for one is an error, and a whole dump leaves them out.
+"""
+
+import io
+import logging
+import zipfile
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+from main.ingest import upsert_postcodes
+from main.metrics import Metrics
+from main.selectors import invalidate_postcode_index
+
+logger = logging.getLogger(__name__)
+
+CHUNK_LINES = 50_000
+COUNTRY, CODE, PLACE, LATITUDE, LONGITUDE = 0, 1, 2, 9, 10
+# the accuracy column is empty on some lines
+MIN_COLUMNS = LONGITUDE + 1
+# countries of the dumps whose postal codes are not plain numbers, e.g. GB 'SW1A', NL
+# '1011 AB', CA 'T0A', BR '01000-000'
+NON_NUMERIC_COUNTRIES = frozenset(
+    'AD BR CA CZ GB GG GR IE IM JE JP LV MD MT NL PL PT SE SK'.split()
+)
+
+
+class UnsupportedCountryError(ValueError):
+    """Countries asked for whose postal codes do not fit Postcode.code."""
+
+
+@contextmanager
+def open_dump(path: Path) -> Iterator[Iterable[str]]:
+    """Open a dump as lines of text, from the .txt inside it when zipped."""
+    if not zipfile.is_zipfile(path):
+        with path.open(encoding='utf-8', newline='') as lines:
+            yield lines
+        return
+    with zipfile.ZipFile(path) as archive:
+        # the country zips hold a readme.txt beside the data
+        names = [name for name in archive.namelist() if name.endswith('.txt')]
+        name = next((name for name in names if name != 'readme.txt'), None)
+        if name is None:
+            raise ValueError(f'No GeoNames .txt in {path}')
+        with archive.open(name) as raw:
+            yield io.TextIOWrapper(raw, encoding='utf-8', newline='')
+
+
+def parse_lines(
+    lines: list[str], countries: set[str] | None, metrics: Metrics
+) -> dict[tuple[str, int], tuple[str, int, str, float, float]]:
+    """Parse the lines into postcode rows by (country, code), the last line of a code wins.
+
+    Rows are (country, code, area, latitude, longitude) as upsert_postcodes takes them.
+    """
+    postcodes = {}
+    for line in lines:
+        # the country comes first, drop the lines of other countries before splitting
+        country = line[: line.find('\t')]
+        if countries and country not in countries:
+            metrics.count('filtered')
+            continue
+        if country in NON_NUMERIC_COUNTRIES:
+            metrics.count('unsupported')
+            continue
+        parts = line.rstrip('\r\n').split('\t')
+        if len(parts) < MIN_COLUMNS:
+            logger.warning(f'Malformed line: {line.strip()}')
+            metrics.count('malformed')
+            continue
+        code = parts[CODE]
+        if not code.isdigit():
+            metrics.count('non_numeric')
+            continue
+        try:
+            latitude, longitude = float(parts[LATITUDE]), float(parts[LONGITUDE])
+        except ValueError:
+            logger.warning(f'Malformed line: {line.strip()}')
+            metrics.count('malformed')
+            continue
+        key = (parts[COUNTRY], int(code))
+        if key in postcodes:
+            metrics.count('duplicates')
+        postcodes[key] = (*key, parts[PLACE], latitude, longitude)
+    return postcodes
+
+
+def import_geonames(
+    path: Path,
+    countries: Iterable[str] | None = None,
+    chunk_lines: int = CHUNK_LINES,
+    using: str = 'default',
+) -> Metrics:
+    """Upsert the postcodes of a dump, of the countries if given, a chunk at a time.
+
+    Raises UnsupportedCountryError for countries in NON_NUMERIC_COUNTRIES.
+    """
+    countries = {country.upper() for country in countries} if countries else None
+    if countries and (unsupported := countries & NON_NUMERIC_COUNTRIES):
+        raise UnsupportedCountryError(
+            f'Cannot import {", ".join(sorted(unsupported))}, their postal codes are not '
+            'numbers and Postcode.code only holds numbers'
+        )
+    if not countries:
+        logger.info(
+            f'Leaving out {", ".join(sorted(NON_NUMERIC_COUNTRIES))}, '
+            'their postal codes are not numbers'
+        )
+    metrics = Metrics('geonames')
+    with open_dump(Path(path)) as lines:
+        while True:
+            with metrics.stage('read'):
+                chunk = list(islice(lines, chunk_lines))
+            if not chunk:
+                break
+            metrics.count('lines', len(chunk))
+            with metrics.stage('parse'):
+                postcodes = parse_lines(chunk, countries, metrics)
+            with metrics.stage('upsert'):
+                metrics.count('imported', upsert_postcodes(postcodes.values(), using))
+            logger.info(
+                f'Read {metrics.counters["lines"]:,} lines, '
+                f'imported {metrics.counters["imported"]:,} postcodes'
+            )
+    if skipped := metrics.counters['non_numeric']:
+        logger.warning(f'Skipped {skipped:,} postal codes that are not numbers')
+    # bulk upserts send no signals
+    invalidate_postcode_index()
+    return metrics
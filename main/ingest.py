@@ -0,0 +1,192 @@
+"""Bulk writes of scraped torrents, imported postcodes and computed distances.
+
+On postgres the rows are copied into a temporary staging table and merged with one
+INSERT ... ON CONFLICT, on sqlite the ORM's bulk upsert does the same in batches.
+Postcodes and distances, being many narrow rows, skip the ORM on sqlite and go through
+executemany.
+"""
+
+import logging
+from collections.abc import Iterable
+from uuid import uuid4
+
+from django.db import connections, transaction
+from django.utils.timezone import now
+
+from main.models import Distance, Postcode, Torrent
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = 500
+TORRENT_FIELDS = (
+    'site',
+    'category',
+    'subcategory',
+    'name',
+    'url',
+    'seeders',
+    'leechers',
+    'uploaded_at',
+    'size',
+    'uploader',
+)
+# refreshed when a scraped torrent is already known
+TORRENT_UPDATE_FIELDS = ('site', 'seeders', 'leechers', 'updated_at')
+POSTCODE_FIELDS = ('country', 'code', 'area', 'latitude', 'longitude')
+# refreshed when an imported postcode is already known, the level comes from opencagelookup
+POSTCODE_UPDATE_FIELDS = ('area', 'latitude', 'longitude', 'updated_at')
+DISTANCE_FIELDS = ('postcode_a', 'postcode_b', 'km')
+
+
+def copy_merge(
+    using: str, model, fields: Iterable[str], rows: Iterable[tuple], merge_sql: str
+) -> int:
+    """Copy rows into a staging table shaped like the model's columns and merge them.
+
+    The merge statement selects from the staging table as ``{staging}``. Each call gets a
+    table of its own, so calls within one open transaction never see each other's rows.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(name).column) for name in fields
+    )
+    staging = f'staging_{uuid4().hex}'
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS '  # noqa S608
+            f'SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        with cursor.cursor.copy(f'COPY {staging} ({columns}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+        cursor.execute(merge_sql.format(table=table, columns=columns, staging=staging))
+        count = cursor.rowcount
+        # dropped on commit too, but the caller's transaction may run many merges first
+        cursor.execute(f'DROP TABLE {staging}')
+        return count
+
+
+def upsert_torrents(items: list[dict], using: str = 'default') -> int:
+    """Insert new torrents and refresh the seeders and leechers of known ones.
+
+    Items are the scraped dicts including the site, the last one wins for a repeated url.
+    Returns the number of rows inserted or updated.
+    """
+    torrents = [Torrent(**item) for item in {item['url']: item for item in items}.values()]
+    if not torrents:
+        return 0
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        Torrent.objects.using(using).bulk_create(
+            torrents,
+            batch_size=INGEST_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['url'],
+            update_fields=TORRENT_UPDATE_FIELDS,
+        )
+        return len(torrents)
+
+    fields = [Torrent._meta.get_field(name) for name in TORRENT_FIELDS]
+    rows = (
+        tuple(
+            field.get_db_prep_save(getattr(torrent, field.attname), connection) for field in fields
+        )
+        for torrent in torrents
+    )
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in TORRENT_UPDATE_FIELDS)
+    merge_sql = (
+        'INSERT INTO {table} ({columns}, created_at, updated_at) '  # noqa S608
+        'SELECT {columns}, now(), now() FROM {staging} '
+        f'ON CONFLICT (url) DO UPDATE SET {updates}'
+    )
+    return copy_merge(using, Torrent, TORRENT_FIELDS, rows, merge_sql)
+
+
+def upsert_postcodes(
+    rows: Iterable[tuple[str, int, str, float, float]], using: str = 'default'
+) -> int:
+    """Insert new postcodes and refresh the area and position of known ones.
+
+    Rows are (country, code, area, latitude, longitude), the last one wins for a repeated
+    postcode. Returns the number of rows inserted or updated.
+    """
+    rows = list({(row[0], row[1]): row for row in rows}.values())
+    if not rows:
+        return 0
+
+    connection = connections[using]
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in POSTCODE_UPDATE_FIELDS)
+    if connection.vendor == 'sqlite':
+        table = connection.ops.quote_name(Postcode._meta.db_table)
+        timestamp = connection.ops.adapt_datetimefield_value(now())
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} '  # noqa S608
+                f'({", ".join(POSTCODE_FIELDS)}, level, opencage, created_at, updated_at) '
+                "VALUES (%s, %s, %s, %s, %s, '', false, %s, %s) "
+                f'ON CONFLICT (country, code) DO UPDATE SET {updates}',
+                [(*row, timestamp, timestamp) for row in rows],
+            )
+        return len(rows)
+
+    if connection.vendor != 'postgresql':
+        Postcode.objects.using(using).bulk_create(
+            [Postcode(**dict(zip(POSTCODE_FIELDS, row, strict=True))) for row in rows],
+            batch_size=INGEST_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['country', 'code'],
+            update_fields=POSTCODE_UPDATE_FIELDS,
+        )
+        return len(rows)
+
+    merge_sql = (
+        'INSERT INTO {table} ({columns}, level, opencage, created_at, updated_at) '  # noqa S608
+        "SELECT {columns}, '', false, now(), now() FROM {staging} "
+        f'ON CONFLICT (country, code) DO UPDATE SET {updates}'
+    )
+    return copy_merge(using, Postcode, POSTCODE_FIELDS, rows, merge_sql)
+
+
+def insert_distances(rows: Iterable[tuple[int, int, float]], using: str = 'default') -> int:
+    """Insert (postcode a id, postcode b id, km) rows, skipping pairs already stored.
+
+    Pairs are stored with the lower id first. Returns the number of rows inserted.
+    """
+    rows = [(a, b, km) if a < b else (b, a, km) for a, b, km in rows]
+    if not rows:
+        return 0
+
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        # building a model per row costs more than the insert itself
+        table = connection.ops.quote_name(Distance._meta.db_table)
+        timestamp = connection.ops.adapt_datetimefield_value(now())
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} '  # noqa S608
+                '(postcode_a_id, postcode_b_id, km, created_at, updated_at) '
+                'VALUES (%s, %s, %s, %s, %s) ON CONFLICT DO NOTHING',
+                [(a, b, km, timestamp, timestamp) for a, b, km in rows],
+            )
+            # the changes of every row, the skipped ones change nothing
+            return cursor.rowcount
+
+    if connection.vendor != 'postgresql':
+        # bulk_create cannot tell which rows it skipped
+        distances = Distance.objects.using(using)
+        before = distances.count()
+        distances.bulk_create(
+            [Distance(postcode_a_id=a, postcode_b_id=b, km=km) for a, b, km in rows],
+            batch_size=INGEST_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        return distances.count() - before
+
+    merge_sql = (
+        'INSERT INTO {table} ({columns}, created_at, updated_at) '
+        'SELECT {columns}, now(), now() FROM {staging} '
+        'ON CONFLICT (postcode_a_id, postcode_b_id) DO NOTHING'
+    )
+    return copy_merge(using, Distance, DISTANCE_FIELDS, rows, merge_sql)
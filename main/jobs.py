@@ -0,0 +1,149 @@
+"""Database backed queue for the long running scrape, stats and prune work.
+
+Jobs are queued from the admin or the views and run by ``manage.py runworkers``.
+Each job reports progress through the usual (done, total) callback, which also raises
+JobCancelledError once a cancel was requested, so jobs stop at their next chunk boundary.
+"""
+
+import logging
+import os
+import socket
+import time
+import traceback
+from collections.abc import Callable
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.utils.timezone import now
+
+from main.constants import (
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_FINISHED,
+    JOB_PRUNE,
+    JOB_QUEUED,
+    JOB_REFRESH_STATS,
+    JOB_RUNNING,
+    JOB_SCRAPE,
+)
+from main.models import Job, Title
+from main.services import Progress, prune, refresh_title_stats, scrape
+
+logger = logging.getLogger(__name__)
+
+JOBS: dict[str, Callable[[Progress], object]] = {
+    JOB_SCRAPE: scrape,
+    JOB_REFRESH_STATS: lambda progress: refresh_title_stats(Title.objects.all(), progress),
+    JOB_PRUNE: lambda progress: prune(progress=progress),
+}
+PROGRESS_INTERVAL = 1  # seconds between progress writes
+POLL_INTERVAL = 2
+STALE_AFTER = timedelta(hours=1)
+ACTIVE_STATUSES = [JOB_QUEUED, JOB_RUNNING]
+
+
+class JobCancelledError(Exception):
+    """Raised in a running job when it was cancelled."""
+
+
+def enqueue(name: str) -> Job:
+    """Queue a job, or return the same job when it is already queued or running.
+
+    When two requests race past the check, the unique_active_job constraint lets only
+    one of them create the job and the other returns it.
+    """
+    if name not in JOBS:
+        raise ValueError(f'Unknown job {name}')
+    active = Job.objects.filter(name=name, status__in=ACTIVE_STATUSES).first()
+    if active:
+        return active
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(name=name)
+    except IntegrityError:
+        # queued by another request since the check, or already finished again
+        return Job.objects.filter(name=name, status__in=ACTIVE_STATUSES).first() or enqueue(name)
+    logger.info(f'Queued {job}')
+    return job
+
+
+def cancel_jobs(queryset: QuerySet) -> int:
+    """Cancel queued jobs and ask running ones to stop, returning the number of jobs."""
+    queued = queryset.filter(status=JOB_QUEUED).update(
+        status=JOB_CANCELLED, finished_at=now(), updated_at=now()
+    )
+    running = queryset.filter(status=JOB_RUNNING).update(cancel_requested=True, updated_at=now())
+    return queued + running
+
+
+def fail_stale_jobs() -> int:
+    """Fail running jobs that have not reported progress for a while, their worker died."""
+    return Job.objects.filter(status=JOB_RUNNING, updated_at__lt=now() - STALE_AFTER).update(
+        status=JOB_FAILED, error='Worker stopped responding', finished_at=now(), updated_at=now()
+    )
+
+
+def claim_next(worker: str) -> Job | None:
+    """Take the oldest queued job.
+
+    The status is flipped with a conditional UPDATE, so when two workers race for the
+    same job only one of them changes the row.
+    """
+    queued = Job.objects.filter(status=JOB_QUEUED).order_by('created_at')
+    for pk in queued.values_list('pk', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=pk, status=JOB_QUEUED).update(
+            status=JOB_RUNNING, worker=worker, started_at=now(), updated_at=now()
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job: Job):
+    """Run a claimed job and record how it ended."""
+    last_write = 0
+
+    def progress(done: int, total: int):
+        nonlocal last_write
+        job.progress_done, job.progress_total = done, total
+        if time.monotonic() - last_write < PROGRESS_INTERVAL and done < total:
+            return
+        last_write = time.monotonic()
+        Job.objects.filter(pk=job.pk).update(
+            progress_done=done, progress_total=total, updated_at=now()
+        )
+        if Job.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise JobCancelledError()
+
+    logger.info(f'Running {job}')
+    status, error = JOB_FINISHED, ''
+    try:
+        JOBS[job.name](progress)
+    except JobCancelledError:
+        status = JOB_CANCELLED
+    except Exception:
+        logger.exception(f'{job} failed')
+        status, error = JOB_FAILED, traceback.format_exc()
+    Job.objects.filter(pk=job.pk).update(
+        status=status,
+        error=error,
+        progress_done=job.progress_done,
+        progress_total=job.progress_total,
+        finished_at=now(),
+        updated_at=now(),
+    )
+    logger.info(f'Ran {job.name} job {job.pk}: {dict(Job.STATUS_CHOICES)[status]}')
+
+
+def work(stop: Callable[[], bool], poll_interval: float = POLL_INTERVAL):
+    """Run queued jobs one after the other until told to stop."""
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    logger.info(f'Worker {worker} started')
+    while not stop():
+        job = claim_next(worker)
+        if job:
+            run_job(job)
+        else:
+            time.sleep(poll_interval)
+    logger.info(f'Worker {worker} stopped')
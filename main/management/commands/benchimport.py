@@ -0,0 +1,67 @@
+import logging
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management import call_command
+from django.db import connections
+
+from main.constants import COUNTRY_ZA
+from main.geonames import CHUNK_LINES, import_geonames
+from main.profiling import ProfiledCommand
+from main.synthetic import SyntheticDataset
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ProfiledCommand):
+    help = 'Benchmark the GeoNames importer on a generated dump and a fresh database.'
+
+    def add_arguments(self, parser):
+        """Dump and import options."""
+        parser.add_argument('--lines', type=int, default=2_000_000, help='Lines in the dump')
+        parser.add_argument('--zip', action='store_true', help='Zip the dump')
+        parser.add_argument('--chunk-lines', type=int, default=CHUNK_LINES)
+        parser.add_argument('--country', default=COUNTRY_ZA, help='Country of the filtered import')
+
+    def handle(self, *args, **options):
+        """Import the dump whole and filtered to one country, each into a new database."""
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            suffix = '.zip' if options['zip'] else '.txt'
+            dump = SyntheticDataset().write_geonames(
+                Path(directory) / f'allCountries{suffix}', options['lines']
+            )
+            runs = {'all': None, options['country']: [options['country']]}
+            for name, countries in runs.items():
+                alias = f'bench_{name}'
+                connections.settings[alias] = {
+                    **connections.settings['default'],
+                    'NAME': Path(directory) / f'{name}.sqlite3',
+                }
+                try:
+                    call_command('migrate', database=alias, verbosity=0)
+                    logger.info(f'Importing {name}...')
+                    start = time.perf_counter()
+                    metrics = import_geonames(dump, countries, options['chunk_lines'], alias)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    connections[alias].close()
+                    del connections[alias]
+                    del connections.settings[alias]
+                logger.info(metrics.summary())
+                results[name] = {
+                    'lines/s': metrics.counters['lines'] / elapsed,
+                    'imported': metrics.counters['imported'],
+                    'seconds': elapsed,
+                    # high water mark of the whole process, on linux in kB
+                    'peak MB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                }
+
+        columns = list(next(iter(results.values())))
+        self.stdout.write(f'{"import":<10}' + ''.join(f'{col:>14}' for col in columns))
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<10}' + ''.join(f'{value:>14,.1f}' for value in result.values())
+            )
@@ -0,0 +1,160 @@
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management import call_command
+from django.db import OperationalError, connections, transaction
+
+from main.constants import CATEGORY_MOVIES, CATEGORY_TV_SHOWS
+from main.models import Torrent
+from main.profiling import ProfiledCommand
+from main.synthetic import SyntheticDataset, build_torrent
+
+logger = logging.getLogger(__name__)
+
+ENGINES = {
+    'default': 'django.db.backends.sqlite3',
+    'tuned': 'torrents.db.sqlite3',
+}
+
+
+class Bench:
+    """Concurrent writers and readers against one database alias."""
+
+    def __init__(self, alias: str, rows: int, batch_size: int):
+        """Set up the counters."""
+        self.alias = alias
+        self.rows = rows
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.lock_errors = 0
+        self.latencies = []
+        self.writing = threading.Event()
+        self.lock = threading.Lock()
+
+    def write(self, seed: int):
+        """Insert generated torrents in batches, one transaction per batch."""
+        dataset = SyntheticDataset(seed=seed)
+        batch = []
+        try:
+            for work in dataset.iter_works(self.rows):
+                for item in work.torrents:
+                    item['url'] = f'{item["url"]}/{seed}'
+                    batch.append(build_torrent(item))
+                if len(batch) >= self.batch_size:
+                    self.insert(batch)
+                    batch = []
+            if batch:
+                self.insert(batch)
+        finally:
+            connections[self.alias].close()
+
+    def insert(self, batch: list[Torrent]):
+        """Insert a batch, counting lock errors."""
+        try:
+            with transaction.atomic(using=self.alias):
+                Torrent.objects.using(self.alias).bulk_create(batch, ignore_conflicts=True)
+        except OperationalError as exc:
+            logger.debug(f'Write failed: {exc}')
+            with self.lock:
+                self.lock_errors += 1
+            return
+        with self.lock:
+            self.inserted += len(batch)
+
+    def read(self):
+        """Run the admin and dashboard queries until the writers are done."""
+        torrents = Torrent.objects.using(self.alias)
+        queries = [
+            lambda: torrents.filter(category=CATEGORY_TV_SHOWS).count(),
+            lambda: list(torrents.filter(category=CATEGORY_MOVIES).order_by('-seeders')[:100]),
+            lambda: list(torrents.order_by('-uploaded_at')[:100]),
+        ]
+        try:
+            while self.writing.is_set():
+                for query in queries:
+                    start = time.perf_counter()
+                    try:
+                        query()
+                    except OperationalError as exc:
+                        logger.debug(f'Read failed: {exc}')
+                        with self.lock:
+                            self.lock_errors += 1
+                        continue
+                    with self.lock:
+                        self.latencies.append(time.perf_counter() - start)
+        finally:
+            connections[self.alias].close()
+
+    def run(self, writers: int, readers: int) -> dict:
+        """Run the threads and summarise."""
+        self.writing.set()
+        reader_threads = [threading.Thread(target=self.read) for _ in range(readers)]
+        writer_threads = [
+            threading.Thread(target=self.write, args=(seed,)) for seed in range(writers)
+        ]
+        start = time.perf_counter()
+        for thread in reader_threads + writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        self.writing.clear()
+        for thread in reader_threads:
+            thread.join()
+
+        quantiles = (
+            statistics.quantiles(self.latencies, n=100) if len(self.latencies) > 1 else [0] * 99
+        )
+        return {
+            'rows/s': self.inserted / elapsed,
+            'reads': len(self.latencies),
+            'p50 ms': quantiles[49] * 1000,
+            'p95 ms': quantiles[94] * 1000,
+            'p99 ms': quantiles[98] * 1000,
+            'lock errors': self.lock_errors,
+        }
+
+
+class Command(ProfiledCommand):
+    help = 'Compare the default and the tuned sqlite backend under concurrent writes and reads.'
+
+    def add_arguments(self, parser):
+        """Load options."""
+        parser.add_argument('--rows', type=int, default=20_000, help='Rows per writer')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--readers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        """Benchmark each backend on a fresh database file."""
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name, engine in ENGINES.items():
+                alias = f'bench_{name}'
+                connections.settings[alias] = {
+                    **connections.settings['default'],
+                    'ENGINE': engine,
+                    'NAME': Path(directory) / f'{name}.sqlite3',
+                    'OPTIONS': {},
+                }
+                try:
+                    call_command('migrate', database=alias, verbosity=0)
+                    connections[alias].close()
+                    logger.info(f'Benchmarking {name} backend...')
+                    bench = Bench(alias, options['rows'], options['batch_size'])
+                    results[name] = bench.run(options['writers'], options['readers'])
+                finally:
+                    connections[alias].close()
+                    del connections[alias]
+                    del connections.settings[alias]
+
+        columns = list(next(iter(results.values())))
+        self.stdout.write(f'{"backend":<10}' + ''.join(f'{col:>14}' for col in columns))
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<10}' + ''.join(f'{value:>14,.1f}' for value in result.values())
+            )
@@ -0,0 +1,28 @@
+import logging
+
+from main.matrix import export_matrix, import_matrix
+from main.profiling import ProfiledCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ProfiledCommand):
+    help = 'Copy postcode distances between the Distance table and a distance matrix file.'
+
+    def add_arguments(self, parser):
+        """Direction and file options."""
+        parser.add_argument(
+            'direction',
+            choices=['export', 'import'],
+            help='export the table to the matrix, or import the matrix into the table',
+        )
+        parser.add_argument('--path', help='Matrix file, default DISTANCE_MATRIX_PATH')
+
+    def handle(self, *args, **options):
+        """Export or import."""
+        if options['direction'] == 'export':
+            matrix = export_matrix(options['path'])
+            logger.info(f'Wrote {matrix.km.filename}')
+        else:
+            import_matrix(options['path'])
+        logger.info('done')
@@ -0,0 +1,82 @@
+import logging
+import re
+
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count, Max, Min
+
+from main.constants import CATEGORY_MOVIES, CATEGORY_TV_SHOWS, STATUS_NEW, SUBCATEGORY_HD_TV
+from main.models import Title, Torrent
+from main.profiling import ProfiledCommand
+from main.search import check_search_indexes
+from main.selectors import list_old_tv, list_recent_games
+
+logger = logging.getLogger(__name__)
+
+# sqlite "SCAN main_torrent" without an index, postgres "Seq Scan on main_torrent"
+FULL_SCAN = re.compile(r'(\bSCAN (\w+)$|\bSCAN (\w+) \(|Seq Scan on (\w+))', re.MULTILINE)
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY|\bSort\b')
+
+
+def main_queries():
+    """Queries behind the selectors and the admin changelists, by name."""
+    title = Title.objects.order_by().values_list('text', flat=True).first() or ''
+    return {
+        'old tv': list_old_tv(),
+        'category counts': Torrent.objects.order_by().values('category').annotate(Count('id')),
+        'recent games': list_recent_games(),
+        'torrent admin': Torrent.objects.order_by('-seeders')[:100],
+        'torrent admin filtered': Torrent.objects.filter(
+            category=CATEGORY_TV_SHOWS, subcategory=SUBCATEGORY_HD_TV
+        ).order_by('-seeders')[:100],
+        'torrent admin by upload': Torrent.objects.order_by('-uploaded_at')[:100],
+        'untitled torrents': Torrent.objects.filter(title__isnull=True).order_by('-seeders')[:100],
+        'title last torrent': Torrent.objects.filter(title_id=title).order_by('-uploaded_at')[:1],
+        'title stats': Torrent.objects.filter(title_id=title)
+        .values('title')
+        .annotate(Min('uploaded_at'), Max('uploaded_at')),
+        'movies admin': Title.objects.filter(torrents__category=CATEGORY_MOVIES).annotate(
+            earliest=Min('torrents__uploaded_at')
+        )[:100],
+        'pc games what is next': Title.objects.filter(
+            status=STATUS_NEW, priority__gte=360
+        ).order_by('-priority')[:100],
+        'pc games ordering': Title.objects.order_by('-year', 'status')[:100],
+        'tv shows ordering': Title.objects.order_by('series', 'season', 'episode')[:100],
+    }
+
+
+class Command(ProfiledCommand):
+    help = 'Explain the main selector and admin queries and fail when one scans a whole table.'
+
+    def add_arguments(self, parser):
+        """Analyze option."""
+        parser.add_argument(
+            '--analyze', action='store_true', help='Refresh planner statistics first'
+        )
+
+    def handle(self, *args, **options):
+        """Explain each query and check it hits an index."""
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        if repaired := check_search_indexes():
+            self.stdout.write(f'Rebuilt the search indexes of {", ".join(repaired)}')
+
+        logger.info(f'Explaining queries over {Torrent.objects.count():,} torrents')
+        failed = []
+        for name, query in main_queries().items():
+            plan = query.explain()
+            scans = [m.group(0) for m in FULL_SCAN.finditer(plan)]
+            status = 'SCAN' if scans else 'ok'
+            if TEMP_SORT.search(plan):
+                status += ' (sorts)'
+            self.stdout.write(f'{name:<25} {status}')
+            self.stdout.write('    ' + plan.replace('\n', '\n    '))
+            if scans:
+                failed.append(name)
+
+        if failed:
+            raise CommandError(f'Queries scanning whole tables: {", ".join(failed)}')
+        logger.info('All queries use indexes')
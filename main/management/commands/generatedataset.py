@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.timezone import make_aware
+
+from main.profiling import ProfiledCommand
+from main.synthetic import SyntheticDataset
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ProfiledCommand):
+    help = 'Generate deterministic synthetic torrents, titles, postcodes and listing pages.'
+
+    def add_arguments(self, parser):
+        """Scale and output options."""
+        parser.add_argument('--torrents', type=int, default=10_000, help='1k to 10M torrents')
+        parser.add_argument('--postcodes', type=int, default=0, help='Number of postcodes')
+        parser.add_argument('--torrents-per-title', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--anchor', type=str, default=None, help='Newest upload date as YYYY-MM-DD'
+        )
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--pages', type=int, default=0, help='Listing pages per site')
+        parser.add_argument('--rows-per-page', type=int, default=50)
+        parser.add_argument(
+            '--html-dir',
+            type=str,
+            default=str(settings.BASE_DIR / 'synthetic'),
+            help='Where the <site>_files page directories go, the project directory to have '
+            'scrape_sites read them',
+        )
+        parser.add_argument('--skip-db', action='store_true', help='Only write listing pages')
+
+    def handle(self, *args, **options):
+        """Generate the dataset."""
+        anchor = options['anchor'] and make_aware(datetime.strptime(options['anchor'], '%Y-%m-%d'))
+        dataset = SyntheticDataset(
+            seed=options['seed'],
+            anchor=anchor,
+            torrents_per_title=options['torrents_per_title'],
+        )
+
+        if not options['skip_db']:
+            logger.info(f'Generating {options["torrents"]:,} torrents (seed {options["seed"]})...')
+            dataset.load_torrents(options['torrents'], batch_size=options['batch_size'])
+            if options['postcodes']:
+                dataset.load_postcodes(options['postcodes'], batch_size=options['batch_size'])
+
+        if options['pages']:
+            dataset.write_pages(
+                directory=Path(options['html_dir']),
+                torrents=options['torrents'],
+                pages=options['pages'],
+                rows_per_page=options['rows_per_page'],
+            )
+        logger.info('done')
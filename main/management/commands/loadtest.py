@@ -0,0 +1,87 @@
+import logging
+import statistics
+import threading
+import time
+
+import requests
+
+from main.profiling import ProfiledCommand
+
+logger = logging.getLogger(__name__)
+
+PATHS = ['/', '/api/titles/', '/api/torrents/']
+
+
+def hammer(url: str, concurrency: int, duration: float) -> dict:
+    """Request the url from concurrent clients for a while and summarise."""
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client():
+        nonlocal errors
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    ok = session.get(url, timeout=30).status_code == requests.codes.ok
+                except requests.RequestException:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if ok:
+                        latencies.append(elapsed)
+                    else:
+                        errors += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    return {
+        'requests': len(latencies),
+        'req/s': len(latencies) / elapsed,
+        'p50 ms': quantiles[49] * 1000,
+        'p95 ms': quantiles[94] * 1000,
+        'p99 ms': quantiles[98] * 1000,
+        'errors': errors,
+    }
+
+
+class Command(ProfiledCommand):
+    help = 'Load test the dashboard and the API on running servers, e.g. WSGI against ASGI.'
+
+    def add_arguments(self, parser):
+        """Target and load options."""
+        parser.add_argument(
+            '--url',
+            action='append',
+            required=True,
+            help='Base url of a running server, repeat to compare servers',
+        )
+        parser.add_argument('--path', action='append', help=f'Paths to request, default {PATHS}')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per path')
+
+    def handle(self, *args, **options):
+        """Load each path of each server in turn."""
+        results = {}
+        for base_url in options['url']:
+            for path in options['path'] or PATHS:
+                url = f'{base_url.rstrip("/")}{path}'
+                logger.info(f'Loading {url} with {options["concurrency"]} clients...')
+                results[url] = hammer(url, options['concurrency'], options['duration'])
+
+        columns = list(next(iter(results.values())))
+        width = max(len(url) for url in results) + 2
+        self.stdout.write(f'{"url":<{width}}' + ''.join(f'{col:>12}' for col in columns))
+        for url, result in results.items():
+            self.stdout.write(
+                f'{url:<{width}}' + ''.join(f'{value:>12,.1f}' for value in result.values())
+            )
@@ -0,0 +1,108 @@
+import json
+import logging
+import random
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from main.profiling import ProfiledCommand
+
+logger = logging.getLogger(__name__)
+
+# roughly the bounds of south africa
+LATITUDES = (-34.8, -22.1)
+LONGITUDES = (16.5, 32.9)
+
+
+def fake_response(query: str, empty: float) -> dict:
+    """Make an OpenCage response for a query, the same one every time."""
+    code = query.split(',')[0].strip()
+    rnd = random.Random(code)
+    if not code.isdigit() or rnd.random() < empty:
+        return {'results': [], 'status': {'code': 200, 'message': 'OK'}}
+    return {
+        'results': [
+            {
+                'components': {'_type': 'postcode', 'postcode': code, 'suburb': f'Suburb {code}'},
+                'geometry': {
+                    'lat': round(rnd.uniform(*LATITUDES), 7),
+                    'lng': round(rnd.uniform(*LONGITUDES), 7),
+                },
+            }
+        ],
+        'status': {'code': 200, 'message': 'OK'},
+    }
+
+
+def make_handler(rate: float, quota: int, latency: float, empty: float):
+    """Make a request handler answering over the rate with 429 and past the quota with 402."""
+    lock = threading.Lock()
+    window = {'second': 0, 'count': 0, 'total': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa N802
+            """Answer a geocode request."""
+            with lock:
+                second = int(time.monotonic())
+                if second != window['second']:
+                    window.update(second=second, count=0)
+                window['count'] += 1
+                window['total'] += 1
+                over_rate = window['count'] > rate
+                over_quota = quota and window['total'] > quota
+            time.sleep(latency)
+            if over_quota:
+                self.reply(HTTPStatus.PAYMENT_REQUIRED, {'status': {'code': 402}})
+            elif over_rate:
+                self.reply(HTTPStatus.TOO_MANY_REQUESTS, {'status': {'code': 429}}, retry_after=1)
+            else:
+                query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+                self.reply(HTTPStatus.OK, fake_response(query, empty))
+
+        def reply(self, status: HTTPStatus, data: dict, retry_after: int | None = None):
+            """Send the data as json."""
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if retry_after:
+                self.send_header('Retry-After', str(retry_after))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # noqa A002
+            """Log through the module logger."""
+            logger.debug(format % args)
+
+    return Handler
+
+
+class Command(ProfiledCommand):
+    help = 'Serve a local stand-in for the OpenCage geocoder, for opencagelookup --base-url.'
+
+    def add_arguments(self, parser):
+        """Address and behaviour options."""
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--rate', type=float, default=10, help='Requests a second before 429')
+        parser.add_argument('--quota', type=int, default=0, help='Requests before 402, 0 for none')
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds per response')
+        parser.add_argument('--empty', type=float, default=0.3, help='Share of codes not found')
+
+    def handle(self, *args, **options):
+        """Serve until interrupted."""
+        handler = make_handler(
+            options['rate'], options['quota'], options['latency'], options['empty']
+        )
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), handler)
+        logger.info(
+            f'Mock geocoder at http://127.0.0.1:{options["port"]}/geocode/v1/json '
+            f'allowing {options["rate"]} requests a second'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -1,132 +1,74 @@
 import logging
-import time
 
-import requests
 from django.conf import settings
-from django.core.management.base import BaseCommand
 
-from main.models import Postcode
+from main.geocoding import (
+    FIRST_CODE,
+    LAST_CODE,
+    OPENCAGE_URL,
+    WRITE_BATCH_SIZE,
+    lookup_postcodes,
+    missing_codes,
+)
+from main.profiling import ProfiledCommand
 
 logger = logging.getLogger(__name__)
-BASE_URL = 'https://api.opencagedata.com/geocode/v1/json'
 
 
-def latlng_precision(result):
-    try:
-        lat = result['geometry']['lat']
-        lng = result['geometry']['lng']
-        lat_prec = len(str(lat).split('.')[1]) if '.' in str(lat) else 0
-        lng_prec = len(str(lng).split('.')[1]) if '.' in str(lng) else 0
-        return lat_prec + lng_prec
-    except Exception:
-        return 0
-
-
-class Command(BaseCommand):
-    help = 'Update or create Postcode entries using OpenCage API for postcodes 0001–4000'
+class Command(ProfiledCommand):
+    help = 'Update or create Postcode entries using OpenCage API for the codes not looked up yet'
+
+    def add_arguments(self, parser):
+        """Range, budget and cache options."""
+        parser.add_argument('--first', type=int, default=FIRST_CODE)
+        parser.add_argument('--last', type=int, default=LAST_CODE)
+        parser.add_argument(
+            '--rate', type=float, default=1, help='Requests per second, 1 on the free tier'
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent requests')
+        parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE)
+        parser.add_argument(
+            '--base-url', default=OPENCAGE_URL, help='Geocoder url, e.g. of mockgeocoder'
+        )
+        parser.add_argument(
+            '--offline',
+            action='store_true',
+            help='Pick the results of every code in the range again from the cached '
+            'responses, without any requests',
+        )
+        parser.add_argument(
+            '--retry-empty',
+            action='store_true',
+            help='Ask again for codes whose cached response has no result',
+        )
 
     def handle(self, *args, **options):
+        """Look up the missing codes and store the results."""
         key = getattr(settings, 'OPENCAGE_API_KEY', None)
-        if not key:
-            raise RuntimeError('OPENCAGE_API_KEY is not set in settings.')
-
-        # Find the last postcode where opencage=True
-        last_updated = Postcode.objects.filter(opencage=True).order_by('-code').first()
-        start_code = (last_updated.code + 1) if last_updated else 1
-
-        logger.info(f'Starting update from postcode {start_code:04d}')
-
-        updated = 0
-        skipped = 0
-
-        for code in range(start_code, 9_999):
-            code_str = f'{code:04d}'
-
-            # Skip if already updated
-            existing = Postcode.objects.filter(code=code, opencage=True).first()
-            if existing:
-                continue
-
-            query = f'{code_str}, south africa'
-            params = {
-                'q': query,
-                'key': key,
-                'language': 'en',
-                'no_annotations': 1,
-                'pretty': 0,
-            }
-
-            # logger.info(f"Looking up postcode {code_str}...")
-
-            try:
-                response = requests.get(BASE_URL, params=params, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-            except Exception as e:
-                logger.warning(f'Request failed for {code_str}: {e}')
-                raise
-
-            postcode_results = [
-                r
-                for r in data.get('results', [])
-                if r.get('components', {}).get('_type') == 'postcode'
-            ]
-
-            postcode_results.sort(key=latlng_precision, reverse=True)
-            result = postcode_results[0] if postcode_results else None
-
-            if not result:
-                logger.info(f'No valid postcode result found for {code_str}')
-                skipped += 1
-                continue
-
-            geometry = result.get('geometry', {})
-            lat = geometry.get('lat')
-            lng = geometry.get('lng')
-            components = result.get('components', {})
-            level = ''
-            area = ''
-
-            for lvl_key in [
-                'suburb',
-                'neighbourhood',
-                'town',
-                'village',
-                'city_district',
-                'city',
-                'municipality',
-                'county',
-                'state_district',
-                'state',
-                'region',
-                'province',
-                'country',
-            ]:
-                value = components.get(lvl_key)
-                if value:
-                    area = value
-                    level = lvl_key
-                    break
-
-            if lat is None or lng is None:
-                logger.warning(f'Missing lat/lng for {code_str}')
-                continue
-
-            postcode_obj, created = Postcode.objects.update_or_create(
-                code=code,
-                defaults={
-                    'latitude': lat,
-                    'longitude': lng,
-                    'area': area,
-                    'level': level,
-                    'opencage': True,
-                },
-            )
-
+        if options['offline']:
+            codes = range(options['first'], options['last'] + 1)
+            logger.info(f'Reranking the cached responses of {len(codes):,} codes')
+        else:
+            if not key:
+                raise RuntimeError('OPENCAGE_API_KEY is not set in settings.')
+            codes = missing_codes(options['first'], options['last'])
             logger.info(
-                f"{'Created' if created else 'Updated'} postcode {code_str} {area} at {lat},{lng}"
+                f'Looking up {len(codes):,} codes from {options["first"]:04d} '
+                f'to {options["last"]:04d}'
             )
-            updated += 1
-            time.sleep(1.2)  # Stay under OpenCage free tier limits
 
-        logger.info(f'Finished. Updated/created: {updated}, Skipped: {skipped}')
+        metrics = lookup_postcodes(
+            codes,
+            key,
+            url=options['base_url'],
+            rate=options['rate'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            offline=options['offline'],
+            retry_empty=options['retry_empty'],
+        )
+        logger.info(metrics.summary())
+        logger.info(
+            f'Finished. Updated/created: {metrics.counters["written"]}, '
+            f'Skipped: {metrics.counters["empty"]}'
+        )
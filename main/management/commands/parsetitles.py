@@ -0,0 +1,36 @@
+import logging
+
+from main.models import Torrent
+from main.parsing import PARSE_CHUNK_SIZE, parse_titles
+from main.profiling import ProfiledCommand
+from main.selectors import invalidate_dashboard_stats
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ProfiledCommand):
+    help = 'Parse the titles of torrents from their names in bulk.'
+
+    def add_arguments(self, parser):
+        """Selection and chunk size options."""
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Every torrent, replacing titles set by hand or by the scraper, '
+            'instead of only the torrents without title',
+        )
+        parser.add_argument('--category', type=str, default=None)
+        parser.add_argument('--chunk-size', type=int, default=PARSE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        """Re-title the selected torrents."""
+        torrents = Torrent.objects.all()
+        if not options['all']:
+            torrents = torrents.filter(title__isnull=True)
+        if options['category']:
+            torrents = torrents.filter(category=options['category'])
+
+        logger.info('parsing titles')
+        parse_titles(torrents, chunk_size=options['chunk_size'])
+        invalidate_dashboard_stats()
+        logger.info('done')
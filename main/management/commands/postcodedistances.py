@@ -1,67 +1,197 @@
 import logging
-from math import asin, cos, radians, sin, sqrt
+import os
+import time
+from collections.abc import Iterator
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+import numpy as np
 from django.db.models import Count
 
+from main.constants import COUNTRY_ZA
+from main.geo import PairBitmap, condensed_index, measure_tiles, nearby_pairs, tile_indices
+from main.ingest import insert_distances
+from main.matrix import DistanceMatrix, postcode_keys
 from main.models import Distance, Postcode
+from main.profiling import ProfiledCommand
 
 logger = logging.getLogger(__name__)
 
-BATCH_SIZE = 1000  # Adjust as needed
+BATCH_SIZE = 10_000
+READ_CHUNK_SIZE = 100_000
+PROGRESS_INTERVAL = 5  # seconds between progress lines
+
+
+def load_computed_pairs(ids: np.ndarray) -> PairBitmap:
+    """Mark the pairs of the sorted postcode ids already in the Distance table."""
+    computed = PairBitmap(len(ids))
+    pairs = Distance.objects.values_list('postcode_a_id', 'postcode_b_id').iterator(
+        chunk_size=READ_CHUNK_SIZE
+    )
+    while chunk := list(islice(pairs, READ_CHUNK_SIZE)):
+        a_ids, b_ids = np.array(chunk, dtype=np.int64).T
+        # positions of the ids, pairs with a postcode outside the set are dropped
+        i = np.searchsorted(ids, a_ids).clip(max=len(ids) - 1)
+        j = np.searchsorted(ids, b_ids).clip(max=len(ids) - 1)
+        known = (ids[i] == a_ids) & (ids[j] == b_ids)
+        computed.add(i[known], j[known])
+    return computed
+
+
+def all_pairs(
+    lat: np.ndarray, lon: np.ndarray, computed: PairBitmap, workers: int
+) -> Iterator[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (pairs done, i, j, km) for the pairs not computed yet, a tile at a time."""
+    n = len(lat)
+    for start, stop, km in measure_tiles(lat, lon, workers=workers):
+        new = ~computed.slice(int(condensed_index(start, start + 1, n)), len(km))
+        i, j = tile_indices(n, start, stop)
+        yield len(km), i[new], j[new], km[new]
+
+
+def pairs_within(
+    lat: np.ndarray, lon: np.ndarray, computed: PairBitmap, max_km: float
+) -> Iterator[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (postcodes done, i, j, km) for the pairs within max_km not computed yet."""
+    for points, i, j, km in nearby_pairs(lat, lon, max_km):
+        new = ~computed.contains(i, j)
+        yield points, i[new], j[new], km[new]
+
+
+def insert_pairs(a_ids: np.ndarray, b_ids: np.ndarray, km: np.ndarray) -> Iterator[tuple[int, int]]:
+    """Insert the distances in batches, yielding (rows written, rows inserted) so far after each.
+
+    Rows of pairs already stored are written but not inserted.
+    """
+    inserted = 0
+    for first in range(0, len(km), BATCH_SIZE):
+        batch = slice(first, first + BATCH_SIZE)
+        rows = zip(a_ids[batch].tolist(), b_ids[batch].tolist(), km[batch].tolist(), strict=True)
+        inserted += insert_distances(rows)
+        yield min(first + BATCH_SIZE, len(km)), inserted
+
+
+class ProgressLog:
+    """Progress lines every PROGRESS_INTERVAL with the rate and an ETA."""
+
+    def __init__(self, total: int, unit: str):
+        """Start the clock."""
+        self.total = total
+        self.unit = unit
+        self.start = self.last = time.monotonic()
+
+    def __call__(self, done: int, written: int, final: bool = False):
+        """Log the progress if due."""
+        if not final and time.monotonic() - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = time.monotonic()
+        elapsed = self.last - self.start
+        rate = done / elapsed if elapsed else 0
+        eta = (self.total - done) / rate if rate else 0
+        logger.info(
+            f'Done {done:,} of {self.total:,} {self.unit} ({done / self.total:.0%}), '
+            f'stored {written:,}, {rate:,.0f} {self.unit}/s, ETA {eta:,.0f}s'
+        )
 
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371.0  # Earth radius in km
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    return R * c
+def log_level_counts():
+    """Log the number of postcodes of each level."""
+    level_counts = (
+        Postcode.objects.values('level')
+        .annotate(count=Count('id'))
+        .order_by('-count')  # Optional: sort by highest count first
+    )
+    for entry in level_counts:
+        logger.info(f"{entry['level'] or '[None]'}: {entry['count']}")
 
 
-class Command(BaseCommand):
+class Command(ProfiledCommand):
     help = 'Populate the Distance table with km between each unique pair of Postcodes.'
 
-    def handle(self, *args, **options):
-        postcodes = list(
-            Postcode.objects.filter(level__in=['suburb', 'neighbourhood', 'town']).all()
+    def add_arguments(self, parser):
+        """Parallelism, radius and storage options."""
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Processes measuring tiles of pairs, this process writes the rows',
         )
-        total_pairs = len(postcodes) * (len(postcodes) - 1) // 2
-        logger.info(f'Calculating distances for {total_pairs:,} postcode pairs...')
-
-        level_counts = (
-            Postcode.objects.values('level')
-            .annotate(count=Count('id'))
-            .order_by('-count')  # Optional: sort by highest count first
+        parser.add_argument(
+            '--max-km',
+            type=float,
+            help='Only store pairs within this distance, found through a grid without '
+            'measuring the pairs further apart',
+        )
+        parser.add_argument(
+            '--store',
+            choices=['table', 'matrix'],
+            default='table',
+            help='Insert into the Distance table, or write a new distance matrix file',
+        )
+        parser.add_argument('--matrix-path', help='Matrix file, default DISTANCE_MATRIX_PATH')
+        parser.add_argument(
+            '--country', default=COUNTRY_ZA, type=str.upper, help='Country of the postcodes'
         )
-        for entry in level_counts:
-            logger.info(f"{entry['level'] or '[None]'}: {entry['count']}")
-
-        batch = []
-        count = 0
-
-        for i, a in enumerate(postcodes):
-            for b in postcodes[i + 1 :]:
-                if a.id > b.id:
-                    a, b = b, a
-
-                # Check if this distance already exists
-                if Distance.objects.filter(postcode_a=a, postcode_b=b).exists():
-                    continue
-
-                km = haversine(a.latitude, a.longitude, b.latitude, b.longitude)
-                batch.append(Distance(postcode_a=a, postcode_b=b, km=round(km, 3)))
-                count += 1
-
-                if len(batch) >= BATCH_SIZE:
-                    Distance.objects.bulk_create(batch)
-                    logger.info(f'Inserted {count:,} distances so far...')
-                    batch.clear()
-
-        # Final flush
-        if batch:
-            Distance.objects.bulk_create(batch)
-            logger.info(f'Inserted final {len(batch):,} distances.')
 
+    def handle(self, *args, **options):
+        """Measure the pairs not stored yet and insert them."""
+        # ordered by id so the first of each pair has the lower id, as Distance stores them
+        postcodes = np.array(
+            Postcode.objects.filter(
+                country=options['country'], level__in=['suburb', 'neighbourhood', 'town']
+            )
+            .order_by('id')
+            .values_list('id', 'code', 'latitude', 'longitude'),
+            dtype=float,
+        ).reshape(-1, 4)
+        ids, lat, lon = postcodes[:, 0].astype(np.int64), postcodes[:, 2], postcodes[:, 3]
+        total_pairs = len(ids) * (len(ids) - 1) // 2
+        if options['max_km']:
+            logger.info(
+                f'Calculating distances within {options["max_km"]} km '
+                f'among {len(ids):,} postcodes...'
+            )
+        else:
+            logger.info(f'Calculating distances for {total_pairs:,} postcode pairs...')
+
+        log_level_counts()
+
+        if not total_pairs:
+            logger.info('Completed populating distances. Total inserted: 0')
+            return
+        matrix = None
+        if options['store'] == 'matrix':
+            keys = postcode_keys(options['country'], postcodes[:, 1].astype(np.int64))
+            matrix = DistanceMatrix.create(keys, options['matrix_path'])
+            computed = PairBitmap(len(ids))
+        else:
+            computed = load_computed_pairs(ids)
+            logger.info(f'Skipping {computed.count():,} pairs already computed')
+
+        # progress is counted in pairs measured, or in postcodes within a radius
+        if options['max_km']:
+            blocks = pairs_within(lat, lon, computed, options['max_km'])
+            progress = ProgressLog(len(ids), 'postcodes')
+        else:
+            blocks = all_pairs(lat, lon, computed, options['workers'])
+            progress = ProgressLog(total_pairs, 'pairs')
+        done = count = 0
+        for step, i, j, distances in blocks:
+            block_done, block_count = done, count
+            if matrix is not None:
+                matrix.write(i, j, distances)
+                batches = [(len(distances), len(distances))]
+            else:
+                batches = insert_pairs(ids[i], ids[j], distances.round(3))
+            for written, inserted in batches:
+                count = block_count + inserted
+                # the block's progress in proportion to its rows written
+                done = block_done + step * written // max(len(distances), 1)
+                progress(done, count)
+            done = block_done + step
+            progress(done, count)
+
+        progress(done, count, final=True)
+        if matrix is not None:
+            matrix.flush()
+            logger.info(f'Wrote {len(matrix):,} postcodes to {matrix.km.filename}')
         logger.info(f'Completed populating distances. Total inserted: {count:,}')
@@ -0,0 +1,20 @@
+import logging
+
+from main.profiling import ProfiledCommand
+from main.services import PRUNE_CHUNK_SIZE, prune
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ProfiledCommand):
+    help = 'Delete old tv and movie torrents and the titles left without torrents.'
+
+    def add_arguments(self, parser):
+        """Chunk size option."""
+        parser.add_argument('--chunk-size', type=int, default=PRUNE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        """Prune in bounded transactions."""
+        logger.info('pruning old torrents')
+        prune(chunk_size=options['chunk_size'])
+        logger.info('done')
@@ -0,0 +1,60 @@
+import logging
+import signal
+import subprocess
+import sys
+
+from django.conf import settings
+
+from main.jobs import POLL_INTERVAL, fail_stale_jobs, work
+from main.profiling import ProfiledCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ProfiledCommand):
+    help = 'Run worker processes taking jobs off the queue until interrupted.'
+
+    def add_arguments(self, parser):
+        """Worker options."""
+        parser.add_argument('--workers', type=int, default=2, help='Jobs to run in parallel')
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        """Work in this process, or start a process per worker and wait for them."""
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            logger.info('Stopping after the current job...')
+            stopping = True
+
+        # a job left running by a dead worker would block queueing another of its kind
+        if failed := fail_stale_jobs():
+            logger.warning(f'Failed {failed} stale jobs')
+
+        if options['workers'] == 1:
+            signal.signal(signal.SIGINT, stop)
+            signal.signal(signal.SIGTERM, stop)
+            work(lambda: stopping, options['poll_interval'])
+            return
+
+        command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runworkers']
+        command += ['--workers', '1', '--poll-interval', str(options['poll_interval'])]
+        processes = [
+            subprocess.Popen(command, cwd=settings.BASE_DIR)  # noqa S603
+            for _ in range(options['workers'])
+        ]
+        logger.info(f'Started {len(processes)} workers')
+
+        def forward(signum, frame):
+            # ctrl-c reaches the whole process group, a plain kill only this process
+            if signum == signal.SIGTERM:
+                for process in processes:
+                    process.send_signal(signum)
+            stop(signum, frame)
+
+        signal.signal(signal.SIGINT, forward)
+        signal.signal(signal.SIGTERM, forward)
+        for process in processes:
+            process.wait()
+        logger.info('done')
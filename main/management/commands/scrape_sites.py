@@ -1,27 +1,21 @@
 import logging
 
-from django.core.management import BaseCommand
-
-from main.models import Title
-from main.scraper import scrape_sites
+from main.profiling import ProfiledCommand
+from main.services import scrape
 
 logger = logging.getLogger(__name__)
 
 
-class Command(BaseCommand):
+class Command(ProfiledCommand):
     help = 'Scrape torrent sites'
 
-    def handle(self, *args, **options):
-        logger.info('scraping sites')
-        scrape_sites()
-
-        logger.info('updating titles')
-        titles = Title.objects.filter().all()
-        for title in titles:
-            if not title.torrents.count():
-                title.delete()
-                continue
-            title.update_stats()
-            title.save()
+    def add_arguments(self, parser):
+        """Logging option."""
+        parser.add_argument('--log-rows', action='store_true', help='Log every scraped torrent')
 
+    def handle(self, *args, **options):
+        """Scrape and update the titles."""
+        if options['log_rows']:
+            logging.getLogger('main.scraper.rows').setLevel(logging.INFO)
+        scrape()
         logger.info('done')
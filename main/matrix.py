@@ -0,0 +1,174 @@
+"""Postcode distances as a condensed matrix in a memory mapped .npy file.
+
+The km of each pair i < j of n postcodes is a float32 at its condensed index, NaN when
+not measured, so a pair costs 4 bytes against well over 100 for a Distance row and is
+looked up without a query. float32 keeps km to within a metre across the country. The
+postcodes, as (country, code) records in matrix order, are kept in a .codes.npy file
+beside it.
+"""
+
+import logging
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from main.constants import COUNTRY_ZA
+from main.geo import condensed_index
+from main.ingest import insert_distances
+from main.models import Distance, Postcode
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 100_000
+WRITE_BATCH_SIZE = 10_000
+# codes are only unique within a country
+KEY_DTYPE = np.dtype([('country', 'U2'), ('code', np.int64)])
+
+
+def codes_path(path: Path) -> Path:
+    """Get the path of the codes file of a matrix."""
+    return path.with_suffix('.codes.npy')
+
+
+def postcode_keys(countries, codes) -> np.ndarray:
+    """Make the (country, code) records of postcodes, of one country when a string."""
+    keys = np.empty(len(codes), dtype=KEY_DTYPE)
+    keys['country'] = countries
+    keys['code'] = codes
+    return keys
+
+
+class DistanceMatrix:
+    """Memory mapped condensed matrix of km between postcodes."""
+
+    def __init__(self, keys: np.ndarray, km: np.ndarray):
+        """Wrap the (country, code) records in matrix order and the condensed km."""
+        self.keys = keys
+        self.km = km
+        self.positions = {key: i for i, key in enumerate(keys.tolist())}
+
+    def __len__(self) -> int:
+        """Get the number of postcodes."""
+        return len(self.keys)
+
+    @classmethod
+    def create(cls, keys: np.ndarray, path: Path | None = None) -> 'DistanceMatrix':
+        """Create a matrix of the postcodes with no pair measured, replacing any at the path."""
+        path = Path(path or settings.DISTANCE_MATRIX_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        keys = np.asarray(keys, dtype=KEY_DTYPE)
+        np.save(codes_path(path), keys)
+        km = np.lib.format.open_memmap(
+            path, mode='w+', dtype=np.float32, shape=(len(keys) * (len(keys) - 1) // 2,)
+        )
+        km[:] = np.nan
+        return cls(keys, km)
+
+    @classmethod
+    def open(cls, path: Path | None = None, mode: str = 'r') -> 'DistanceMatrix':
+        """Map a matrix, read only unless mode is r+."""
+        path = Path(path or settings.DISTANCE_MATRIX_PATH)
+        keys = np.load(codes_path(path))
+        if keys.dtype.names is None:
+            # written before postcodes had a country, when they were all ZA
+            keys = postcode_keys(COUNTRY_ZA, keys)
+        return cls(keys, np.load(path, mmap_mode=mode))
+
+    def index(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        """Get the condensed index of each pair of positions, in either order."""
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        return condensed_index(i, j, len(self))
+
+    def distance(
+        self, code_a: int, code_b: int, country_a: str = COUNTRY_ZA, country_b: str | None = None
+    ) -> float | None:
+        """Get the km between two postcodes, None if not measured or unknown.
+
+        The second postcode is in the country of the first unless given.
+        """
+        i = self.positions.get((country_a, code_a))
+        j = self.positions.get((country_b or country_a, code_b))
+        if i is None or j is None:
+            return None
+        if i == j:
+            return 0.0
+        km = self.km[int(self.index(i, j))]
+        return None if np.isnan(km) else float(km)
+
+    def write(self, i: np.ndarray, j: np.ndarray, km: np.ndarray):
+        """Store the km of the pairs of positions i, j."""
+        self.km[self.index(np.asarray(i, np.int64), np.asarray(j, np.int64))] = km
+
+    def flush(self):
+        """Write the changes to the file."""
+        if isinstance(self.km, np.memmap):
+            self.km.flush()
+
+
+def export_matrix(path: Path | None = None) -> DistanceMatrix:
+    """Write the Distance table to a matrix of every postcode it mentions."""
+    postcodes = list(
+        Postcode.objects.filter(distances_a__isnull=False)
+        .union(Postcode.objects.filter(distances_b__isnull=False))
+        .order_by('id')
+        .values_list('id', 'country', 'code')
+    )
+    ids = np.array([postcode[0] for postcode in postcodes], dtype=np.int64)
+    matrix = DistanceMatrix.create(
+        postcode_keys([p[1] for p in postcodes], [p[2] for p in postcodes]), path
+    )
+    rows = Distance.objects.values_list('postcode_a_id', 'postcode_b_id', 'km').iterator(
+        chunk_size=READ_CHUNK_SIZE
+    )
+    count = 0
+    while chunk := list(islice(rows, READ_CHUNK_SIZE)):
+        pairs = np.array(chunk, dtype=float)
+        matrix.write(
+            np.searchsorted(ids, pairs[:, 0].astype(np.int64)),
+            np.searchsorted(ids, pairs[:, 1].astype(np.int64)),
+            pairs[:, 2],
+        )
+        count += len(chunk)
+    matrix.flush()
+    logger.info(f'Exported {count:,} distances between {len(matrix):,} postcodes')
+    return matrix
+
+
+def import_matrix(path: Path | None = None) -> int:
+    """Insert the measured pairs of a matrix into the Distance table, returning the count.
+
+    Postcodes missing from the Postcode table are skipped, as are pairs already stored,
+    so the count is of the pairs newly inserted.
+    """
+    matrix = DistanceMatrix.open(path)
+    keys = matrix.keys.tolist()
+    ids_by_key = {
+        (country, code): pk
+        for country, code, pk in Postcode.objects.filter(
+            country__in={country for country, _ in keys}
+        ).values_list('country', 'code', 'id')
+    }
+    ids = np.array([ids_by_key.get(key, 0) for key in keys], dtype=np.int64)
+    n = len(matrix)
+    batch = []
+    count = 0
+    for i in range(n - 1):
+        # the pairs of row i are contiguous
+        start = int(condensed_index(i, i + 1, n))
+        km = np.asarray(matrix.km[start : start + n - i - 1], dtype=float).round(3)
+        j = np.arange(i + 1, n)
+        keep = ~np.isnan(km) & (ids[j] != 0) & (ids[i] != 0)
+        batch += zip(
+            ids[np.full(keep.sum(), i)].tolist(),
+            ids[j[keep]].tolist(),
+            km[keep].tolist(),
+            strict=True,
+        )
+        if len(batch) >= WRITE_BATCH_SIZE:
+            count += insert_distances(batch)
+            batch = []
+    count += insert_distances(batch)
+    logger.info(f'Imported {count:,} new distances between {n:,} postcodes')
+    return count
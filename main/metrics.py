@@ -0,0 +1,126 @@
+"""Counters and stage timings of a pipeline run, with table, json and prometheus output.
+
+The prometheus output is in the text format read by node exporter's textfile collector.
+"""
+
+import json
+import statistics
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+# histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Metrics:
+    """Counters and stage timings of one run of a pipeline."""
+
+    def __init__(self, name: str):
+        """Start the run."""
+        self.name = name
+        self.counters = Counter()
+        self.timings: dict[str, list[float]] = {}
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+
+    def count(self, name: str, value: int = 1):
+        """Add to a counter."""
+        self.counters[name] += value
+
+    def observe(self, stage: str, seconds: float):
+        """Record one timing of a stage."""
+        self.timings.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time the block as one run of the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def stage_stats(self) -> dict[str, dict]:
+        """Summarise the timings of each stage."""
+        stats = {}
+        for stage, timings in self.timings.items():
+            ordered = sorted(timings)
+            stats[stage] = {
+                'count': len(ordered),
+                'total': sum(ordered),
+                'mean': statistics.fmean(ordered),
+                'p50': ordered[len(ordered) // 2],
+                'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                'max': ordered[-1],
+                'buckets': [sum(1 for t in ordered if t <= bucket) for bucket in BUCKETS],
+            }
+        return stats
+
+    def as_dict(self) -> dict:
+        """Get the counters and stage summaries."""
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'elapsed': time.perf_counter() - self.start,
+            'counters': dict(self.counters),
+            'stages': {
+                stage: {key: value for key, value in stats.items() if key != 'buckets'}
+                for stage, stats in self.stage_stats().items()
+            },
+        }
+
+    def summary(self) -> str:
+        """Format the stages and counters as a table."""
+        elapsed = time.perf_counter() - self.start
+        lines = [
+            f'{self.name} metrics after {elapsed:.1f}s',
+            f'{"stage":<12}{"count":>10}{"total s":>10}{"share":>8}'
+            f'{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}',
+        ]
+        for stage, stats in self.stage_stats().items():
+            lines.append(
+                f'{stage:<12}{stats["count"]:>10,}{stats["total"]:>10.2f}'
+                f'{stats["total"] / elapsed:>8.0%}{stats["mean"] * 1000:>10.2f}'
+                f'{stats["p50"] * 1000:>10.2f}{stats["p95"] * 1000:>10.2f}'
+                f'{stats["max"] * 1000:>10.2f}'
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{name:<12}{value:>10,}')
+        return '\n'.join(lines)
+
+    def prometheus(self) -> str:
+        """Format the counters and stage histograms as prometheus text."""
+        prefix = f'torrents_{self.name}'
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+        lines.append(f'# TYPE {prefix}_stage_seconds histogram')
+        for stage, stats in self.stage_stats().items():
+            for bucket, count in zip(BUCKETS, stats['buckets'], strict=True):
+                lines.append(
+                    f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bucket}"}} {count}'
+                )
+            lines += [
+                f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}',
+                f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total"]}',
+                f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}',
+            ]
+        lines += [
+            f'# TYPE {prefix}_last_run_timestamp_seconds gauge',
+            f'{prefix}_last_run_timestamp_seconds {self.started_at}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory: Path) -> tuple[Path, Path]:
+        """Write <name>_metrics.json and <name>_metrics.prom, replacing them atomically."""
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = (directory / f'{self.name}_metrics.json', directory / f'{self.name}_metrics.prom')
+        contents = (json.dumps(self.as_dict(), indent=2), self.prometheus())
+        for path, content in zip(paths, contents, strict=True):
+            tmp_path = path.with_suffix(f'{path.suffix}.tmp')
+            tmp_path.write_text(content)
+            tmp_path.replace(path)
+        return paths
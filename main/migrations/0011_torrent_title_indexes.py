@@ -0,0 +1,60 @@
+# Generated by Django 5.0.3 on 2026-10-19 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0010_postcode_level_postcode_opencage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='title',
+            index=models.Index(fields=['status', '-status_at'], name='title_status_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='title',
+            index=models.Index(fields=['status', '-priority'], name='title_status_priority_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='title',
+            index=models.Index(fields=['-year', 'status'], name='title_year_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='title',
+            index=models.Index(fields=['series', 'season', 'episode'], name='title_series_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(
+                fields=['category', 'created_at'], name='torrent_category_created_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(fields=['category', 'title'], name='torrent_category_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(fields=['title', 'uploaded_at'], name='torrent_title_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(fields=['-seeders'], name='torrent_seeders_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(
+                fields=['category', 'subcategory', '-seeders'], name='torrent_cat_sub_seeders_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(fields=['-uploaded_at'], name='torrent_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='torrent',
+            index=models.Index(fields=['title', '-seeders'], name='torrent_title_seeders_idx'),
+        ),
+    ]
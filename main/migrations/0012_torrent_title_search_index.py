@@ -0,0 +1,67 @@
+from django.db import migrations
+
+SQLITE_INDEXES = (
+    # table, indexed column, rowid column
+    ('main_torrent', 'name', 'id'),
+    ('main_title', 'text', 'rowid'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    """Create fts5 trigram indexes kept in sync by triggers, or trigram gin indexes."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column, _ in SQLITE_INDEXES:
+            schema_editor.execute(
+                f'CREATE INDEX {table}_{column}_trgm ON {table} '
+                f'USING gin (UPPER({column}::text) gin_trgm_ops)'
+            )
+        return
+    if vendor != 'sqlite':
+        return
+
+    for table, column, rowid in SQLITE_INDEXES:
+        fts = f'{table}_fts'
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {fts} USING fts5({column}, '
+            f"content='{table}', content_rowid='{rowid}', tokenize='trigram')"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '  # noqa S608
+            f'INSERT INTO {fts}(rowid, {column}) VALUES (new.{rowid}, new.{column}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '  # noqa S608
+            f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{rowid}, "
+            f'old.{column}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN '  # noqa S608
+            f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{rowid}, "
+            f'old.{column}); '
+            f'INSERT INTO {fts}(rowid, {column}) VALUES (new.{rowid}, new.{column}); END'
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")  # noqa S608
+
+
+def drop_search_indexes(apps, schema_editor):
+    """Drop the search indexes."""
+    vendor = schema_editor.connection.vendor
+    for table, column, _ in SQLITE_INDEXES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm')
+        elif vendor == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0011_torrent_title_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def widen_size(apps, schema_editor):
+    """Widen the column on postgres, sqlite integers are 64 bit already.
+
+    Altering the field on sqlite would rebuild the table and drop the search triggers.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE main_torrent ALTER COLUMN size TYPE bigint')
+
+
+def narrow_size(apps, schema_editor):
+    """Narrow the column on postgres again."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE main_torrent ALTER COLUMN size TYPE integer')
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0012_torrent_title_search_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(widen_size, narrow_size)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='torrent',
+                    name='size',
+                    field=models.BigIntegerField(),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.3 on 2026-10-19 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0013_torrent_size_bigint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                (
+                    'name',
+                    models.CharField(
+                        choices=[
+                            ('scrape', 'Scrape sites'),
+                            ('refresh stats', 'Refresh title stats'),
+                            ('prune', 'Prune old torrents'),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                (
+                    'status',
+                    models.IntegerField(
+                        choices=[
+                            (10, 'Queued'),
+                            (20, 'Running'),
+                            (30, 'Finished'),
+                            (40, 'Failed'),
+                            (50, 'Cancelled'),
+                        ],
+                        default=10,
+                    ),
+                ),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('progress_done', models.BigIntegerField(default=0)),
+                ('progress_total', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['status', 'created_at'], name='job_status_created_idx')
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.3 on 2026-10-19 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0014_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postcode',
+            name='country',
+            field=models.CharField(default='ZA', max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='postcode',
+            name='code',
+            field=models.IntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='postcode',
+            constraint=models.UniqueConstraint(
+                fields=('country', 'code'), name='unique_country_postcode'
+            ),
+        ),
+    ]
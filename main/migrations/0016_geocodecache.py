@@ -0,0 +1,30 @@
+# Generated by Django 5.0.3 on 2026-10-19 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0015_postcode_country'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('query', models.CharField(max_length=255, unique=True)),
+                ('response', models.JSONField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
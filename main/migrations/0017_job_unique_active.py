@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-19 10:54
+
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def cancel_duplicate_jobs(apps, schema_editor):
+    """Cancel all but the oldest queued or running job of each kind."""
+    Job = apps.get_model('main', 'Job')
+    active = Job.objects.filter(status__in=[10, 20]).order_by('name', 'created_at')
+    seen = set()
+    for job in active:
+        if job.name in seen:
+            Job.objects.filter(pk=job.pk).update(status=50, finished_at=now())
+        seen.add(job.name)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('main', '0016_geocodecache'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status__in', [10, 20])),
+                fields=('name',),
+                name='unique_active_job',
+            ),
+        ),
+    ]
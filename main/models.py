@@ -7,6 +7,15 @@ from main.constants import (
     CATEGORY_GAMES,
     CATEGORY_MOVIES,
     CATEGORY_TV_SHOWS,
+    COUNTRY_ZA,
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_FINISHED,
+    JOB_PRUNE,
+    JOB_QUEUED,
+    JOB_REFRESH_STATS,
+    JOB_RUNNING,
+    JOB_SCRAPE,
     SITE_1337X,
     SITE_RARBG,
     STATUS_FINISHED,
@@ -30,6 +39,9 @@ class Timestamp(models.Model):
         abstract = True
 
 
+# Title and Torrent have fts5 search indexes on sqlite kept in sync by triggers, see
+# main.search. Altering a field of either rebuilds the table and drops the triggers, they
+# are recreated after migrate, but rather alter the column with RunSQL as 0013 does.
 class Title(Timestamp):
     STATUS_CHOICES = (
         (STATUS_NEW, 'New'),
@@ -53,6 +65,15 @@ class Title(Timestamp):
 
     class Meta:
         ordering = ('text',)
+        indexes = [
+            # recent games and the status filter
+            models.Index(fields=['status', '-status_at'], name='title_status_at_idx'),
+            # pc games "what is next"
+            models.Index(fields=['status', '-priority'], name='title_status_priority_idx'),
+            models.Index(fields=['-year', 'status'], name='title_year_status_idx'),
+            # tv shows ordering
+            models.Index(fields=['series', 'season', 'episode'], name='title_series_idx'),
+        ]
 
     def __str__(self):
         return f'{self.text}'
@@ -63,9 +84,14 @@ class Title(Timestamp):
         self.latest_upload_at = self.torrents.aggregate(Max('uploaded_at'))['uploaded_at__max']
         if not self.earliest_upload_at or not self.latest_upload_at:
             raise ValueError()
-        days_earliest = (now() - self.earliest_upload_at).days
-        days_latest = (now() - self.latest_upload_at).days
-        self.priority = days_earliest + days_latest
+        self.priority = self.calculate_priority(self.earliest_upload_at, self.latest_upload_at)
+
+    @staticmethod
+    def calculate_priority(earliest_upload_at, latest_upload_at) -> int:
+        """Priority is the age in days of the first and the last upload added together."""
+        days_earliest = (now() - earliest_upload_at).days
+        days_latest = (now() - latest_upload_at).days
+        return days_earliest + days_latest
 
     def status_fmt(self) -> str:
         """Format the status of the title to text."""
@@ -113,7 +139,7 @@ class Torrent(Timestamp):
     seeders = models.IntegerField()
     leechers = models.IntegerField()
     uploaded_at = models.DateTimeField()
-    size = models.IntegerField()
+    size = models.BigIntegerField()
     uploader = models.CharField(max_length=250)
 
     title = models.ForeignKey(
@@ -131,6 +157,25 @@ class Torrent(Timestamp):
     subtitle = models.CharField(max_length=50, null=True, blank=True)
     language = models.CharField(max_length=50, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # old tv and the per category counts
+            models.Index(fields=['category', 'created_at'], name='torrent_category_created_idx'),
+            # title admins joining on category
+            models.Index(fields=['category', 'title'], name='torrent_category_title_idx'),
+            # first/last upload per title
+            models.Index(fields=['title', 'uploaded_at'], name='torrent_title_uploaded_idx'),
+            # torrent admin ordering and filters
+            models.Index(fields=['-seeders'], name='torrent_seeders_idx'),
+            models.Index(
+                fields=['category', 'subcategory', '-seeders'], name='torrent_cat_sub_seeders_idx'
+            ),
+            models.Index(fields=['-uploaded_at'], name='torrent_uploaded_idx'),
+            # "filter untitled" and the torrents of a title, sqlite prefers this over a
+            # partial index on title_id is null
+            models.Index(fields=['title', '-seeders'], name='torrent_title_seeders_idx'),
+        ]
+
     def __str__(self) -> str:
         status = self.title.status_fmt() if self.title else ''
         return f'<{self.category} {self.name} {status}>'
@@ -143,13 +188,19 @@ class Torrent(Timestamp):
 
 
 class Postcode(Timestamp):
-    code = models.IntegerField(unique=True)
+    country = models.CharField(max_length=2, default=COUNTRY_ZA)
+    code = models.IntegerField()
     area = models.CharField(max_length=150)
     level = models.CharField(max_length=50)
     latitude = models.FloatField()
     longitude = models.FloatField()
     opencage = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['country', 'code'], name='unique_country_postcode')
+        ]
+
     def __str__(self):
         return f'<Postcode {self.code} ({self.area})- {self.latitude} {self.longitude}>'
 
@@ -174,3 +225,60 @@ class Distance(Timestamp):
         if self.postcode_a_id > self.postcode_b_id:
             self.postcode_a, self.postcode_b = self.postcode_b, self.postcode_a
         super().save(*args, **kwargs)
+
+
+# raw geocoder responses by query, those without a result too
+class GeocodeCache(Timestamp):
+    query = models.CharField(max_length=255, unique=True)
+    response = models.JSONField()
+
+    def __str__(self):
+        return f'<GeocodeCache {self.query}>'
+
+
+class Job(Timestamp):
+    NAMES = (
+        (JOB_SCRAPE, 'Scrape sites'),
+        (JOB_REFRESH_STATS, 'Refresh title stats'),
+        (JOB_PRUNE, 'Prune old torrents'),
+    )
+    STATUS_CHOICES = (
+        (JOB_QUEUED, 'Queued'),
+        (JOB_RUNNING, 'Running'),
+        (JOB_FINISHED, 'Finished'),
+        (JOB_FAILED, 'Failed'),
+        (JOB_CANCELLED, 'Cancelled'),
+    )
+    name = models.CharField(max_length=50, choices=NAMES)
+    status = models.IntegerField(choices=STATUS_CHOICES, default=JOB_QUEUED)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True)
+    progress_done = models.BigIntegerField(default=0)
+    progress_total = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # claiming the oldest queued job
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+        constraints = [
+            # one queued or running job of a kind, enqueue relies on it when racing
+            models.UniqueConstraint(
+                fields=['name'],
+                condition=models.Q(status__in=[JOB_QUEUED, JOB_RUNNING]),
+                name='unique_active_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f'<Job {self.pk} {self.name} {self.get_status_display()}>'
+
+    def progress_fmt(self) -> str:
+        """Format the progress of the job to text."""
+        if not self.progress_total:
+            return ''
+        share = self.progress_done / self.progress_total
+        return f'{self.progress_done:,} / {self.progress_total:,} ({share:.0%})'
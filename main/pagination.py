@@ -0,0 +1,216 @@
+import base64
+import json
+
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, OrderBy, Q, QuerySet
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'k'
+COUNT_LIMIT = 10_000
+
+
+def encode_cursor(number: int, values: list) -> str:
+    """Encode the page number and the sort key of the row before it."""
+    payload = json.dumps({'p': number, 'v': values}, cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, list] | None:
+    """Decode a cursor, ignoring anything malformed."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        number, values = int(payload['p']), payload['v']
+    except (ValueError, TypeError, KeyError):
+        return None
+    return (number, values) if isinstance(values, list) else None
+
+
+def estimate_table_rows(queryset: QuerySet) -> int | None:
+    """Estimate the row count of an unfiltered table from the backend's statistics."""
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(_ROWID_) FROM {table}')  # noqa S608
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table]
+            )
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class KeysetPaginator(Paginator):
+    """Paginator that seeks past the previous page instead of using OFFSET.
+
+    Following the "next" link carries a cursor with the sort key of the last row, so
+    the next page is an index range scan however deep it is. Jumping to an arbitrary
+    page, ordering by something that cannot be sought on, or a cursor whose sort key does
+    not fit the ordering, falls back to OFFSET.
+    The count is exact up to ``count_limit`` rows and estimated beyond that.
+    """
+
+    def __init__(
+        self,
+        object_list,
+        per_page,
+        orphans=0,
+        allow_empty_first_page=True,
+        cursor: str | None = None,
+        count_limit: int = COUNT_LIMIT,
+    ):
+        """Set up with the cursor from the request, if any."""
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.cursor = cursor and decode_cursor(cursor)
+        self.count_limit = count_limit
+        self.is_estimate = False
+        self.next_cursor = None
+
+    @cached_property
+    def count(self) -> int:
+        """Count up to the limit, then estimate."""
+        capped = self.object_list[: self.count_limit + 1].count()
+        if capped <= self.count_limit:
+            return capped
+        self.is_estimate = True
+        if not self.object_list.query.where:
+            return max(estimate_table_rows(self.object_list) or 0, capped)
+        return capped
+
+    @cached_property
+    def sort_keys(self) -> list[tuple[str, bool, bool]] | None:
+        """Get (name, descending, nullable) for each ordering term, or None if unsupported."""
+        opts = self.object_list.model._meta
+        annotations = self.object_list.query.annotations
+        keys = []
+        for term in self.object_list.query.order_by:
+            if isinstance(term, str):
+                descending = term.startswith('-')
+                name = term.lstrip('-')
+            elif (
+                isinstance(term, OrderBy)
+                and isinstance(term.expression, F)
+                and term.nulls_first is None
+                and term.nulls_last is None
+            ):
+                descending = term.descending
+                name = term.expression.name
+            else:
+                return None
+            if name == 'pk':
+                name = opts.pk.name
+            if name in (key for key, _, _ in keys):
+                continue
+            if name in annotations:
+                keys.append((name, descending, True))
+                continue
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.is_relation:
+                return None
+            keys.append((name, descending, field.null))
+        if opts.pk.name not in (name for name, _, _ in keys):
+            return None
+        return keys
+
+    def clean_values(self, values: list) -> list | None:
+        """Convert a cursor's sort key to the types of its fields, None if it does not fit."""
+        if not self.sort_keys or len(values) != len(self.sort_keys):
+            return None
+        opts = self.object_list.model._meta
+        annotations = self.object_list.query.annotations
+        cleaned = []
+        for (name, _, _), value in zip(self.sort_keys, values, strict=True):
+            field = annotations[name].output_field if name in annotations else opts.get_field(name)
+            try:
+                python_value = field.to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                return None
+            # the cursor is only made from rows without nulls in the sort key
+            if python_value is None:
+                return None
+            cleaned.append(python_value)
+        return cleaned
+
+    @cached_property
+    def cursor_values(self) -> list | None:
+        """Get the sort key of the cursor, None without a cursor that can be sought on."""
+        return self.cursor and self.clean_values(self.cursor[1])
+
+    def seeks(self, number: int) -> bool:
+        """Tell whether the page is reached by seeking past the cursor."""
+        return bool(self.cursor) and self.cursor[0] == number and self.cursor_values is not None
+
+    def validate_number(self, number):
+        """Allow pages past the estimate when following a cursor."""
+        if self.seeks(number):
+            return number
+        return super().validate_number(number)
+
+    def seek(self, values: list) -> QuerySet:
+        """Filter to the rows after the given sort key."""
+        nulls_largest = connections[self.object_list.db].features.nulls_order_largest
+        condition = Q()
+        for ix, (name, descending, nullable) in enumerate(self.sort_keys):
+            after = Q(**{f'{name}__{"lt" if descending else "gt"}': values[ix]})
+            if nullable and nulls_largest != descending:
+                after |= Q(**{f'{name}__isnull': True})
+            for prev_ix, (prev_name, _, _) in enumerate(self.sort_keys[:ix]):
+                after &= Q(**{prev_name: values[prev_ix]})
+            condition |= after
+        return self.object_list.filter(condition)
+
+    def page(self, number):
+        """Get a page by seeking when the cursor points at it."""
+        number = self.validate_number(number)
+        # one row more than the page, to tell whether there is a next page
+        if self.seeks(number):
+            rows = list(self.seek(self.cursor_values)[: self.per_page + 1])
+        else:
+            bottom = (number - 1) * self.per_page
+            rows = list(self.object_list[bottom : bottom + self.per_page + 1])
+        object_list = rows[: self.per_page]
+        if not object_list and number > 1:
+            raise EmptyPage('That page contains no results')
+
+        if self.sort_keys and len(rows) > self.per_page:
+            values = [getattr(object_list[-1], name) for name, _, _ in self.sort_keys]
+            if None not in values:
+                self.next_cursor = encode_cursor(number + 1, values)
+        return Page(object_list, number, self)
+
+
+class KeysetPaginationMixin:
+    """Admin mixin paginating the changelist with a KeysetPaginator."""
+
+    paginator = KeysetPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        """Take the cursor out of the query string before the changelist parses filters."""
+        if CURSOR_VAR in request.GET:
+            request.GET = request.GET.copy()
+            request.keyset_cursor = request.GET.pop(CURSOR_VAR)[-1]
+        return super().changelist_view(request, extra_context)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        """Pass the cursor to the paginator."""
+        cursor = getattr(request, 'keyset_cursor', None)
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, cursor=cursor)
+
+    def get_changelist_instance(self, request):
+        """Add the link to the next page."""
+        cl = super().get_changelist_instance(request)
+        next_cursor = getattr(cl.paginator, 'next_cursor', None)
+        cl.next_page_url = next_cursor and cl.get_query_string(
+            {PAGE_VAR: cl.page_num + 1, CURSOR_VAR: next_cursor}
+        )
+        return cl
@@ -1,24 +1,60 @@
 import logging
-from collections import Counter
+from collections.abc import Callable
 
-from main.models import Torrent
+from django.db import transaction
+from django.db.models import QuerySet
 
+from main.models import Title, Torrent
 
 logger = logging.getLogger(__name__)
 
+PARSE_CHUNK_SIZE = 2_000
 
-def parse_title(torrent: Torrent):
-    logger.info(f'parsing title for {torrent}')
-    title = torrent.name.title()
+
+def parse_title(name: str) -> str:
+    """Parse the title text from a torrent name."""
+    title = name.title()
 
     # replace underscores
-    cntr = Counter(title)
-    if cntr['_'] > cntr[' ']:
+    if title.count('_') > title.count(' '):
         title = title.replace('_', ' ')
 
     # stop when getting brackets
     if (ix := title.find('(')) != -1:
         title = title[:ix].strip()
 
-    torrent.title = title
-    torrent.save()
+    return title
+
+
+def parse_titles(
+    queryset: QuerySet[Torrent],
+    chunk_size: int = PARSE_CHUNK_SIZE,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """Set the title of torrents from their names, a chunk at a time.
+
+    Chunks are read by primary key range rather than from one open cursor, because
+    SQLite gives no isolation between a cursor and the updates made while it is open.
+    Each chunk creates its missing titles and updates the foreign keys in bulk.
+    """
+    total = queryset.count()
+    torrents = queryset.order_by('pk').only('pk', 'name')
+    updated = 0
+    last_pk = 0
+    while chunk := list(torrents.filter(pk__gt=last_pk)[:chunk_size]):
+        last_pk = chunk[-1].pk
+        texts = {torrent.pk: parse_title(torrent.name) for torrent in chunk}
+        wanted = {text for text in texts.values() if text}
+        with transaction.atomic():
+            existing = set(Title.objects.filter(text__in=wanted).values_list('text', flat=True))
+            Title.objects.bulk_create(
+                [Title(text=text) for text in wanted - existing], ignore_conflicts=True
+            )
+            for torrent in chunk:
+                torrent.title_id = texts[torrent.pk] or None
+            Torrent.objects.bulk_update(chunk, ['title'])
+        updated += len(chunk)
+        logger.info(f'Parsed titles of {updated:,} of {total:,} torrents')
+        if progress:
+            progress(updated, total)
+    return updated
@@ -0,0 +1,171 @@
+"""Profiling options shared by the management commands.
+
+Commands subclassing ProfiledCommand accept:
+
+- ``--profile`` to run under cProfile, writing ``<command>-<time>.prof`` for snakeviz or
+  pstats and a report of the top functions by cumulative time
+- ``--profile-memory`` to trace allocations with tracemalloc and report the top lines
+- ``--profile-sql`` to time every query and report the slowest and most repeated ones,
+  from any thread of the command but not from processes it starts
+
+Reports are written to PROFILE_DIR (logs/ by default). For sampling a long running
+command without restarting it, attach ``py-spy top --pid <pid>`` instead.
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+TOP = 30
+# collapse "IN (%s, %s, ...)" and multi row VALUES so queries differing only in the
+# number of parameters group together
+PLACEHOLDERS = re.compile(r'\((?:%s, )*%s\)')
+ROWS = re.compile(r'\(\.\.\.\)(?:, \(\.\.\.\))+')
+
+
+class QueryLog:
+    """Execute wrapper timing each query by its SQL."""
+
+    def __init__(self):
+        """Start empty."""
+        self.stats = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0})
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Time the query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            key = ROWS.sub('(...), ...', PLACEHOLDERS.sub('(...)', sql))
+            with self.lock:
+                stats = self.stats[key]
+                stats['count'] += 1
+                stats['total'] += elapsed
+                stats['max'] = max(stats['max'], elapsed)
+
+    def report(self) -> str:
+        """Format the slowest and the most repeated queries."""
+        count = sum(stats['count'] for stats in self.stats.values())
+        total = sum(stats['total'] for stats in self.stats.values())
+        lines = [f'{count:,} queries in {total:.2f}s, {len(self.stats):,} distinct']
+        for title, key in (('Slowest in total', 'total'), ('Most repeated', 'count')):
+            lines += ['', title, f'{"count":>10}{"total s":>10}{"max ms":>10}  sql']
+            ranked = sorted(self.stats.items(), key=lambda item: item[1][key], reverse=True)
+            for sql, stats in ranked[:TOP]:
+                lines.append(
+                    f'{stats["count"]:>10,}{stats["total"]:>10.3f}'
+                    f'{stats["max"] * 1000:>10.2f}  {sql[:500]}'
+                )
+        return '\n'.join(lines)
+
+
+class ProfiledCommand(BaseCommand):
+    """Management command with the profiling options."""
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        """Add the profiling options after the command's own."""
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument('--profile', action='store_true', help='Profile with cProfile')
+        parser.add_argument(
+            '--profile-memory', action='store_true', help='Report the top allocations'
+        )
+        parser.add_argument(
+            '--profile-sql',
+            action='store_true',
+            help='Report the slowest and repeated queries of every thread, '
+            'not those of worker processes',
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        """Run the command under the requested profilers."""
+        name = self.__module__.rsplit('.', 1)[-1]
+        prefix = Path(settings.PROFILE_DIR) / f'{name}-{datetime.now():%Y%m%d-%H%M%S}'
+        with ExitStack() as stack:
+            if options.get('profile_sql'):
+                stack.enter_context(profile_sql(prefix))
+            if options.get('profile_memory'):
+                stack.enter_context(profile_memory(prefix))
+            if options.get('profile'):
+                stack.enter_context(profile_cpu(prefix))
+            return super().execute(*args, **options)
+
+
+@contextmanager
+def profile_cpu(prefix: Path):
+    """Profile the block with cProfile."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(f'{prefix}.prof')
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(TOP)
+        Path(f'{prefix}.prof.txt').write_text(report.getvalue())
+        logger.info(f'Wrote cpu profile to {prefix}.prof and {prefix}.prof.txt')
+
+
+@contextmanager
+def profile_memory(prefix: Path):
+    """Trace the allocations made in the block."""
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lines = [f'current {current / 1e6:,.1f} MB, peak {peak / 1e6:,.1f} MB', '']
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:TOP]]
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        Path(f'{prefix}.mem.txt').write_text('\n'.join(lines))
+        logger.info(f'Wrote allocations to {prefix}.mem.txt (peak {peak / 1e6:,.1f} MB)')
+
+
+@contextmanager
+def profile_sql(prefix: Path):
+    """Time the queries of the block on every connection, including other threads' ones."""
+    query_log = QueryLog()
+    # each thread has its own connections, wrap them as they connect
+    wrapped = []
+
+    def wrap(sender, connection, **kwargs):
+        if query_log not in connection.execute_wrappers:
+            connection.execute_wrappers.append(query_log)
+            wrapped.append(connection)
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(query_log))
+        connection_created.connect(wrap, weak=False)
+        try:
+            yield
+        finally:
+            connection_created.disconnect(wrap)
+            for connection in wrapped:
+                if query_log in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(query_log)
+            prefix.parent.mkdir(parents=True, exist_ok=True)
+            Path(f'{prefix}.sql.txt').write_text(query_log.report())
+            logger.info(f'Wrote query log to {prefix}.sql.txt')
@@ -1,6 +1,7 @@
 import difflib
 import logging
 import re
+from collections.abc import Callable
 from pathlib import Path
 from time import sleep
 
@@ -34,10 +35,14 @@ from main.constants import (
     SUBCATEGORY_SD_TV,
     SUBCATEGORY_UHD,
 )
+from main.ingest import upsert_torrents
+from main.metrics import Metrics
 from main.models import Title, Torrent
 from torrents.settings import BASE_DIR
 
 logger = logging.getLogger(__name__)
+# one line per scraped torrent, quiet unless scrape_sites --log-rows
+row_logger = logging.getLogger(f'{__name__}.rows')
 sleep_time = 0
 last_url = None
 
@@ -74,184 +79,212 @@ def get(url: str) -> requests.Response:
     return res
 
 
-def scrape_sites():
+def scrape_sites(
+    progress: Callable[[int, int], None] | None = None, metrics: Metrics | None = None
+):
     """Scrape sites."""
     logger.info('Scraping sites...')
-    scrape_1337x()
+    scrape_1337x(progress, metrics)
     # scrape_rarbg()
     logger.info('sites scraped.')
 
 
-def scrape_1337x():
+def scrape_1337x(
+    progress: Callable[[int, int], None] | None = None, metrics: Metrics | None = None
+):
     """Scrape all 1337x pages."""
     logger.info('Scraping 1337x...')
-    file_paths = Path(BASE_DIR / '1337x_files').glob('*')
-    for file_path in file_paths:
-        if not str(file_path).endswith('html'):
-            continue
+    metrics = metrics or Metrics('scrape')
+    file_paths = [
+        file_path
+        for file_path in Path(BASE_DIR / '1337x_files').glob('*')
+        if str(file_path).endswith('html')
+    ]
+    for page, file_path in enumerate(file_paths, 1):
         # if 'topmovies' not in str(file_path):
         #     continue
-        data = scrape_1337x_page(file_path)
-        for ix, item in enumerate(data):
-            try:
-                torrent = Torrent.objects.get(url=item['url'])
-                torrent.seeders = item['seeders']
-                torrent.leechers = item['leechers']
-                torrent.save()
-            except Torrent.DoesNotExist:
-                torrent = Torrent.objects.create(site=SITE_1337X, **item)
-            # auto-create title for TV shows
-            auto_add_title(torrent)
-            logger.info(f'{ix}: {torrent}')
+        data = scrape_1337x_page(file_path, metrics)
+        metrics.count('pages')
+        with metrics.stage('upsert'):
+            metrics.count(
+                'upserted', upsert_torrents([{'site': SITE_1337X, **item} for item in data])
+            )
+        # auto-create title for TV shows and movies
+        with metrics.stage('title'):
+            untitled = Torrent.objects.filter(
+                url__in=[item['url'] for item in data],
+                category__in=[CATEGORY_TV_SHOWS, CATEGORY_MOVIES],
+                title__isnull=True,
+            )
+            for torrent in untitled:
+                auto_add_title(torrent)
+                metrics.count('titled')
+        if progress:
+            progress(page, len(file_paths))
     logger.info('finished scraping 1337x')
 
 
-def scrape_1337x_page(file_path):  # noqa PLR0915 PLR0912
+def scrape_1337x_page(file_path, metrics: Metrics | None = None):
     """Scrape list of torrents from 1337x page."""
+    metrics = metrics or Metrics('scrape')
     data = []
-    with Path.open(file_path, errors='ignore') as fp:
+    with metrics.stage('read'), Path.open(file_path, errors='ignore') as fp:
         content = fp.read()
-    html = BeautifulSoup(content, 'html.parser')
+    with metrics.stage('parse'):
+        html = BeautifulSoup(content, 'html.parser')
+        rows = html.find('table', class_='table-list').find_all('tr')
 
-    rows = html.find('table', class_='table-list').find_all('tr')
     for row in rows[1:]:
-        cols = row.find_all('td')
-
-        # subcategory
-        # movies
-        if '/sub/54/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_H264
-            category = CATEGORY_MOVIES
-        elif '/sub/70/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_HEVC
-            category = CATEGORY_MOVIES
-        elif '/sub/73/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_BOLLYWOOD
-            category = CATEGORY_MOVIES
-        elif '/sub/42/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_HD_MOVIES
-            category = CATEGORY_MOVIES
-        elif '/sub/4/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_DUBS
-            category = CATEGORY_MOVIES
-        elif '/sub/1/0' in str(cols[0]) or '/sub/5/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_DVD
-            category = CATEGORY_MOVIES
-        elif '/sub/76/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_UHD
-            category = CATEGORY_MOVIES
-        elif '/sub/2/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_DIVX_MOVIES
-            category = CATEGORY_MOVIES
-        elif '/sub/55/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_MP4
-            category = CATEGORY_MOVIES
-        elif '/sub/9/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_DOCS
-            category = CATEGORY_MOVIES
-
-        # tv
-        elif '/sub/41/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_HD_TV
-            category = CATEGORY_TV_SHOWS
-        elif '/sub/75/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_SD_TV
-            category = CATEGORY_TV_SHOWS
-        elif '/sub/6/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_DIVX_TV
-            category = CATEGORY_TV_SHOWS
-        elif '/sub/71/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_HEVC_TV
-            category = CATEGORY_TV_SHOWS
-        elif '/sub/48/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_DIVX_TV
-            category = CATEGORY_TV_SHOWS
-        elif any(
-            [
-                '/sub/74/0' in str(cols[0]),  # cartoon
-            ]
-        ):
+        with metrics.stage('classify'):
+            item = scrape_1337x_row(row)
+        if item is None:
+            metrics.count('skipped')
             continue
+        row_logger.info(f'{item["category"]} {item["subcategory"]} {item["name"]}')
+        data.append(item)
+    metrics.count('rows', len(data))
+    logger.info(f'finished scraping {file_path} with {len(data)} torrents found')
+    return data
 
-        # games
-        elif '/sub/10/0' in str(cols[0]):
-            subcategory = SUBCATEGORY_PCGAMES
-            category = CATEGORY_GAMES
 
-        # skip
-        elif any(
-            [
-                '/sub/3/0' in str(cols[0]),  # svcd
-                '/sub/11/0' in str(cols[0]),  # ps2
-                '/sub/12/0' in str(cols[0]),  # psp
-                '/sub/13/0' in str(cols[0]),  # xbox
-                '/sub/14/0' in str(cols[0]),  # xbox 360
-                '/sub/17/0' in str(cols[0]),  # other
-                '/sub/34/0' in str(cols[0]),  # tutorials
-                '/sub/35/0' in str(cols[0]),  # sounds
-                '/sub/36/0' in str(cols[0]),  # ebooks
-                '/sub/43/0' in str(cols[0]),  # ps3
-                '/sub/44/0' in str(cols[0]),  # wii
-                '/sub/45/0' in str(cols[0]),  # ds
-                '/sub/56/0' in str(cols[0]),  # android
-                '/sub/67/0' in str(cols[0]),  # unknown platform
-                '/sub/72/0' in str(cols[0]),  # 3DS
-                '/sub/77/0' in str(cols[0]),  # ps4
-                '/sub/82/0' in str(cols[0]),  # switch
-            ]
-        ):
-            continue
-        else:
-            raise ValueError(f'unknown subcategory: {cols[0]}')
+def scrape_1337x_row(row) -> dict | None:  # noqa PLR0915 PLR0912
+    """Classify a row of a 1337x page and extract the torrent, None for skipped rows."""
+    cols = row.find_all('td')
+    cell = str(cols[0])
+
+    # subcategory
+    # movies
+    if '/sub/54/0' in cell:
+        subcategory = SUBCATEGORY_H264
+        category = CATEGORY_MOVIES
+    elif '/sub/70/0' in cell:
+        subcategory = SUBCATEGORY_HEVC
+        category = CATEGORY_MOVIES
+    elif '/sub/73/0' in cell:
+        subcategory = SUBCATEGORY_BOLLYWOOD
+        category = CATEGORY_MOVIES
+    elif '/sub/42/0' in cell:
+        subcategory = SUBCATEGORY_HD_MOVIES
+        category = CATEGORY_MOVIES
+    elif '/sub/4/0' in cell:
+        subcategory = SUBCATEGORY_DUBS
+        category = CATEGORY_MOVIES
+    elif '/sub/1/0' in cell or '/sub/5/0' in cell:
+        subcategory = SUBCATEGORY_DVD
+        category = CATEGORY_MOVIES
+    elif '/sub/76/0' in cell:
+        subcategory = SUBCATEGORY_UHD
+        category = CATEGORY_MOVIES
+    elif '/sub/2/0' in cell:
+        subcategory = SUBCATEGORY_DIVX_MOVIES
+        category = CATEGORY_MOVIES
+    elif '/sub/55/0' in cell:
+        subcategory = SUBCATEGORY_MP4
+        category = CATEGORY_MOVIES
+    elif '/sub/9/0' in cell:
+        subcategory = SUBCATEGORY_DOCS
+        category = CATEGORY_MOVIES
+
+    # tv
+    elif '/sub/41/0' in cell:
+        subcategory = SUBCATEGORY_HD_TV
+        category = CATEGORY_TV_SHOWS
+    elif '/sub/75/0' in cell:
+        subcategory = SUBCATEGORY_SD_TV
+        category = CATEGORY_TV_SHOWS
+    elif '/sub/6/0' in cell:
+        subcategory = SUBCATEGORY_DIVX_TV
+        category = CATEGORY_TV_SHOWS
+    elif '/sub/71/0' in cell:
+        subcategory = SUBCATEGORY_HEVC_TV
+        category = CATEGORY_TV_SHOWS
+    elif '/sub/48/0' in cell:
+        subcategory = SUBCATEGORY_DIVX_TV
+        category = CATEGORY_TV_SHOWS
+    elif any(
+        [
+            '/sub/74/0' in cell,  # cartoon
+        ]
+    ):
+        return None
+
+    # games
+    elif '/sub/10/0' in cell:
+        subcategory = SUBCATEGORY_PCGAMES
+        category = CATEGORY_GAMES
+
+    # skip
+    elif any(
+        [
+            '/sub/3/0' in cell,  # svcd
+            '/sub/11/0' in cell,  # ps2
+            '/sub/12/0' in cell,  # psp
+            '/sub/13/0' in cell,  # xbox
+            '/sub/14/0' in cell,  # xbox 360
+            '/sub/17/0' in cell,  # other
+            '/sub/34/0' in cell,  # tutorials
+            '/sub/35/0' in cell,  # sounds
+            '/sub/36/0' in cell,  # ebooks
+            '/sub/43/0' in cell,  # ps3
+            '/sub/44/0' in cell,  # wii
+            '/sub/45/0' in cell,  # ds
+            '/sub/56/0' in cell,  # android
+            '/sub/67/0' in cell,  # unknown platform
+            '/sub/72/0' in cell,  # 3DS
+            '/sub/77/0' in cell,  # ps4
+            '/sub/82/0' in cell,  # switch
+        ]
+    ):
+        return None
+    else:
+        raise ValueError(f'unknown subcategory: {cols[0]}')
 
-        # category
-        if not category or not subcategory:
-            raise ValueError(f'Unknown category for sub {cols[0]}')
+    # category
+    if not category or not subcategory:
+        raise ValueError(f'Unknown category for sub {cols[0]}')
 
-        # name
-        try:
-            name = cols[0].find_all('a')[1]
-        except IndexError:
-            name = cols[0].find_all('a')[0]
-        name = name.text
+    # name
+    try:
+        name = cols[0].find_all('a')[1]
+    except IndexError:
+        name = cols[0].find_all('a')[0]
+    name = name.text
 
-        # url
-        try:
-            url = cols[0].find_all('a')[1]
-        except IndexError:
-            url = cols[0].find_all('a')[0]
-        url = f'https://1337x.to{url["href"]}'
+    # url
+    try:
+        url = cols[0].find_all('a')[1]
+    except IndexError:
+        url = cols[0].find_all('a')[0]
+    url = f'https://1337x.to{url["href"]}'
 
-        # seeders
-        seeders = int(cols[1].text)
+    # seeders
+    seeders = int(cols[1].text)
 
-        # leechers
-        leechers = int(cols[2].text)
+    # leechers
+    leechers = int(cols[2].text)
 
-        # upload date
-        uploaded_at = make_aware(parse(cols[3].text))
+    # upload date
+    uploaded_at = make_aware(parse(cols[3].text))
 
-        # size
-        size_txt = cols[4].find(text=True)
-        size = size_txt_to_int(size_txt)
+    # size
+    size_txt = cols[4].find(text=True)
+    size = size_txt_to_int(size_txt)
 
-        # uploader
-        uploader = cols[5].text
+    # uploader
+    uploader = cols[5].text
 
-        item = {
-            'category': category,
-            'subcategory': subcategory,
-            'name': name,
-            'url': url,
-            'seeders': seeders,
-            'leechers': leechers,
-            'uploaded_at': uploaded_at,
-            'size': size,
-            'uploader': uploader,
-        }
-        data.append(item)
-    logger.info(f'finished scraping {file_path} with {len(data)} torrents found')
-    return data
+    item = {
+        'category': category,
+        'subcategory': subcategory,
+        'name': name,
+        'url': url,
+        'seeders': seeders,
+        'leechers': leechers,
+        'uploaded_at': uploaded_at,
+        'size': size,
+        'uploader': uploader,
+    }
+    return item
 
 
 def scrape_1337x_detail_page(item):
@@ -275,21 +308,18 @@ def scrape_rarbg():
         if not str(file_path).endswith('html'):
             continue
         data = scrape_rarbg_page(file_path)
-        for ix, item in enumerate(data):
-            try:
-                torrent = Torrent.objects.get(url=item['url'])
-                torrent.site = SITE_RARBG
-                torrent.seeders = item['seeders']
-                torrent.leechers = item['leechers']
-                torrent.save()
-            except Torrent.DoesNotExist:
-                torrent = Torrent.objects.create(
-                    site=SITE_RARBG,
-                    category=CATEGORY_GAMES,
-                    subcategory=SUBCATEGORY_PCGAMES,
+        # known torrents only get the site, seeders and leechers refreshed
+        upsert_torrents(
+            [
+                {
+                    'site': SITE_RARBG,
+                    'category': CATEGORY_GAMES,
+                    'subcategory': SUBCATEGORY_PCGAMES,
                     **item,
-                )
-            logger.info(f'{ix}: {torrent}')
+                }
+                for item in data
+            ]
+        )
     logger.info(f'finished scraping {SITE_RARBG}')
 
 
@@ -0,0 +1,133 @@
+"""Substring search of torrent names and title texts through fts5 trigram indexes.
+
+On sqlite the indexes are external content fts5 tables kept in sync by triggers, created
+by migration 0012. They are keyed on the rowid, which for main_title is the implicit one
+as its primary key is text, so a VACUUM may renumber it under the index. Rebuilding a
+table, as sqlite does to alter a field, drops its triggers. check_search_indexes puts
+both right and runs after every migrate.
+"""
+
+import logging
+
+from django.db import DatabaseError, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import QuerySet
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+
+logger = logging.getLogger(__name__)
+
+# the trigram tokenizer cannot match shorter terms
+MIN_TERM_LENGTH = 3
+# table, indexed column, rowid column
+SEARCH_INDEXES = (
+    ('main_torrent', 'name', 'id'),
+    ('main_title', 'text', 'rowid'),
+)
+SEARCH_INDEX_MIGRATION = ('main', '0012_torrent_title_search_index')
+
+
+def fts_query(search_term: str) -> str | None:
+    """Turn an admin search term into an fts5 query, or None if it cannot be matched.
+
+    Every term has to match as a substring, like the admin's icontains lookups.
+    """
+    phrases = []
+    for bit in smart_split(search_term):
+        term = bit
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+            term = unescape_string_literal(bit)
+        if len(term) < MIN_TERM_LENGTH:
+            return None
+        phrases.append('"{}"'.format(term.replace('"', '""')))
+    return ' AND '.join(phrases) or None
+
+
+def search(queryset: QuerySet, search_term: str) -> QuerySet | None:
+    """Filter a torrent or title queryset through its fts5 index.
+
+    Returns None when the database has no index or the term is too short for it.
+    """
+    match = fts_query(search_term)
+    if not match or connections[queryset.db].vendor != 'sqlite':
+        return None
+    opts = queryset.model._meta
+    table = opts.db_table
+    sql = (
+        f'SELECT "{opts.pk.column}" FROM "{table}" WHERE rowid IN '  # noqa S608
+        f'(SELECT rowid FROM "{table}_fts" WHERE "{table}_fts" MATCH %s)'
+    )
+    return queryset.filter(pk__in=RawSQL(sql, [match]))  # noqa S611
+
+
+def search_trigger_sql(table: str, column: str, rowid: str) -> list[str]:
+    """Get the statements creating the triggers that keep an fts5 index in sync."""
+    fts = f'{table}_fts'
+    return [
+        f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '  # noqa S608
+        f'INSERT INTO {fts}(rowid, {column}) VALUES (new.{rowid}, new.{column}); END',
+        f'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '  # noqa S608
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{rowid}, "
+        f'old.{column}); END',
+        f'CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN '  # noqa S608
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{rowid}, "
+        f'old.{column}); '
+        f'INSERT INTO {fts}(rowid, {column}) VALUES (new.{rowid}, new.{column}); END',
+    ]
+
+
+def check_search_indexes(using: str = 'default') -> list[str]:
+    """Recreate missing search indexes and triggers and rebuild indexes out of sync.
+
+    Returns the tables whose index was repaired.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return []
+    if SEARCH_INDEX_MIGRATION not in MigrationRecorder(connection).applied_migrations():
+        return []
+
+    repaired = []
+    with connection.cursor() as cursor:
+        for table, column, rowid in SEARCH_INDEXES:
+            fts = f'{table}_fts'
+            triggers = {f'{fts}_insert', f'{fts}_delete', f'{fts}_update'}
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND "
+                'name IN (%s, %s, %s, %s)',
+                [fts, *sorted(triggers)],
+            )
+            found = {name for (name,) in cursor.fetchall()}
+            if fts not in found:
+                cursor.execute(
+                    f'CREATE VIRTUAL TABLE {fts} USING fts5({column}, '
+                    f"content='{table}', content_rowid='{rowid}', tokenize='trigram')"
+                )
+            if not triggers <= found:
+                for trigger in triggers:
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                for sql in search_trigger_sql(table, column, rowid):
+                    cursor.execute(sql)
+                logger.warning(f'Recreated the search triggers of {table}')
+            else:
+                try:
+                    # a rank of 1 compares the index with the table's rows too
+                    cursor.execute(
+                        f"INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)"  # noqa S608
+                    )
+                    continue
+                except DatabaseError:
+                    logger.warning(f'Search index of {table} is out of sync')
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")  # noqa S608
+            repaired.append(table)
+    return repaired
+
+
+class FullTextSearchMixin:
+    """Admin mixin searching the fts5 index instead of LIKE scans over every row."""
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search the index, falling back to the default search."""
+        if search_term and (results := search(queryset, search_term)) is not None:
+            return results, False
+        return super().get_search_results(request, queryset, search_term)
@@ -1,11 +1,28 @@
+import threading
+import time
 from datetime import timedelta
 
-from django.db.models import DurationField, ExpressionWrapper, F, Max, Min, QuerySet
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Min, QuerySet
 from django.utils import timezone
 from django.utils.timezone import now
 
-from main.constants import CATEGORY_GAMES, CATEGORY_MOVIES, CATEGORY_TV_SHOWS, STATUS_FINISHED
-from main.models import Title, Torrent
+from main.constants import (
+    CATEGORY_GAMES,
+    CATEGORY_MOVIES,
+    CATEGORY_TV_SHOWS,
+    COUNTRY_ZA,
+    STATUS_FINISHED,
+)
+from main.geo import SpatialIndex
+from main.models import Postcode, Title, Torrent
+
+DASHBOARD_CACHE_KEY = 'dashboard_stats'
+DASHBOARD_CACHE_TIMEOUT = 60 * 60
+POSTCODE_INDEX_VERSION_KEY = 'postcode_index_version'
+POSTCODE_INDEX_CHECK_INTERVAL = 5  # seconds between looking for changes by other processes
+POSTCODE_FIELDS = ('country', 'code', 'area', 'level', 'latitude', 'longitude')
 
 
 def list_titles_without_torrents():
@@ -43,3 +60,124 @@ def list_recent_games() -> QuerySet[Title]:
         .order_by('-status_at')[:10]
     )
     return recent_games
+
+
+def list_category_counts() -> QuerySet:
+    """List the number of torrents per category."""
+    return Torrent.objects.order_by().values('category').annotate(count=Count('id'))
+
+
+def count_torrents_by_category() -> dict[str, int]:
+    """Count torrents per category in one grouped query."""
+    return {row['category']: row['count'] for row in list_category_counts()}
+
+
+def get_dashboard_stats() -> dict:
+    """Get the home dashboard numbers, cached until titles or torrents change."""
+    stats = cache.get(DASHBOARD_CACHE_KEY)
+    if stats is None:
+        counts = count_torrents_by_category()
+        stats = {
+            'count_titles_without_torrents': list_titles_without_torrents().count(),
+            'count_old_tv': list_old_tv().count(),
+            'count_movies': counts.get(CATEGORY_MOVIES, 0),
+            'count_series': counts.get(CATEGORY_TV_SHOWS, 0),
+            'count_games': counts.get(CATEGORY_GAMES, 0),
+            'recent_games': list(list_recent_games())[::-1],
+        }
+        cache.set(DASHBOARD_CACHE_KEY, stats, DASHBOARD_CACHE_TIMEOUT)
+    return stats
+
+
+async def aget_dashboard_stats() -> dict:
+    """Get the home dashboard numbers with the async cache and ORM."""
+    stats = await cache.aget(DASHBOARD_CACHE_KEY)
+    if stats is None:
+        counts = {row['category']: row['count'] async for row in list_category_counts()}
+        stats = {
+            'count_titles_without_torrents': await list_titles_without_torrents().acount(),
+            'count_old_tv': await list_old_tv().acount(),
+            'count_movies': counts.get(CATEGORY_MOVIES, 0),
+            'count_series': counts.get(CATEGORY_TV_SHOWS, 0),
+            'count_games': counts.get(CATEGORY_GAMES, 0),
+            'recent_games': [game async for game in list_recent_games()][::-1],
+        }
+        await cache.aset(DASHBOARD_CACHE_KEY, stats, DASHBOARD_CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate_dashboard_stats():
+    """Drop the cached dashboard numbers."""
+    cache.delete(DASHBOARD_CACHE_KEY)
+
+
+class PostcodeIndex:
+    """Spatial index over every postcode, with their fields by position."""
+
+    def __init__(self, version):
+        """Load the postcodes and index them."""
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.postcodes = list(Postcode.objects.order_by('country', 'code').values(*POSTCODE_FIELDS))
+        self.positions = {
+            (postcode['country'], postcode['code']): i for i, postcode in enumerate(self.postcodes)
+        }
+        self.index = SpatialIndex(
+            np.array([postcode['latitude'] for postcode in self.postcodes], dtype=float),
+            np.array([postcode['longitude'] for postcode in self.postcodes], dtype=float),
+        )
+
+    def rows(self, indices: np.ndarray, km: np.ndarray) -> list[dict]:
+        """Get the postcodes at the positions with their distances."""
+        return [
+            {**self.postcodes[i], 'km': round(d, 3)}
+            for i, d in zip(indices.tolist(), km.tolist(), strict=True)
+        ]
+
+
+_postcode_index: PostcodeIndex | None = None
+_postcode_index_lock = threading.Lock()
+
+
+def get_postcode_index() -> PostcodeIndex:
+    """Get the process wide postcode index, built on first use and rebuilt after changes.
+
+    Changes made in this process drop the index through the Postcode signals, changes
+    made by other processes are noticed through a version stamp in the cache.
+    """
+    global _postcode_index  # noqa PLW0603
+    index = _postcode_index
+    if index is not None and time.monotonic() - index.checked_at < POSTCODE_INDEX_CHECK_INTERVAL:
+        return index
+    with _postcode_index_lock:
+        version = cache.get(POSTCODE_INDEX_VERSION_KEY)
+        index = _postcode_index
+        if index is None or index.version != version:
+            index = _postcode_index = PostcodeIndex(version)
+        index.checked_at = time.monotonic()
+        return index
+
+
+def invalidate_postcode_index():
+    """Drop the postcode index of this process and have the others rebuild theirs."""
+    global _postcode_index  # noqa PLW0603
+    _postcode_index = None
+    cache.set(POSTCODE_INDEX_VERSION_KEY, time.time_ns(), None)
+
+
+def list_nearest_postcodes(lat: float, lon: float, k: int = 1) -> list[dict]:
+    """List the k postcodes nearest to a point, nearest first."""
+    index = get_postcode_index()
+    return index.rows(*index.index.nearest(lat, lon, k))
+
+
+def list_postcodes_within(code: int, km: float, country: str = COUNTRY_ZA) -> list[dict] | None:
+    """List the other postcodes within km of a postcode, nearest first, None if unknown."""
+    index = get_postcode_index()
+    position = index.positions.get((country, code))
+    if position is None:
+        return None
+    postcode = index.postcodes[position]
+    indices, distances = index.index.within(postcode['latitude'], postcode['longitude'], km)
+    others = indices != position
+    return index.rows(indices[others], distances[others])
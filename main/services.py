@@ -0,0 +1,157 @@
+import logging
+from collections.abc import Callable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, QuerySet
+from django.utils.timezone import now
+
+from main.metrics import Metrics
+from main.models import Title, Torrent
+from main.scraper import scrape_sites
+from main.selectors import invalidate_dashboard_stats, list_old_tv, list_titles_without_torrents
+
+logger = logging.getLogger(__name__)
+
+Progress = Callable[[int, int], None]
+
+PRUNE_CHUNK_SIZE = 5_000
+STATS_BATCH_SIZE = 1_000
+
+
+def phase_progress(progress: Progress | None, phase: int, phases: int) -> Progress | None:
+    """Report the progress of one of several steps as a percentage of the whole.
+
+    The steps count different things, so each is given an equal share and the job's
+    progress only moves forward.
+    """
+    if progress is None:
+        return None
+
+    def report(done: int, total: int):
+        share = done / total if total else 1
+        progress(round((phase + share) * 100 / phases), 100)
+
+    return report
+
+
+def prune_old_torrents(chunk_size: int = PRUNE_CHUNK_SIZE, progress: Progress | None = None):
+    """Delete old tv and movie torrents in id ranges, one transaction per range.
+
+    Nothing references a torrent, so the rows are deleted with a raw DELETE instead
+    of going through the collector, which would load every row into memory first.
+    """
+    old_tv = list_old_tv()
+    bounds = old_tv.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+
+    total = bounds['high'] - bounds['low'] + 1
+    deleted = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        with transaction.atomic():
+            chunk = old_tv.filter(id__gte=start, id__lt=start + chunk_size)
+            deleted += chunk._raw_delete(chunk.db)
+        done = min(start + chunk_size - bounds['low'], total)
+        logger.info(f'Deleted {deleted:,} old torrents ({done / total:.0%} of id range)')
+        if progress:
+            progress(done, total)
+    return deleted
+
+
+def prune_titles_without_torrents(
+    chunk_size: int = PRUNE_CHUNK_SIZE, progress: Progress | None = None
+):
+    """Delete titles without torrents in primary key ranges, one transaction per range."""
+    empty = list_titles_without_torrents().order_by('text')
+    total = empty.count()
+    deleted = 0
+    last = None
+    while True:
+        remaining = empty.filter(text__gt=last) if last is not None else empty
+        boundary = remaining.values_list('text', flat=True)[chunk_size - 1 : chunk_size].first()
+        with transaction.atomic():
+            chunk = remaining.filter(text__lte=boundary) if boundary is not None else remaining
+            deleted += chunk._raw_delete(chunk.db)
+        logger.info(f'Deleted {deleted:,} of {total:,} titles without torrents')
+        if progress:
+            progress(deleted, total)
+        if boundary is None:
+            break
+        last = boundary
+    return deleted
+
+
+def prune(chunk_size: int = PRUNE_CHUNK_SIZE, progress: Progress | None = None):
+    """Delete old torrents and then the titles left without torrents."""
+    torrents = prune_old_torrents(chunk_size, phase_progress(progress, 0, 2))
+    titles = prune_titles_without_torrents(chunk_size, phase_progress(progress, 1, 2))
+    invalidate_dashboard_stats()
+    logger.info(f'Pruned {torrents:,} torrents and {titles:,} titles')
+    return torrents, titles
+
+
+def mark_titles(queryset: QuerySet, status: int) -> int:
+    """Set the status of the titles in one UPDATE, returning the number of rows changed."""
+    pks = queryset.order_by().values('pk')
+    count = Title.objects.filter(pk__in=pks).update(status=status, status_at=now())
+    invalidate_dashboard_stats()
+    return count
+
+
+def refresh_title_stats(queryset: QuerySet, progress: Progress | None = None) -> int:
+    """Update upload stats and priority of the titles from grouped queries.
+
+    The stats are read a chunk of titles at a time rather than from one open cursor,
+    because on sqlite a connection still reading cannot take the write lock once
+    another process has written. Titles without torrents are left as they are.
+    Returns the number of titles updated.
+    """
+    stats = (
+        Torrent.objects.filter(title__in=queryset.order_by().values('pk'))
+        .values('title')
+        .annotate(earliest=Min('uploaded_at'), latest=Max('uploaded_at'))
+        .order_by('title')
+    )
+    fields = ['earliest_upload_at', 'latest_upload_at', 'priority', 'updated_at']
+    total = queryset.count() if progress else 0
+    updated = 0
+    last = None
+    while chunk := list(
+        (stats.filter(title__gt=last) if last is not None else stats)[:STATS_BATCH_SIZE]
+    ):
+        last = chunk[-1]['title']
+        titles = [
+            Title(
+                pk=row['title'],
+                earliest_upload_at=row['earliest'],
+                latest_upload_at=row['latest'],
+                priority=Title.calculate_priority(row['earliest'], row['latest']),
+                updated_at=now(),
+            )
+            for row in chunk
+        ]
+        Title.objects.bulk_update(titles, fields)
+        updated += len(titles)
+        if progress:
+            progress(updated, total)
+    invalidate_dashboard_stats()
+    logger.info(f'Updated stats of {updated:,} titles')
+    return updated
+
+
+def scrape(progress: Progress | None = None) -> Metrics:
+    """Scrape the sites and update the titles, exporting the metrics of the run."""
+    metrics = Metrics('scrape')
+    logger.info('scraping sites')
+    scrape_sites(phase_progress(progress, 0, 3), metrics)
+
+    logger.info('updating titles')
+    with metrics.stage('stats'):
+        prune_titles_without_torrents(progress=phase_progress(progress, 1, 3))
+        refresh_title_stats(Title.objects.all(), phase_progress(progress, 2, 3))
+
+    invalidate_dashboard_stats()
+    metrics.export(settings.METRICS_DIR)
+    logger.info(metrics.summary())
+    return metrics
@@ -0,0 +1,22 @@
+"""Signal receivers, connected when the app is ready."""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from main.models import Postcode
+from main.search import check_search_indexes
+from main.selectors import invalidate_postcode_index
+
+
+@receiver([post_save, post_delete], sender=Postcode)
+def postcode_changed(sender, using, **kwargs):
+    """Rebuild the postcode index once the change is committed."""
+    transaction.on_commit(invalidate_postcode_index, using=using)
+
+
+@receiver(post_migrate)
+def migrated(sender, using, **kwargs):
+    """Repair the search indexes a migration may have left without triggers."""
+    if sender.name == 'main':
+        check_search_indexes(using)
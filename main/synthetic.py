@@ -0,0 +1,419 @@
+import html
+import io
+import logging
+import random
+import zipfile
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils.timezone import now
+
+from main.constants import (
+    CATEGORY_GAMES,
+    CATEGORY_MOVIES,
+    CATEGORY_TV_SHOWS,
+    SITE_1337X,
+    SITE_RARBG,
+    STATUS_FINISHED,
+    STATUS_NEW,
+    STATUS_SKIPPED,
+    SUBCATEGORY_BOLLYWOOD,
+    SUBCATEGORY_DIVX_TV,
+    SUBCATEGORY_H264,
+    SUBCATEGORY_HD_MOVIES,
+    SUBCATEGORY_HD_TV,
+    SUBCATEGORY_HEVC,
+    SUBCATEGORY_HEVC_TV,
+    SUBCATEGORY_PCGAMES,
+    SUBCATEGORY_SD_TV,
+    SUBCATEGORY_UHD,
+)
+from main.models import Postcode, Title, Torrent
+from main.scraper import size_txt_to_int
+from main.selectors import invalidate_postcode_index
+
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_UPLOADER = 'synthetic'
+
+# 1337x sub ids as recognised by scraper.scrape_1337x_page
+SUBCATEGORIES = {
+    CATEGORY_MOVIES: (
+        (54, SUBCATEGORY_H264),
+        (70, SUBCATEGORY_HEVC),
+        (73, SUBCATEGORY_BOLLYWOOD),
+        (42, SUBCATEGORY_HD_MOVIES),
+        (76, SUBCATEGORY_UHD),
+    ),
+    CATEGORY_TV_SHOWS: (
+        (41, SUBCATEGORY_HD_TV),
+        (75, SUBCATEGORY_SD_TV),
+        (6, SUBCATEGORY_DIVX_TV),
+        (71, SUBCATEGORY_HEVC_TV),
+    ),
+    CATEGORY_GAMES: ((10, SUBCATEGORY_PCGAMES),),
+}
+CATEGORY_WEIGHTS = {CATEGORY_MOVIES: 45, CATEGORY_TV_SHOWS: 45, CATEGORY_GAMES: 10}
+STATUS_WEIGHTS = {STATUS_NEW: 60, STATUS_SKIPPED: 25, STATUS_FINISHED: 15}
+LEVEL_WEIGHTS = {'suburb': 40, 'neighbourhood': 15, 'town': 20, 'village': 15, 'city': 10}
+
+WORDS = (
+    'Silent River Iron Harbor Last Kingdom Dark Winter Broken Crown Night Shift Red Desert '
+    'Lost Signal Hidden Valley Golden Hour Cold Case Deep Space Wild Frontier Black Mirror '
+    'Burning Sky Empty Road Glass Tower Paper Moon Stone Garden Blue Planet Shadow Line '
+    'Northern Lights Final Score Rising Tide Open Water Steel Heart Quiet Storm Fallen Star '
+    'Secret Service Long Way Home Little Fires Great Escape Small Town Big City Family Ties'
+).split()
+RESOLUTIONS = ('480p', '720p', '1080p', '2160p')
+SOURCES = ('WEBRip', 'WEB-DL', 'BluRay', 'HDTV', 'BRRip', 'HDRip')
+CODECS = ('x264', 'x265', 'H264', 'HEVC', 'XviD')
+GROUPS = ('YIFY', 'RARBG', 'GalaxyRG', 'EZTVx', 'ION10', 'PSA', 'TGx', 'NOGRP')
+GAME_GROUPS = ('FitGirl', 'CODEX', 'DODI', 'ElAmigos', 'GOG', 'TENOKE')
+
+# South Africa bounding box
+LATITUDE_RANGE = (-34.8, -22.1)
+LONGITUDE_RANGE = (16.5, 32.9)
+
+# postal code formats of the synthetic GeoNames countries, # a digit and ? a letter
+GEONAMES_FORMATS = {
+    'ZA': '####',
+    'US': '#####',
+    'DE': '#####',
+    'FR': '#####',
+    'AU': '####',
+    'IN': '######',
+    'BR': '#####-###',
+    'GB': '??# #??',
+    'NL': '#### ??',
+    'CA': '?#?',
+}
+
+RARBG_SHARE = 0.3
+GIGABYTE_SHARE = 0.7
+EMPTY_WORK_SHARE = 0.01
+UNTITLED_SHARE = 0.05
+
+
+@dataclass
+class Work:
+    """A synthetic movie, episode or game with its title and torrents."""
+
+    category: str
+    words: list[str]
+    year: int
+    season: int | None = None
+    episode: int | None = None
+    torrents: list[dict] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """Title text as scraper.auto_add_title would derive it."""
+        series = ' '.join(self.words)
+        if self.category == CATEGORY_TV_SHOWS:
+            return f'{series} S{self.season:02d}E{self.episode:02d}'
+        if self.category == CATEGORY_MOVIES:
+            return f'{series} {self.year}'
+        return series
+
+
+class SyntheticDataset:
+    """Deterministic generator of torrents, titles and postcodes.
+
+    The same seed and anchor always produce the same rows, so runs at different
+    scales are comparable.
+    """
+
+    def __init__(self, seed: int = 42, anchor: datetime | None = None, torrents_per_title=5):
+        """Set up the generator with a seed and the newest upload date."""
+        self.seed = seed
+        self.anchor = anchor or now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.torrents_per_title = torrents_per_title
+
+    def _choice(self, rng: random.Random, weights: dict):
+        return rng.choices(tuple(weights), weights=tuple(weights.values()))[0]
+
+    def _work(self, rng: random.Random) -> Work:
+        category = self._choice(rng, CATEGORY_WEIGHTS)
+        words = rng.sample(WORDS, rng.randint(1, 4))
+        year = rng.randint(1990, self.anchor.year)
+        if category == CATEGORY_TV_SHOWS:
+            return Work(category, words, year, rng.randint(1, 12), rng.randint(1, 24))
+        return Work(category, words, year)
+
+    def _release_name(self, rng: random.Random, work: Work) -> str:
+        if work.category == CATEGORY_GAMES:
+            version = f'v{rng.randint(1, 3)}.{rng.randint(0, 9)}.{rng.randint(0, 99)}'
+            return f'{" ".join(work.words)} {version}-{rng.choice(GAME_GROUPS)}'
+        parts = ['.'.join(work.words)]
+        if work.category == CATEGORY_TV_SHOWS:
+            parts.append(f'S{work.season:02d}E{work.episode:02d}')
+        else:
+            parts.append(str(work.year))
+        parts += [rng.choice(RESOLUTIONS), rng.choice(SOURCES), rng.choice(CODECS)]
+        return f'{".".join(parts)}-{rng.choice(GROUPS)}'
+
+    def _torrent(self, rng: random.Random, work: Work, number: int) -> dict:
+        sub_id, subcategory = rng.choice(SUBCATEGORIES[work.category])
+        name = self._release_name(rng, work)
+        site = (
+            SITE_RARBG
+            if work.category == CATEGORY_GAMES and rng.random() < RARBG_SHARE
+            else SITE_1337X
+        )
+        slug = name.replace(' ', '-')
+        if site == SITE_RARBG:
+            url = f'https://rarbgtor.org/torrent/{number}/{slug}/'
+        else:
+            url = f'https://1337x.to/torrent/{number}/{slug}/'
+        size_txt = (
+            f'{rng.uniform(0.2, 60):.2f} GB'
+            if rng.random() < GIGABYTE_SHARE
+            else (f'{rng.uniform(100, 999):.1f} MB')
+        )
+        return {
+            'site': site,
+            'sub_id': sub_id,
+            'category': work.category,
+            'subcategory': subcategory,
+            'name': name,
+            'url': url,
+            'seeders': min(int(rng.paretovariate(1.2)) - 1, 100_000),
+            'leechers': min(int(rng.paretovariate(1.5)) - 1, 100_000),
+            'uploaded_at': self.anchor - timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 4)),
+            'size_txt': size_txt,
+            'size': size_txt_to_int(size_txt),
+            'uploader': SYNTHETIC_UPLOADER,
+        }
+
+    def iter_works(self, torrents: int) -> Iterator[Work]:
+        """Yield works with their torrents until the torrent count is reached.
+
+        About 1% of the works have no torrents, so the clean-up selectors have something
+        to find.
+        """
+        rng = random.Random(self.seed)
+        produced = 0
+        while produced < torrents:
+            work = self._work(rng)
+            if rng.random() >= EMPTY_WORK_SHARE:
+                count = min(rng.randint(1, 2 * self.torrents_per_title - 1), torrents - produced)
+                for _ in range(count):
+                    produced += 1
+                    work.torrents.append(self._torrent(rng, work, produced))
+            yield work
+
+    def title_for(self, rng: random.Random, work: Work) -> Title:
+        """Build the title of a work including its stats."""
+        status = self._choice(rng, STATUS_WEIGHTS)
+        title = Title(
+            text=work.text,
+            status=status,
+            status_at=None
+            if status == STATUS_NEW
+            else self.anchor - timedelta(days=rng.randint(0, 365)),
+            year=work.year if work.category != CATEGORY_TV_SHOWS else None,
+            series=' '.join(work.words) if work.category == CATEGORY_TV_SHOWS else None,
+            season=work.season,
+            episode=work.episode,
+        )
+        if work.torrents:
+            title.earliest_upload_at = min(t['uploaded_at'] for t in work.torrents)
+            title.latest_upload_at = max(t['uploaded_at'] for t in work.torrents)
+            title.priority = (self.anchor - title.earliest_upload_at).days + (
+                self.anchor - title.latest_upload_at
+            ).days
+        return title
+
+    def load_torrents(self, torrents: int, batch_size: int = 5_000) -> int:
+        """Bulk insert titles and torrents, returning the number of torrents inserted.
+
+        About 5% of the torrents are left without a title for the untitled filter.
+        """
+        rng = random.Random(self.seed + 1)
+        titles, rows, inserted = {}, [], 0
+
+        def flush():
+            nonlocal inserted
+            with transaction.atomic():
+                Title.objects.bulk_create(titles.values(), ignore_conflicts=True)
+                last_pk = Torrent.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+                Torrent.objects.bulk_create(rows, ignore_conflicts=True)
+                # rows skipped as conflicts get no id, so the new ones are those past the last
+                inserted += Torrent.objects.filter(pk__gt=last_pk).count()
+            logger.info(f'Inserted {inserted:,} of {torrents:,} torrents')
+            titles.clear()
+            rows.clear()
+
+        for work in self.iter_works(torrents):
+            titles.setdefault(work.text, self.title_for(rng, work))
+            for item in work.torrents:
+                untitled = rng.random() < UNTITLED_SHARE
+                rows.append(build_torrent(item, None if untitled else work.text))
+            if len(rows) >= batch_size:
+                flush()
+        if rows or titles:
+            flush()
+
+        # created_at is auto_now_add, so backdate it in one statement
+        Torrent.objects.filter(uploader=SYNTHETIC_UPLOADER).update(created_at=F('uploaded_at'))
+        return inserted
+
+    def load_postcodes(self, postcodes: int, batch_size: int = 5_000) -> int:
+        """Bulk insert postcodes numbered from 1, returning the number generated."""
+        rng = random.Random(self.seed + 2)
+        batch = []
+        for code in range(1, postcodes + 1):
+            batch.append(
+                Postcode(
+                    code=code,
+                    area=' '.join(rng.sample(WORDS, rng.randint(1, 2))),
+                    level=self._choice(rng, LEVEL_WEIGHTS),
+                    latitude=round(rng.uniform(*LATITUDE_RANGE), 4),
+                    longitude=round(rng.uniform(*LONGITUDE_RANGE), 4),
+                )
+            )
+            if len(batch) >= batch_size:
+                Postcode.objects.bulk_create(batch, ignore_conflicts=True)
+                batch.clear()
+        if batch:
+            Postcode.objects.bulk_create(batch, ignore_conflicts=True)
+        # bulk inserts send no signals
+        invalidate_postcode_index()
+        logger.info(f'Inserted {postcodes:,} postcodes')
+        return postcodes
+
+    def iter_site_torrents(self, site: str, torrents: int) -> Iterator[dict]:
+        """Yield the torrents of one site in the same order as load_torrents."""
+        for work in self.iter_works(torrents):
+            for item in work.torrents:
+                if item['site'] == site:
+                    yield item
+
+    def write_pages(self, directory: Path, torrents: int, pages: int, rows_per_page: int = 50):
+        """Write 1337x and rarbg listing pages for the scraper to pick up offline."""
+        for site, render in ((SITE_1337X, render_1337x_page), (SITE_RARBG, render_rarbg_page)):
+            site_dir = directory / f'{site}_files'
+            site_dir.mkdir(parents=True, exist_ok=True)
+            items = self.iter_site_torrents(site, torrents)
+            for page in range(1, pages + 1):
+                chunk = [item for _, item in zip(range(rows_per_page), items, strict=False)]
+                if not chunk:
+                    break
+                file_path = site_dir / f'synthetic-{page:05d}.html'
+                file_path.write_text(render(chunk), encoding='utf-8')
+            logger.info(f'Wrote {site} pages to {site_dir}')
+
+    def write_geonames(self, path: Path, lines: int) -> Path:
+        """Write a GeoNames postal code dump of the countries in GEONAMES_FORMATS.
+
+        A .zip path gets the dump zipped as allCountries.txt. Codes repeat within a
+        country, and some formats have letters, as in the real dumps.
+        """
+        rng = random.Random(self.seed + 3)
+        countries = tuple(GEONAMES_FORMATS)
+        digits, letters = '0123456789', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+        def code(country: str) -> str:
+            return ''.join(
+                rng.choice(digits) if char == '#' else rng.choice(letters) if char == '?' else char
+                for char in GEONAMES_FORMATS[country]
+            )
+
+        def write(out):
+            for _ in range(lines):
+                country = rng.choice(countries)
+                place = ' '.join(rng.sample(WORDS, rng.randint(1, 2)))
+                admin = rng.choice(WORDS)
+                out.write(
+                    f'{country}\t{code(country)}\t{place}\t{admin}\t{rng.randint(1, 99)}'
+                    f'\t\t\t\t\t{rng.uniform(-60, 70):.4f}\t{rng.uniform(-180, 180):.4f}'
+                    f'\t{rng.choice(("", "1", "4", "6"))}\n'
+                )
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == '.zip':
+            with (
+                zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive,
+                archive.open('allCountries.txt', 'w') as raw,
+                io.TextIOWrapper(raw, encoding='utf-8', newline='') as out,
+            ):
+                write(out)
+        else:
+            with path.open('w', encoding='utf-8', newline='') as out:
+                write(out)
+        logger.info(f'Wrote {lines:,} GeoNames lines to {path}')
+        return path
+
+
+def build_torrent(item: dict, title_id: str | None = None) -> Torrent:
+    """Build an unsaved torrent from a generated item."""
+    fields = {k: v for k, v in item.items() if k not in ('sub_id', 'size_txt')}
+    return Torrent(title_id=title_id, **fields)
+
+
+##########################################################################################
+# Html
+##########################################################################################
+
+
+def render_1337x_page(items: list[dict]) -> str:
+    """Render torrents as a 1337x listing page."""
+    rows = []
+    for item in items:
+        name = html.escape(item['name'])
+        href = item['url'].removeprefix('https://1337x.to')
+        rows.append(
+            '<tr>'
+            f'<td class="coll-1 name"><a href="/sub/{item["sub_id"]}/0/" class="icon">'
+            f'<i class="flaticon-hd"></i></a><a href="{href}">{name}</a></td>'
+            f'<td class="coll-2 seeds">{item["seeders"]}</td>'
+            f'<td class="coll-3 leeches">{item["leechers"]}</td>'
+            f'<td class="coll-date">{item["uploaded_at"]:%Y-%m-%d %H:%M}</td>'
+            f'<td class="coll-4 size mob-uploader">{item["size_txt"]}'
+            f'<span class="seeds">{item["seeders"]}</span></td>'
+            f'<td class="coll-5 uploader"><a href="/user/{item["uploader"]}/">'
+            f'{item["uploader"]}</a></td>'
+            '</tr>'
+        )
+    return (
+        '<html><body><div class="table-list-wrap">'
+        '<table class="table-list table table-responsive table-striped"><thead><tr>'
+        '<th class="coll-1 name">name</th><th class="coll-2">se</th><th class="coll-3">le</th>'
+        '<th class="coll-date">time</th><th class="coll-4">size</th>'
+        '<th class="coll-5">uploader</th></tr></thead><tbody>\n'
+        + '\n'.join(rows)
+        + '\n</tbody></table></div></body></html>\n'
+    )
+
+
+def render_rarbg_page(items: list[dict]) -> str:
+    """Render torrents as a rarbg listing page."""
+    rows = []
+    for item in items:
+        name = html.escape(item['name'])
+        href = item['url'].removeprefix('https://rarbgtor.org')
+        rows.append(
+            '<tr class="lista2">'
+            '<td class="lista"><a href="/torrents.php?category=27"><img src="/cat.gif"></a></td>'
+            f'<td class="lista"><a href="{href}" title="{name}">{name}</a></td>'
+            f'<td class="lista">{item["uploaded_at"]:%Y-%m-%d %H:%M:%S}</td>'
+            f'<td class="lista">{item["size_txt"]}</td>'
+            f'<td class="lista"><font color="#008000">{item["seeders"]}</font></td>'
+            f'<td class="lista">{item["leechers"]}</td>'
+            '<td class="lista">--</td>'
+            f'<td class="lista">{item["uploader"]}</td>'
+            '</tr>'
+        )
+    return (
+        '<html><body><table class="lista2t"><tr>'
+        '<td class="header6">Cat.</td><td class="header6">File</td>'
+        '<td class="header6">Added</td><td class="header6">Size</td>'
+        '<td class="header6">S.</td><td class="header6">L.</td>'
+        '<td class="header6">comments</td><td class="header6">Uploader</td></tr>\n'
+        + '\n'.join(rows)
+        + '\n</table></body></html>\n'
+    )
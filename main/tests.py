@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.paginator import EmptyPage
+from django.db import connection, connections
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from main.constants import (
+    CATEGORY_GAMES,
+    CATEGORY_MOVIES,
+    CATEGORY_TV_SHOWS,
+    COUNTRY_ZA,
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_FINISHED,
+    JOB_PRUNE,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_SCRAPE,
+    SITE_1337X,
+    STATUS_FINISHED,
+    STATUS_NEW,
+)
+from main.geo import (
+    PairBitmap,
+    SpatialIndex,
+    condensed_distances,
+    condensed_index,
+    haversine,
+    measure_tiles,
+    nearby_pairs,
+    pairwise_blocks,
+)
+from main.geocoding import lookup_postcodes, missing_codes, query_for
+from main.geonames import (
+    NON_NUMERIC_COUNTRIES,
+    UnsupportedCountryError,
+    import_geonames,
+    parse_lines,
+)
+from main.ingest import upsert_postcodes, upsert_torrents
+from main.jobs import JOBS, cancel_jobs, claim_next, enqueue, fail_stale_jobs, run_job
+from main.management.commands import postcodedistances
+from main.management.commands.mockgeocoder import fake_response
+from main.matrix import DistanceMatrix, export_matrix, import_matrix
+from main.metrics import BUCKETS, Metrics
+from main.models import Distance, GeocodeCache, Job, Postcode, Title, Torrent
+from main.pagination import KeysetPaginator, encode_cursor
+from main.parsing import parse_title, parse_titles
+from main.profiling import QueryLog, profile_sql
+from main.scraper import scrape_1337x_page, scrape_rarbg_page
+from main.search import check_search_indexes, fts_query, search
+from main.selectors import (
+    DASHBOARD_CACHE_KEY,
+    aget_dashboard_stats,
+    get_dashboard_stats,
+    invalidate_postcode_index,
+    list_old_tv,
+    list_titles_without_torrents,
+)
+from main.services import (
+    mark_titles,
+    prune,
+    prune_old_torrents,
+    prune_titles_without_torrents,
+    refresh_title_stats,
+)
+from main.synthetic import LATITUDE_RANGE, LONGITUDE_RANGE, SyntheticDataset
+
+ANCHOR = make_aware(datetime(2024, 6, 1))
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def random_points(n: int, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """Get n points spread over the synthetic postcode area."""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(*LATITUDE_RANGE, n), rng.uniform(*LONGITUDE_RANGE, n)
+
+
+class SyntheticDatasetTest(TestCase):
+    def test_same_seed_same_rows(self):
+        """A seed and anchor always give the same works and torrents."""
+        names = [
+            [torrent['name'] for work in dataset.iter_works(200) for torrent in work.torrents]
+            for dataset in (SyntheticDataset(anchor=ANCHOR), SyntheticDataset(anchor=ANCHOR))
+        ]
+        assert names[0] == names[1]
+        assert len(names[0]) == 200
+        other = SyntheticDataset(seed=7, anchor=ANCHOR).iter_works(200)
+        assert [t['name'] for work in other for t in work.torrents] != names[0]
+
+    def test_load_torrents(self):
+        """Torrents are stored with their titles, some untitled and backdated."""
+        inserted = SyntheticDataset(anchor=ANCHOR).load_torrents(1_000, batch_size=300)
+        assert inserted == Torrent.objects.count() == 1_000
+        untitled = Torrent.objects.filter(title__isnull=True).count()
+        assert 0 < untitled < 150
+        assert Title.objects.filter(torrents__isnull=True).exists()
+        assert not Torrent.objects.exclude(created_at=F('uploaded_at')).exists()
+        assert not Torrent.objects.filter(uploaded_at__gt=ANCHOR).exists()
+
+    def test_reload_counts_only_new_torrents(self):
+        """Torrents already stored are skipped and not counted."""
+        SyntheticDataset(anchor=ANCHOR).load_torrents(300, batch_size=100)
+        assert SyntheticDataset(anchor=ANCHOR).load_torrents(500, batch_size=100) == 200
+        assert Torrent.objects.count() == 500
+
+    def test_load_postcodes(self):
+        """Postcodes are numbered from 1 within south africa."""
+        assert SyntheticDataset().load_postcodes(50, batch_size=20) == 50
+        assert list(Postcode.objects.order_by('code').values_list('code', flat=True)) == list(
+            range(1, 51)
+        )
+        for postcode in Postcode.objects.all():
+            assert LATITUDE_RANGE[0] <= postcode.latitude <= LATITUDE_RANGE[1]
+            assert LONGITUDE_RANGE[0] <= postcode.longitude <= LONGITUDE_RANGE[1]
+
+    def test_pages_scrape_back(self):
+        """The scraper reads back the torrents written to the listing pages."""
+        dataset = SyntheticDataset(anchor=ANCHOR)
+        with tempfile.TemporaryDirectory() as directory:
+            dataset.write_pages(Path(directory), torrents=300, pages=2, rows_per_page=20)
+            pages = sorted(Path(directory, '1337x_files').glob('*.html'))
+            assert len(pages) == 2
+            scraped = [item for page in pages for item in scrape_1337x_page(page)]
+            rarbg = Path(directory, 'rarbg_files', 'synthetic-00001.html')
+            assert scrape_rarbg_page(rarbg)
+        expected = list(dataset.iter_site_torrents(SITE_1337X, 300))[:40]
+        assert [item['url'] for item in scraped] == [item['url'] for item in expected]
+        assert [item['seeders'] for item in scraped] == [item['seeders'] for item in expected]
+
+
+class GenerateDatasetCommandTest(TestCase):
+    def test_generates_rows_and_pages(self):
+        """The command loads the rows and writes pages to the given directory."""
+        with tempfile.TemporaryDirectory() as directory:
+            call_command(
+                'generatedataset',
+                torrents=200,
+                postcodes=10,
+                anchor='2024-06-01',
+                pages=1,
+                html_dir=directory,
+            )
+            assert Path(directory, '1337x_files', 'synthetic-00001.html').exists()
+        assert Torrent.objects.count() == 200
+        assert Postcode.objects.count() == 10
+
+    def test_pages_default_to_their_own_directory(self):
+        """Without --html-dir the pages stay out of the directories scrape_sites reads."""
+        with tempfile.TemporaryDirectory() as directory, self.settings(BASE_DIR=Path(directory)):
+            call_command('generatedataset', torrents=100, pages=1, skip_db=True)
+            assert Path(directory, 'synthetic', '1337x_files', 'synthetic-00001.html').exists()
+            assert not Path(directory, '1337x_files').exists()
+
+    def test_skip_db_only_writes_pages(self):
+        """With --skip-db nothing is stored."""
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('generatedataset', torrents=100, pages=1, html_dir=directory, skip_db=True)
+            assert Path(directory, 'rarbg_files').is_dir()
+        assert not Torrent.objects.exists()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DashboardStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        SyntheticDataset(anchor=ANCHOR).load_torrents(300)
+
+    def test_counts_are_cached(self):
+        """The numbers are counted once and then served from the cache."""
+        stats = get_dashboard_stats()
+        assert stats['count_movies'] == Torrent.objects.filter(category=CATEGORY_MOVIES).count()
+        assert stats['count_games'] == Torrent.objects.filter(category=CATEGORY_GAMES).count()
+        Torrent.objects.filter(category=CATEGORY_MOVIES).delete()
+        with self.assertNumQueries(0):
+            assert get_dashboard_stats() == stats
+
+    def test_admin_triage_drops_the_cache(self):
+        """Marking titles from the admin drops the cached numbers."""
+        get_dashboard_stats()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        shows = Title.objects.filter(torrents__category=CATEGORY_TV_SHOWS).distinct()
+        selected = list(shows.values_list('pk', flat=True)[:3])
+        response = self.client.post(
+            reverse('admin:main_tvshows_changelist'),
+            {'action': 'mark_as_finished_cmd', '_selected_action': selected},
+        )
+        assert response.status_code == 302
+        assert Title.objects.filter(pk__in=selected, status=STATUS_FINISHED).count() == 3
+        assert cache.get(DASHBOARD_CACHE_KEY) is None
+
+    def test_admin_parse_titles_drops_the_cache(self):
+        """Parsing titles from the admin drops the cached numbers."""
+        get_dashboard_stats()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        selected = list(Torrent.objects.filter(title__isnull=True).values_list('pk', flat=True))
+        response = self.client.post(
+            reverse('admin:main_torrent_changelist'),
+            {'action': 'parse_title_cmd', '_selected_action': selected},
+        )
+        assert response.status_code == 302
+        assert not Torrent.objects.filter(title__isnull=True).exists()
+        assert cache.get(DASHBOARD_CACHE_KEY) is None
+
+    def test_home_view(self):
+        """The home page shows the cached numbers."""
+        response = self.client.get(reverse('home_view'))
+        assert response.status_code == 200
+        assert response.context['count_series'] == get_dashboard_stats()['count_series']
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PruneTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # uploads reach four years back from today, about half are old
+        SyntheticDataset().load_torrents(600)
+
+    def test_prune_old_torrents(self):
+        """Every old torrent is deleted a chunk at a time, the others are kept."""
+        old, kept = list_old_tv().count(), Torrent.objects.count() - list_old_tv().count()
+        assert old > 0
+        progress = mock.Mock()
+        assert prune_old_torrents(chunk_size=50, progress=progress) == old
+        assert not list_old_tv().exists()
+        assert Torrent.objects.count() == kept
+        done = [call.args[0] for call in progress.call_args_list]
+        assert done == sorted(done)
+        assert progress.call_args_list[-1].args[0] == progress.call_args_list[-1].args[1]
+
+    def test_prune_titles_without_torrents(self):
+        """Titles without torrents are deleted in chunks, the others are kept."""
+        prune_old_torrents()
+        empty = list_titles_without_torrents().count()
+        titles = Title.objects.count()
+        progress = mock.Mock()
+        assert prune_titles_without_torrents(chunk_size=7, progress=progress) == empty
+        assert not list_titles_without_torrents().exists()
+        assert Title.objects.count() == titles - empty
+        progress.assert_called_with(empty, empty)
+
+    def test_prune_invalidates_dashboard(self):
+        """The dashboard counts again after a prune."""
+        assert get_dashboard_stats()['count_old_tv'] > 0
+        prune()
+        assert get_dashboard_stats()['count_old_tv'] == 0
+        assert get_dashboard_stats()['count_titles_without_torrents'] == 0
+
+    def test_prune_progress_moves_forward(self):
+        """Both steps report into one percentage that only goes up."""
+        progress = mock.Mock()
+        prune(chunk_size=50, progress=progress)
+        done = [call.args for call in progress.call_args_list]
+        assert {total for _, total in done} == {100}
+        assert [percent for percent, _ in done] == sorted(percent for percent, _ in done)
+        assert done[-1] == (100, 100)
+
+
+class KeysetPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Title.objects.bulk_create(
+            [Title(text=f'title {i:03d}', priority=i % 7) for i in range(1, 51)]
+        )
+
+    def test_cursor_pages_match_offset_pages(self):
+        """Following the next cursors gives the same pages as OFFSET."""
+        queryset = Title.objects.order_by('-priority', 'text')
+        offset = KeysetPaginator(queryset, 10)
+        cursor = None
+        for number in range(1, 6):
+            paginator = KeysetPaginator(queryset, 10, cursor=cursor)
+            assert list(paginator.page(number)) == list(offset.page(number))
+            cursor = paginator.next_cursor
+            assert (cursor is None) == (number == 5)
+
+    def test_no_next_cursor_after_the_last_row(self):
+        """Only a page with rows after it gets a cursor, full or not."""
+        queryset = Title.objects.order_by('text')
+        for per_page, last in ((10, 5), (7, 8)):
+            for number in range(1, last + 1):
+                paginator = KeysetPaginator(queryset, per_page)
+                paginator.page(number)
+                assert (paginator.next_cursor is None) == (number == last), (per_page, number)
+        with self.assertRaises(EmptyPage):  # noqa PT027
+            KeysetPaginator(queryset, 10).page(6)
+
+    def test_unsupported_ordering_falls_back_to_offset(self):
+        """An ordering without the primary key cannot be sought on."""
+        paginator = KeysetPaginator(Title.objects.order_by('priority'), 10)
+        assert paginator.sort_keys is None
+        assert len(paginator.page(2)) == 10
+        assert paginator.next_cursor is None
+
+    def test_count_is_estimated_past_the_limit(self):
+        """The count stops at the limit and is estimated from the table."""
+        paginator = KeysetPaginator(Title.objects.order_by('text'), 10, count_limit=20)
+        assert paginator.count >= 21
+        assert paginator.is_estimate
+
+    def test_cursor_values_are_cleaned(self):
+        """The cursor's sort key gets the field types, it is ignored if it does not fit."""
+        queryset = Title.objects.order_by('-priority', 'text')
+        paginator = KeysetPaginator(queryset, 10, cursor=encode_cursor(2, ['3', 7]))
+        assert paginator.cursor_values == [3, '7']
+        offset = KeysetPaginator(queryset, 10)
+        for values in (['x', 'title 001'], [3], [None, 'title 001']):
+            paginator = KeysetPaginator(queryset, 10, cursor=encode_cursor(2, values))
+            assert paginator.cursor_values is None, values
+            assert list(paginator.page(2)) == list(offset.page(2))
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        SyntheticDataset(anchor=ANCHOR).load_torrents(250)
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def changelist_ids(self, url: str) -> list[int]:
+        """Follow the next links from the url, collecting the ids shown."""
+        path, ids = url, []
+        while url:
+            response = self.client.get(url)
+            assert response.status_code == 200
+            cl = response.context['cl']
+            ids += [torrent.pk for torrent in cl.result_list]
+            url = cl.next_page_url and path + cl.next_page_url
+        return ids
+
+    def test_next_links_walk_every_torrent(self):
+        """The next links show each torrent once, best seeded first."""
+        ids = self.changelist_ids(reverse('admin:main_torrent_changelist'))
+        assert sorted(ids) == sorted(Torrent.objects.values_list('pk', flat=True))
+        seeders = dict(Torrent.objects.values_list('pk', 'seeders'))
+        assert [seeders[pk] for pk in ids] == sorted(seeders.values(), reverse=True)
+
+    def test_tampered_cursor_falls_back_to_offset(self):
+        """A cursor that does not fit the ordering shows the page by number."""
+        url = reverse('admin:main_torrent_changelist')
+        response = self.client.get(url, {'p': 2, 'k': encode_cursor(2, ['many', 'x'])})
+        assert response.status_code == 200
+        offset = Torrent.objects.order_by('-seeders', '-pk')[100:200]
+        shown = [torrent.pk for torrent in response.context['cl'].result_list]
+        assert shown == [torrent.pk for torrent in offset]
+
+    def test_full_last_page_has_no_next_link(self):
+        """With a multiple of the page size the last page links nowhere."""
+        Torrent.objects.filter(pk__in=Torrent.objects.order_by('pk').values('pk')[200:]).delete()
+        ids = self.changelist_ids(reverse('admin:main_torrent_changelist'))
+        assert sorted(ids) == sorted(Torrent.objects.values_list('pk', flat=True))
+
+
+class TitleServicesTest(TestCase):
+    def setUp(self):
+        SyntheticDataset(anchor=ANCHOR).load_torrents(400)
+
+    def test_mark_titles(self):
+        """The titles of the queryset get the status and its time, the others are left."""
+        titles = Title.objects.filter(torrents__category=CATEGORY_GAMES).distinct()
+        pks = set(titles.values_list('pk', flat=True))
+        others = dict(Title.objects.exclude(pk__in=pks).values_list('pk', 'status'))
+        assert mark_titles(titles, STATUS_FINISHED) == len(pks)
+        marked = Title.objects.filter(pk__in=pks)
+        assert set(marked.values_list('status', flat=True)) == {STATUS_FINISHED}
+        assert not marked.filter(status_at__isnull=True).exists()
+        assert dict(Title.objects.exclude(pk__in=pks).values_list('pk', 'status')) == others
+
+    def test_refresh_title_stats(self):
+        """The stats match those worked out a title at a time."""
+        Title.objects.update(earliest_upload_at=None, latest_upload_at=None, priority=None)
+        with_torrents = Title.objects.filter(torrents__isnull=False).distinct()
+        assert refresh_title_stats(Title.objects.all()) == with_torrents.count()
+        for title in with_torrents[:50]:
+            stored = (title.earliest_upload_at, title.latest_upload_at, title.priority)
+            title.update_stats()
+            assert stored == (title.earliest_upload_at, title.latest_upload_at, title.priority)
+        assert not Title.objects.filter(torrents__isnull=True, priority__isnull=False).exists()
+
+    def test_refresh_title_stats_of_a_selection(self):
+        """Only the titles of the queryset are updated."""
+        Title.objects.update(priority=None)
+        new = Title.objects.filter(status=STATUS_NEW, torrents__isnull=False).distinct()
+        refresh_title_stats(new, progress=mock.Mock())
+        assert set(Title.objects.filter(priority__isnull=False)) == set(new)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ParseTitlesTest(TestCase):
+    def setUp(self):
+        SyntheticDataset(anchor=ANCHOR).load_torrents(300)
+
+    def test_parse_title(self):
+        """Names are title cased, underscores become spaces and brackets are cut off."""
+        assert parse_title('the_last_kingdom_2020') == 'The Last Kingdom 2020'
+        assert parse_title('dark winter (2019) [1080p]') == 'Dark Winter'
+        assert parse_title('a_b c d') == 'A_B C D'
+
+    def test_parse_titles(self):
+        """Every torrent gets the title parsed from its name, missing titles are created."""
+        Title.objects.create(text=parse_title(Torrent.objects.first().name))
+        assert parse_titles(Torrent.objects.all(), chunk_size=70, progress=mock.Mock()) == 300
+        for pk, name, title in Torrent.objects.values_list('pk', 'name', 'title'):
+            assert title == parse_title(name), pk
+        assert Title.objects.filter(pk__in=Torrent.objects.values('title')).count() == len(
+            {parse_title(name) for name in Torrent.objects.values_list('name', flat=True)}
+        )
+
+    def test_command_selection(self):
+        """By default only the untitled torrents are re-titled, --all takes every one."""
+        untitled = set(Torrent.objects.filter(title__isnull=True).values_list('pk', flat=True))
+        titled = dict(Torrent.objects.filter(title__isnull=False).values_list('pk', 'title'))
+        assert untitled
+        call_command('parsetitles', chunk_size=50)
+        assert not Torrent.objects.filter(title__isnull=True).exists()
+        assert dict(Torrent.objects.filter(pk__in=titled).values_list('pk', 'title')) == titled
+        for torrent in Torrent.objects.filter(pk__in=untitled):
+            assert torrent.title_id == parse_title(torrent.name)
+
+        call_command('parsetitles', all=True, category=CATEGORY_GAMES)
+        for torrent in Torrent.objects.filter(category=CATEGORY_GAMES):
+            assert torrent.title_id == parse_title(torrent.name)
+        others = Torrent.objects.filter(pk__in=titled).exclude(category=CATEGORY_GAMES)
+        assert dict(others.values_list('pk', 'title')) == {
+            pk: titled[pk] for pk in others.values_list('pk', flat=True)
+        }
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Title.objects.bulk_create(
+            [Title(text='The Matrix Reloaded'), Title(text='Matrix'), Title(text='Heat')]
+        )
+        SyntheticDataset(anchor=ANCHOR).load_torrents(300)
+
+    def test_fts_query(self):
+        """Terms become quoted phrases, too short terms cannot be matched."""
+        assert fts_query('matrix "re loaded"') == '"matrix" AND "re loaded"'
+        assert fts_query('ma') is None
+        assert fts_query('') is None
+
+    def test_search_titles(self):
+        """Every term has to match somewhere in the text, in any case."""
+        texts = set(search(Title.objects.all(), 'atri').values_list('text', flat=True))
+        assert texts == {'The Matrix Reloaded', 'Matrix'}
+        assert search(Title.objects.all(), 'matrix load').count() == 1
+        assert search(Title.objects.all(), 'he') is None
+
+    def test_search_torrents_like_icontains(self):
+        """The index finds the same torrents as a LIKE scan."""
+        for term in ('1080p', 'winter', 'x265 GalaxyRG'):
+            found = search(Torrent.objects.all(), term)
+            expected = Torrent.objects.all()
+            for bit in term.split():
+                expected = expected.filter(name__icontains=bit)
+            assert set(found) == set(expected), term
+
+    def test_index_follows_changes(self):
+        """Updated and deleted torrents are updated in the index."""
+        torrent = Torrent.objects.first()
+        torrent.name = 'Quetzalcoatl.2024.1080p'
+        torrent.save()
+        assert list(search(Torrent.objects.all(), 'quetzal')) == [torrent]
+        torrent.delete()
+        assert not search(Torrent.objects.all(), 'quetzal').exists()
+
+    def test_missing_triggers_are_recreated(self):
+        """A dropped trigger is put back and the index rebuilt."""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER main_title_fts_insert')
+        Title.objects.create(text='Ronin')
+        assert search(Title.objects.all(), 'ronin').count() == 0
+        assert check_search_indexes() == ['main_title']
+        assert search(Title.objects.all(), 'ronin').count() == 1
+        assert check_search_indexes() == []
+
+
+class UpsertTorrentsTest(TestCase):
+    def items(self, count: int) -> list[dict]:
+        """Get generated torrents as the scraper hands them over."""
+        works = SyntheticDataset(anchor=ANCHOR).iter_works(count)
+        return [
+            {k: v for k, v in item.items() if k not in ('sub_id', 'size_txt')}
+            for work in works
+            for item in work.torrents
+        ]
+
+    def test_inserts_and_updates(self):
+        """New urls are inserted, known ones only get the site, seeders and leechers."""
+        items = self.items(120)
+        assert upsert_torrents(items[:100]) == 100
+        Torrent.objects.update(title=Title.objects.create(text='Kept'))
+        changed = [
+            {**item, 'name': 'renamed', 'seeders': 999_999, 'leechers': 7} for item in items[:50]
+        ]
+        assert upsert_torrents(changed + items[100:]) == 70
+        assert Torrent.objects.count() == 120
+        updated = Torrent.objects.filter(url__in=[item['url'] for item in changed])
+        assert set(updated.values_list('seeders', 'leechers', 'title')) == {(999_999, 7, 'Kept')}
+        assert not Torrent.objects.filter(name='renamed').exists()
+
+    def test_last_item_of_a_url_wins(self):
+        """A url repeated in one call is written once with its last values."""
+        item = self.items(1)[0]
+        assert upsert_torrents([item, {**item, 'seeders': 1}, {**item, 'seeders': 2}]) == 1
+        assert Torrent.objects.get().seeders == 2
+        assert upsert_torrents([]) == 0
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JobsTest(TestCase):
+    def test_enqueue_returns_the_active_job(self):
+        """A job of a kind is only queued once until it has ended."""
+        job = enqueue(JOB_SCRAPE)
+        assert enqueue(JOB_SCRAPE) == job
+        Job.objects.filter(pk=job.pk).update(status=JOB_CANCELLED)
+        assert enqueue(JOB_SCRAPE) != job
+        with self.assertRaises(ValueError):  # noqa PT027
+            enqueue('unknown')
+
+    def test_enqueue_race_returns_the_winner(self):
+        """A request that missed the job queued meanwhile returns it instead of a second."""
+        winner = Job.objects.create(name=JOB_SCRAPE)
+        filter_jobs = Job.objects.filter
+
+        def missed_first(*args, **kwargs):
+            # the first check ran before the other request created its job
+            queryset = filter_jobs(*args, **kwargs)
+            return queryset.none() if search.call_count == 1 else queryset
+
+        with mock.patch.object(Job.objects, 'filter', side_effect=missed_first) as search:
+            assert enqueue(JOB_SCRAPE) == winner
+        assert Job.objects.count() == 1
+
+    def test_claim_and_cancel(self):
+        """The oldest queued job is claimed once, cancelling flags the running one."""
+        job = enqueue(JOB_SCRAPE)
+        queued = enqueue(JOB_PRUNE)
+        claimed = claim_next('worker')
+        assert (claimed.pk, claimed.status, claimed.worker) == (job.pk, JOB_RUNNING, 'worker')
+        assert claim_next('other').pk == queued.pk
+        assert claim_next('other') is None
+        Job.objects.filter(pk=queued.pk).update(status=JOB_QUEUED)
+        assert cancel_jobs(Job.objects.all()) == 2
+        assert Job.objects.get(pk=job.pk).cancel_requested
+        assert Job.objects.get(pk=queued.pk).status == JOB_CANCELLED
+
+    def test_run_job_records_the_outcome(self):
+        """A job finishes, fails with its traceback or stops once cancelled."""
+
+        def cancelled(progress):
+            Job.objects.update(cancel_requested=True)
+            progress(1, 2)
+
+        outcomes = {
+            JOB_SCRAPE: (lambda progress: progress(3, 3), JOB_FINISHED),
+            JOB_PRUNE: (lambda progress: 1 / 0, JOB_FAILED),
+            'cancelled': (cancelled, JOB_CANCELLED),
+        }
+        with mock.patch.dict(JOBS, {name: run for name, (run, _) in outcomes.items()}):
+            for name, (_, status) in outcomes.items():
+                job = Job.objects.create(name=name, status=JOB_RUNNING)
+                run_job(job)
+                job.refresh_from_db()
+                assert job.status == status, name
+                assert job.finished_at is not None
+        assert 'ZeroDivisionError' in Job.objects.get(name=JOB_PRUNE).error
+        assert Job.objects.get(name=JOB_SCRAPE).progress_fmt() == '3 / 3 (100%)'
+
+    def test_stale_jobs_fail(self):
+        """Running jobs without progress for too long are failed."""
+        stale = Job.objects.create(name=JOB_SCRAPE, status=JOB_RUNNING)
+        fresh = Job.objects.create(name=JOB_PRUNE, status=JOB_RUNNING)
+        Job.objects.filter(pk=stale.pk).update(updated_at=ANCHOR)
+        assert fail_stale_jobs() == 1
+        assert Job.objects.get(pk=stale.pk).status == JOB_FAILED
+        assert Job.objects.get(pk=fresh.pk).status == JOB_RUNNING
+
+    def test_single_worker_fails_stale_jobs(self):
+        """Each worker process fails the jobs a dead worker left running."""
+        stale = Job.objects.create(name=JOB_SCRAPE, status=JOB_RUNNING)
+        Job.objects.filter(pk=stale.pk).update(updated_at=ANCHOR)
+        with mock.patch('main.management.commands.runworkers.work') as work:
+            call_command('runworkers', workers=1)
+        work.assert_called_once()
+        assert Job.objects.get(pk=stale.pk).status == JOB_FAILED
+
+    def test_clear_tv_view_queues_a_prune(self):
+        """The view queues a prune and returns straight away."""
+        response = self.client.get(reverse('clear_tv_view'))
+        assert response.status_code == 302
+        assert Job.objects.get().name == JOB_PRUNE
+        assert Job.objects.get().status == JOB_QUEUED
+
+
+class MetricsTest(TestCase):
+    def metrics(self) -> Metrics:
+        """Get metrics with two counters and timings of two stages."""
+        metrics = Metrics('test')
+        metrics.count('pages')
+        metrics.count('rows', 20)
+        for seconds in (0.002, 0.02, 0.2, 2):
+            metrics.observe('parse', seconds)
+        with metrics.stage('upsert'):
+            pass
+        return metrics
+
+    def test_prometheus(self):
+        """Counters, cumulative histogram buckets and the run timestamp are exported."""
+        lines = self.metrics().prometheus().splitlines()
+        assert '# TYPE torrents_test_rows_total counter' in lines
+        assert 'torrents_test_rows_total 20' in lines
+        assert 'torrents_test_pages_total 1' in lines
+        assert '# TYPE torrents_test_stage_seconds histogram' in lines
+        buckets = [
+            int(line.rsplit(' ', 1)[1])
+            for line in lines
+            if line.startswith('torrents_test_stage_seconds_bucket{stage="parse"')
+        ]
+        assert buckets == [0, 1, 1, 2, 2, 3, 3, 4, 4, 4, 4]
+        assert len(buckets) == len(BUCKETS) + 1
+        assert 'torrents_test_stage_seconds_count{stage="parse"} 4' in lines
+        assert 'torrents_test_stage_seconds_count{stage="upsert"} 1' in lines
+        sums = [line for line in lines if line.startswith('torrents_test_stage_seconds_sum')]
+        assert round(float(sums[0].rsplit(' ', 1)[1]), 6) == 2.222
+        assert lines[-2] == '# TYPE torrents_test_last_run_timestamp_seconds gauge'
+
+    def test_summary_and_export(self):
+        """The table lists each stage and counter, the files hold the same numbers."""
+        metrics = self.metrics()
+        summary = metrics.summary()
+        assert 'parse' in summary
+        assert 'upsert' in summary
+        assert 'rows' in summary
+        with tempfile.TemporaryDirectory() as directory:
+            json_path, prom_path = metrics.export(Path(directory))
+            data = json.loads(json_path.read_text())
+            assert prom_path.read_text().startswith('# TYPE torrents_test_pages_total counter')
+            assert sorted(path.name for path in Path(directory).iterdir()) == [
+                'test_metrics.json',
+                'test_metrics.prom',
+            ]
+        assert data['counters'] == {'pages': 1, 'rows': 20}
+        assert data['stages']['parse']['count'] == 4
+        assert data['stages']['parse']['max'] == 2
+
+    def test_scraping_a_page_is_timed(self):
+        """Reading and parsing a listing page are timed as stages."""
+        metrics = Metrics('scrape')
+        with tempfile.TemporaryDirectory() as directory:
+            SyntheticDataset(anchor=ANCHOR).write_pages(Path(directory), 100, 1)
+            items = scrape_1337x_page(
+                Path(directory, '1337x_files', 'synthetic-00001.html'), metrics
+            )
+        assert items
+        assert {'read', 'parse'} <= set(metrics.timings)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProfiledCommandTest(TestCase):
+    def test_profiles_written(self):
+        """Each profiling option writes its report under PROFILE_DIR."""
+        SyntheticDataset(anchor=ANCHOR).load_torrents(100)
+        with tempfile.TemporaryDirectory() as directory, self.settings(PROFILE_DIR=directory):
+            call_command(
+                'parsetitles', profile=True, profile_memory=True, profile_sql=True, chunk_size=30
+            )
+            reports = {path.name.split('.', 1)[1]: path for path in Path(directory).iterdir()}
+            assert set(reports) == {'prof', 'prof.txt', 'mem.txt', 'sql.txt'}
+            assert all(path.name.startswith('parsetitles-') for path in reports.values())
+            assert 'cumulative' in reports['prof.txt'].read_text()
+            assert 'peak' in reports['mem.txt'].read_text()
+            sql = reports['sql.txt'].read_text()
+        assert 'Most repeated' in sql
+        assert 'UPDATE "main_torrent"' in sql
+
+    def test_query_log_groups_by_shape(self):
+        """Queries differing in the number of parameters are counted together."""
+        query_log = QueryLog()
+
+        def execute(sql, params, many, context):
+            return None
+
+        query_log(execute, 'SELECT 1 WHERE id IN (%s, %s)', [1, 2], False, {})
+        query_log(execute, 'SELECT 1 WHERE id IN (%s)', [1], False, {})
+        query_log(execute, 'INSERT INTO t VALUES (%s, %s), (%s, %s)', [1, 2, 3, 4], False, {})
+        assert {sql: stats['count'] for sql, stats in query_log.stats.items()} == {
+            'SELECT 1 WHERE id IN (...)': 2,
+            'INSERT INTO t VALUES (...), ...': 1,
+        }
+        assert query_log.report().startswith('3 queries')
+
+    def test_queries_of_other_threads_are_logged(self):
+        """A connection opened by another thread while profiling is timed too."""
+
+        def count_jobs():
+            Job.objects.filter(name='threaded').count()
+            connections.close_all()
+
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = Path(directory) / 'threads'
+            with profile_sql(prefix):
+                thread = threading.Thread(target=count_jobs)
+                thread.start()
+                thread.join()
+            sql = Path(f'{prefix}.sql.txt').read_text()
+        assert sql.startswith('1 queries')
+        assert 'FROM "main_job" WHERE "main_job"."name" = %s' in sql
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        SyntheticDataset(anchor=ANCHOR).load_torrents(300)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_home_view(self):
+        """The async dashboard has the same numbers as the sync one."""
+        response = await self.async_client.get(reverse('home_view'))
+        assert response.status_code == 200
+        stats = await aget_dashboard_stats()
+        await cache.aclear()
+        assert stats == await sync_to_async(get_dashboard_stats)()
+
+    async def test_titles_view(self):
+        """Titles are listed by text up to the limit."""
+        response = await self.async_client.get(reverse('api_titles'), {'limit': 7})
+        texts = [title['text'] for title in response.json()['results']]
+        assert texts == [text async for text in Title.objects.values_list('text', flat=True)[:7]]
+        response = await self.async_client.get(reverse('api_titles'), {'limit': 'many'})
+        assert response.status_code == 400
+        assert response.json() == {'error': 'limit must be a number'}
+
+    async def test_title_view(self):
+        """A title comes with its torrents, best seeded first."""
+        title = await Title.objects.filter(torrents__isnull=False).afirst()
+        response = await self.async_client.get(reverse('api_title', args=[title.text]))
+        assert response.json()['text'] == title.text
+        seeders = [torrent['seeders'] for torrent in response.json()['torrents']]
+        assert seeders == sorted(seeders, reverse=True)
+        assert len(seeders) == await Torrent.objects.filter(title=title).acount()
+        response = await self.async_client.get(reverse('api_title', args=['No such title']))
+        assert response.status_code == 404
+
+    async def test_torrents_view(self):
+        """Torrents are listed best seeded first, only with GET."""
+        response = await self.async_client.get(reverse('api_torrents'))
+        seeders = [torrent['seeders'] for torrent in response.json()['results']]
+        assert len(seeders) == 50
+        assert seeders == sorted(seeders, reverse=True)
+        response = await self.async_client.post(reverse('api_torrents'))
+        assert response.status_code == 405
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        SyntheticDataset(anchor=ANCHOR).load_torrents(300)
+
+    def follow(self, url: str, params: dict) -> list[dict]:
+        """Follow the next urls from the first page, collecting the results."""
+        response = self.client.get(url, params)
+        results = []
+        while True:
+            assert response.status_code == 200
+            page = response.json()['results']
+            assert page, 'a next url led to an empty page'
+            results += page
+            if not response.json()['next']:
+                return results
+            response = self.client.get(response.json()['next'])
+
+    def test_torrent_pages_follow_the_cursor(self):
+        """The next urls give every matching torrent once, best seeded first."""
+        results = self.follow(reverse('api_torrents'), {'category': CATEGORY_MOVIES, 'limit': 17})
+        movies = Torrent.objects.filter(category=CATEGORY_MOVIES).order_by('-seeders', 'id')
+        assert [torrent['id'] for torrent in results] == list(movies.values_list('id', flat=True))
+
+    def test_full_last_page_has_no_next_url(self):
+        """With a multiple of the limit the last page links nowhere."""
+        count = Torrent.objects.count()
+        results = self.follow(reverse('api_torrents'), {'limit': count // 3})
+        assert len(results) == count
+
+    def test_tampered_cursor(self):
+        """A cursor whose sort key does not fit the ordering is a bad request."""
+        for values in ([], [10], [10, 'abc'], ['many', 5], [None, 5], [10, 5, 1], [[1], {}]):
+            response = self.client.get(
+                reverse('api_torrents'), {'cursor': encode_cursor(2, values)}
+            )
+            assert response.status_code == 400, values
+            assert response.json()['error'] == 'cursor is invalid', values
+        response = self.client.get(reverse('api_torrents'), {'cursor': encode_cursor(2, '10')})
+        assert response.status_code == 400
+        response = self.client.get(reverse('api_torrents'), {'cursor': encode_cursor(2, ['7', 1])})
+        assert response.status_code == 200
+
+    def test_title_filters(self):
+        """Titles are filtered by status, category and latest upload."""
+        after, before = '2023-01-01', '2024-01-01T12:00:00+00:00'
+        results = self.follow(
+            reverse('api_titles'),
+            {
+                'status': STATUS_NEW,
+                'category': CATEGORY_GAMES,
+                'uploaded_after': after,
+                'uploaded_before': before,
+                'limit': 5,
+            },
+        )
+        expected = (
+            Title.objects.filter(
+                status=STATUS_NEW,
+                torrents__category=CATEGORY_GAMES,
+                latest_upload_at__gte=make_aware(datetime(2023, 1, 1)),
+                latest_upload_at__lt=datetime.fromisoformat(before),
+            )
+            .distinct()
+            .order_by('text')
+        )
+        assert expected.exists()
+        assert [title['text'] for title in results] == [title.text for title in expected]
+
+    def test_bad_requests(self):
+        """Malformed parameters are answered with 400 and the reason."""
+        for url, params, error in (
+            ('api_titles', {'status': 'new'}, 'status must be a number'),
+            ('api_titles', {'uploaded_after': 'yesterday'}, 'uploaded_after must be a date'),
+            ('api_torrents', {'uploaded_before': '2024-13-45'}, 'uploaded_before must be a date'),
+            ('api_torrents', {'cursor': 'not a cursor'}, 'cursor is invalid'),
+            ('api_torrents_export', {'format': 'xml'}, 'format must be one of ndjson, csv'),
+            ('api_titles_export', {'uploaded_after': 'soon'}, 'uploaded_after must be a date'),
+        ):
+            response = self.client.get(reverse(url), params)
+            assert response.status_code == 400, url
+            assert response.json()['error'].startswith(error), url
+
+    def test_export_ndjson(self):
+        """Every matching torrent is streamed as a json line."""
+        response = self.client.get(reverse('api_torrents_export'), {'category': CATEGORY_GAMES})
+        assert response['Content-Type'] == 'application/x-ndjson'
+        assert response['Content-Disposition'] == 'attachment; filename="torrents.ndjson"'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        games = Torrent.objects.filter(category=CATEGORY_GAMES).order_by('id')
+        assert [json.loads(line)['id'] for line in lines] == [torrent.pk for torrent in games]
+
+    def test_export_csv(self):
+        """Every title is streamed as a csv row under a header."""
+        response = self.client.get(reverse('api_titles_export'), {'format': 'csv'})
+        assert response['Content-Type'] == 'text/csv'
+        content = b''.join(response.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        assert rows[0][:2] == ['text', 'status']
+        assert [row[0] for row in rows[1:]] == list(Title.objects.values_list('text', flat=True))
+
+    async def test_export_async(self):
+        """Under ASGI the rows are streamed from the async ORM."""
+        response = await self.async_client.get(reverse('api_torrents_export'))
+        lines = b''.join([chunk async for chunk in response.streaming_content]).splitlines()
+        assert len(lines) == await Torrent.objects.acount()
+
+
+class GeoTest(TestCase):
+    def test_condensed_distances(self):
+        """The condensed matrix holds the haversine km of each pair i < j, by i then j."""
+        lat, lon = random_points(30)
+        km = condensed_distances(lat, lon)
+        i, j = np.triu_indices(30, 1)
+        expected = [haversine(lat[a], lon[a], lat[b], lon[b]) for a, b in zip(i, j, strict=True)]
+        np.testing.assert_allclose(km, expected)
+
+    def test_small_tiles(self):
+        """Tiles of a few rows give the same pairs as one tile."""
+        lat, lon = random_points(30)
+        blocks = list(pairwise_blocks(lat, lon, tile_pairs=50))
+        assert len(blocks) > 1
+        i, j, km = (np.concatenate(arrays) for arrays in zip(*blocks, strict=True))
+        expected_i, expected_j = np.triu_indices(30, 1)
+        assert i.tolist() == expected_i.tolist()
+        assert j.tolist() == expected_j.tolist()
+        np.testing.assert_allclose(km, condensed_distances(lat, lon))
+
+    def test_pair_bitmap(self):
+        """Marked pairs are found by count and slice at their condensed index."""
+        n = 40
+        bitmap = PairBitmap(n)
+        i, j = np.array([0, 3, 3, 38]), np.array([1, 4, 39, 39])
+        bitmap.add(i, j)
+        bitmap.add(i[:1], j[:1])
+        assert bitmap.count() == 4
+        assert bitmap.contains(i, j).all()
+        assert not bitmap.contains(np.array([0, 5]), np.array([2, 6])).any()
+        expected_i, expected_j = np.triu_indices(n, 1)
+        marked = np.flatnonzero(bitmap.slice(0, n * (n - 1) // 2))
+        assert [(expected_i[k], expected_j[k]) for k in marked] == list(zip(i, j, strict=True))
+        assert bitmap.slice(int(condensed_index(3, 4, n)), 3).tolist() == [True, False, False]
+
+    def test_measure_tiles(self):
+        """Worker processes give back the tiles in order with the same km."""
+        lat, lon = random_points(60)
+        measured = list(measure_tiles(lat, lon, workers=2, tile_pairs=100))
+        assert len(measured) > 2 * 2
+        assert [start for start, _, _ in measured[1:]] == [stop for _, stop, _ in measured[:-1]]
+        assert (measured[0][0], measured[-1][1]) == (0, 59)
+        km = np.concatenate([km for _, _, km in measured])
+        np.testing.assert_allclose(km, condensed_distances(lat, lon))
+
+    def test_nearby_pairs_match_brute_force(self):
+        """The grid finds every pair within the radius and no other."""
+        lat, lon = random_points(400)
+        found = {}
+        for _, i, j, km in nearby_pairs(lat, lon, 75):
+            found.update(zip(zip(i.tolist(), j.tolist(), strict=True), km.tolist(), strict=True))
+        km = condensed_distances(lat, lon)
+        i, j = np.triu_indices(400, 1)
+        near = km <= 75
+        expected = dict(
+            zip(zip(i[near].tolist(), j[near].tolist(), strict=True), km[near], strict=True)
+        )
+        assert expected
+        assert found.keys() == expected.keys()
+        np.testing.assert_allclose(list(found.values()), [expected[pair] for pair in found])
+
+    def test_spatial_index_matches_brute_force(self):
+        """Within and nearest agree with measuring every point."""
+        lat, lon = random_points(500)
+        index = SpatialIndex(lat, lon)
+        km = np.array([haversine(-26.2, 28.0, a, b) for a, b in zip(lat, lon, strict=True)])
+
+        indices, distances = index.within(-26.2, 28.0, 150)
+        assert set(indices.tolist()) == set(np.flatnonzero(km <= 150).tolist())
+        np.testing.assert_allclose(distances, km[indices], atol=1e-6)
+        assert (np.diff(distances) >= 0).all()
+
+        indices, distances = index.nearest(-26.2, 28.0, k=7)
+        assert indices.tolist() == np.argsort(km, kind='stable')[:7].tolist()
+        np.testing.assert_allclose(distances, np.sort(km)[:7], atol=1e-6)
+        assert len(index.nearest(0, 0, k=1000)[0]) == 500
+
+    def test_spatial_index_across_antimeridian(self):
+        """Points either side of the antimeridian are near each other."""
+        index = SpatialIndex(np.array([0.0, 0.0, 10.0]), np.array([179.9, -179.9, 0.0]))
+        indices, distances = index.within(0, 179.95, 20)
+        assert sorted(indices.tolist()) == [0, 1]
+        expected = sorted(haversine(0, 179.95, 0, lon) for lon in (179.9, -179.9))
+        np.testing.assert_allclose(distances, expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PostcodeApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        SyntheticDataset().load_postcodes(300)
+
+    def setUp(self):
+        cache.clear()
+        invalidate_postcode_index()
+
+    def test_nearest(self):
+        """The k nearest postcodes come back nearest first."""
+        response = self.client.get(
+            reverse('api_postcodes_nearest'), {'lat': -26, 'lon': 28, 'k': 5}
+        )
+        assert response.status_code == 200
+        results = response.json()['results']
+        expected = sorted(
+            Postcode.objects.all(),
+            key=lambda postcode: haversine(-26, 28, postcode.latitude, postcode.longitude),
+        )[:5]
+        assert [postcode['code'] for postcode in results] == [
+            postcode.code for postcode in expected
+        ]
+
+    def test_within(self):
+        """Other postcodes within km of a postcode come back, unknown codes are 404."""
+        postcode = Postcode.objects.order_by('code').first()
+        url = reverse('api_postcodes_within', args=[postcode.code])
+        results = self.client.get(url, {'km': 300}).json()['results']
+        expected = {
+            other.code
+            for other in Postcode.objects.exclude(pk=postcode.pk)
+            if haversine(postcode.latitude, postcode.longitude, other.latitude, other.longitude)
+            <= 300
+        }
+        assert expected
+        assert {other['code'] for other in results} == expected
+        assert all(other['km'] <= 300 for other in results)
+        unknown = reverse('api_postcodes_within', args=[Postcode.objects.count() + 1])
+        assert self.client.get(unknown, {'km': 1}).status_code == 404
+
+    def test_bad_requests(self):
+        """Missing and out of range numbers are answered with 400."""
+        url = reverse('api_postcodes_nearest')
+        for params, error in (
+            ({'lon': 28}, 'lat is required'),
+            ({'lat': 'north', 'lon': 28}, 'lat must be a number'),
+            ({'lat': 91, 'lon': 28}, 'lat must be between'),
+            ({'lat': -26, 'lon': 'nan'}, 'lon must be between'),
+            ({'lat': -26, 'lon': 28, 'k': 0}, 'k must be between'),
+        ):
+            response = self.client.get(url, params)
+            assert response.status_code == 400, params
+            assert response.json()['error'].startswith(error), params
+
+    def test_index_follows_changes(self):
+        """A saved postcode is found once the change is committed."""
+        with self.assertNumQueries(1):
+            self.client.get(reverse('api_postcodes_nearest'), {'lat': 0, 'lon': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            Postcode.objects.create(code=0, area='Null Island', level='', latitude=0, longitude=0)
+        results = self.client.get(reverse('api_postcodes_nearest'), {'lat': 0, 'lon': 0}).json()
+        assert results['results'][0]['area'] == 'Null Island'
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DistanceMatrixTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        SyntheticDataset().load_postcodes(40)
+        call_command('postcodedistances', workers=1)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'distances.npy'
+
+    def test_export_import_round_trip(self):
+        """Exported distances are found in the matrix and imported back unchanged."""
+        rows = sorted(Distance.objects.values_list('postcode_a__code', 'postcode_b__code', 'km'))
+        assert rows
+        matrix = export_matrix(self.path)
+        for code_a, code_b, km in rows[:50]:
+            assert abs(matrix.distance(code_b, code_a) - km) < 1e-3
+        assert matrix.distance(rows[0][0], rows[0][0]) == 0.0
+        assert DistanceMatrix.open(self.path).distance(rows[0][0], -1) is None
+
+        assert import_matrix(self.path) == 0
+        Distance.objects.all().delete()
+        assert import_matrix(self.path) == len(rows)
+        imported = sorted(
+            Distance.objects.values_list('postcode_a__code', 'postcode_b__code', 'km')
+        )
+        assert [row[:2] for row in imported] == [row[:2] for row in rows]
+        np.testing.assert_allclose(
+            [row[2] for row in imported], [row[2] for row in rows], atol=1e-3
+        )
+
+    def test_insert_pairs_counts_rows_inserted(self):
+        """Pairs already stored are written again but not counted as inserted."""
+        rows = list(Distance.objects.values_list('pk', 'postcode_a_id', 'postcode_b_id', 'km')[:30])
+        Distance.objects.filter(pk__in=[row[0] for row in rows[:10]]).delete()
+        _, a_ids, b_ids, km = map(np.array, zip(*rows, strict=True))
+        with mock.patch.object(postcodedistances, 'BATCH_SIZE', 7):
+            batches = list(postcodedistances.insert_pairs(a_ids, b_ids, km))
+        assert batches[-1] == (30, 10)
+        assert [written for written, _ in batches] == [7, 14, 21, 28, 30]
+
+    def test_command_writes_matrix(self):
+        """The matrix store holds the km the table store inserts."""
+        call_command('postcodedistances', workers=1, store='matrix', matrix_path=str(self.path))
+        matrix = DistanceMatrix.open(self.path)
+        for code_a, code_b, km in Distance.objects.values_list(
+            'postcode_a__code', 'postcode_b__code', 'km'
+        )[:50]:
+            assert abs(matrix.distance(code_a, code_b) - km) < 1e-3
+
+    def test_second_country(self):
+        """Pairs of postcodes with the same codes in another country are kept apart."""
+        Postcode.objects.bulk_create(
+            Postcode(
+                country='NA',
+                code=postcode.code,
+                area=postcode.area,
+                level=postcode.level,
+                latitude=postcode.latitude + 1,
+                longitude=postcode.longitude - 1,
+            )
+            for postcode in Postcode.objects.all()
+        )
+        call_command('postcodedistances', workers=1, country='NA')
+        rows = sorted(
+            Distance.objects.values_list(
+                'postcode_a__country', 'postcode_a__code', 'postcode_b__code', 'km'
+            )
+        )
+        assert {row[0] for row in rows} == {'NA', COUNTRY_ZA}
+        matrix = export_matrix(self.path)
+        for country, code_a, code_b, km in rows[::20]:
+            assert abs(matrix.distance(code_a, code_b, country) - km) < 1e-3
+        assert matrix.distance(rows[0][1], rows[0][2], COUNTRY_ZA, 'NA') is None
+
+        Distance.objects.all().delete()
+        assert import_matrix(self.path) == len(rows)
+        imported = Distance.objects.values_list(
+            'postcode_a__country', 'postcode_b__country', 'postcode_a__code', 'postcode_b__code'
+        )
+        assert sorted(row[1:] for row in imported) == sorted(
+            (row[0], row[1], row[2]) for row in rows
+        )
+        assert all(row[0] == row[1] for row in imported)
+
+    def test_codes_without_country_are_za(self):
+        """A codes file from before postcodes had a country is read as ZA."""
+        matrix = export_matrix(self.path)
+        np.save(self.path.with_suffix('.codes.npy'), matrix.keys['code'])
+        code_a, code_b, km = Distance.objects.values_list(
+            'postcode_a__code', 'postcode_b__code', 'km'
+        ).first()
+        assert abs(DistanceMatrix.open(self.path).distance(code_a, code_b) - km) < 1e-3
+
+
+GEONAMES_LINE = '{}\t{}\t{}\t\t\t\t\t\t\t{}\t{}\t1\n'
+
+
+class UpsertPostcodesTest(TestCase):
+    def test_inserts_and_updates(self):
+        """New postcodes are inserted, known ones get the new area and position only."""
+        upsert_postcodes([(COUNTRY_ZA, 1, 'Old', 1.0, 2.0), ('NA', 1, 'Other', 3.0, 4.0)])
+        Postcode.objects.filter(country=COUNTRY_ZA).update(level='town', opencage=True)
+        count = upsert_postcodes(
+            [(COUNTRY_ZA, 1, 'Mid', 5.0, 6.0), (COUNTRY_ZA, 1, 'New', 7.0, 8.0)]
+        )
+        assert count == 1
+        postcode = Postcode.objects.get(country=COUNTRY_ZA, code=1)
+        assert (postcode.area, postcode.latitude, postcode.longitude) == ('New', 7, 8)
+        assert (postcode.level, postcode.opencage) == ('town', True)
+        assert Postcode.objects.get(country='NA').area == 'Other'
+        assert upsert_postcodes([]) == 0
+
+
+class GeonamesTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_parse_lines(self):
+        """Other countries, letter codes and malformed lines are skipped, the last wins."""
+        lines = [
+            GEONAMES_LINE.format('ZA', '0001', 'First', '-25.5', '28.1'),
+            GEONAMES_LINE.format('ZA', '0001', 'Second', '-25.6', '28.2'),
+            GEONAMES_LINE.format('US', '10001', 'New York', '40.7', '-74.0'),
+            GEONAMES_LINE.format('GB', 'SW1A', 'London', '51.5', '-0.1'),
+            GEONAMES_LINE.format('ZA', '00A2', 'Typo', '-25.6', '28.2'),
+            GEONAMES_LINE.format('ZA', '0002', 'Broken', 'north', '28.2'),
+            'ZA\t0003\tShort\n',
+        ]
+        metrics = Metrics('test')
+        rows = parse_lines(lines, {'ZA', 'GB'}, metrics)
+        assert rows == {('ZA', 1): ('ZA', 1, 'Second', -25.6, 28.2)}
+        assert metrics.counters['filtered'] == 1
+        assert metrics.counters['unsupported'] == 1
+        assert metrics.counters['non_numeric'] == 1
+        assert metrics.counters['malformed'] == 2
+        assert metrics.counters['duplicates'] == 1
+
+    def test_import_zip_in_chunks(self):
+        """A zipped dump imported in small chunks gives the same postcodes as one chunk."""
+        dump = SyntheticDataset().write_geonames(self.directory / 'allCountries.zip', 500)
+        metrics = import_geonames(dump, ['za', 'us'], chunk_lines=70)
+        assert metrics.counters['lines'] == 500
+        assert set(Postcode.objects.values_list('country', flat=True)) == {'ZA', 'US'}
+        chunked = set(Postcode.objects.values_list('country', 'code', 'area'))
+        Postcode.objects.all().delete()
+        import_geonames(dump, ['ZA', 'US'])
+        assert set(Postcode.objects.values_list('country', 'code', 'area')) == chunked
+
+    def test_countries_with_letter_codes(self):
+        """Asking for them is an error, a whole dump leaves them out."""
+        dump = SyntheticDataset().write_geonames(self.directory / 'allCountries.txt', 500)
+        with self.assertRaises(UnsupportedCountryError) as raised:  # noqa PT027
+            import_geonames(dump, ['za', 'gb', 'nl'])
+        assert 'GB, NL' in str(raised.exception)
+        assert not Postcode.objects.exists()
+
+        metrics = import_geonames(dump)
+        assert metrics.counters['unsupported'] > 0
+        assert metrics.counters['non_numeric'] == 0
+        imported = set(Postcode.objects.values_list('country', flat=True))
+        assert imported
+        assert not imported & NON_NUMERIC_COUNTRIES
+        with self.assertRaises(CommandError):  # noqa PT027
+            call_command('importpostcodes', dump, country=['CA'])
+
+    def test_command(self):
+        """Importpostcodes upserts the dump, keeping the level set by the lookup."""
+        path = self.directory / 'ZA.txt'
+        path.write_text(GEONAMES_LINE.format('ZA', '1', 'Old', '1.0', '2.0'), encoding='utf-8')
+        call_command('importpostcodes', path)
+        Postcode.objects.update(level='town')
+        path.write_text(GEONAMES_LINE.format('ZA', '1', 'New', '7.0', '8.0'), encoding='utf-8')
+        call_command('importpostcodes', path)
+        postcode = Postcode.objects.get()
+        assert (postcode.area, postcode.latitude, postcode.level) == ('New', 7, 'town')
+        with self.assertRaises(FileNotFoundError):  # noqa PT027
+            call_command('importpostcodes', self.directory / 'missing.txt')
+
+
+class FakeResponse:
+    """A geocoder response with its status and json."""
+
+    def __init__(self, status_code: int, data: dict):  # noqa D107
+        self.status_code = status_code
+        self.data = data
+        self.headers = {}
+
+    def raise_for_status(self):
+        """Raise on an error status like requests does."""
+        if self.status_code >= requests.codes.bad_request:
+            raise requests.HTTPError(f'{self.status_code} error')
+
+    def json(self) -> dict:
+        """Get the data."""
+        return self.data
+
+
+class FakeSession:
+    """Answers like mockgeocoder, with a status per code and a quota of requests."""
+
+    def __init__(self, empty: float = 0.3, statuses: dict | None = None, quota: int = 0):  # noqa D107
+        self.empty = empty
+        self.statuses = statuses or {}
+        self.quota = quota
+        self.queries = []
+
+    def get(self, url, params, timeout):
+        """Answer the query of the params."""
+        self.queries.append(params['q'])
+        if self.quota and len(self.queries) > self.quota:
+            return FakeResponse(requests.codes.payment_required, {})
+        code = int(params['q'].split(',')[0])
+        status = self.statuses.get(code, requests.codes.ok)
+        return FakeResponse(status, fake_response(params['q'], self.empty))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LookupPostcodesTest(TestCase):
+    def lookup(self, session: FakeSession, codes, **kwargs):
+        """Look up the codes answered by the session, without waiting between requests."""
+        with mock.patch('main.geocoding.session', return_value=session):
+            return lookup_postcodes(codes, 'key', rate=10_000, batch_size=7, **kwargs)
+
+    def test_stores_results_and_caches_every_response(self):
+        """Each code is asked once, found ones are stored and every response cached."""
+        session = FakeSession()
+        metrics = self.lookup(session, range(1, 41))
+        assert sorted(session.queries) == sorted(query_for(c) for c in range(1, 41))
+        found = Postcode.objects.filter(country=COUNTRY_ZA, opencage=True)
+        assert found.count() == metrics.counters['written']
+        assert metrics.counters['written'] + metrics.counters['empty'] == 40
+        assert metrics.counters['empty'] > 0
+        assert GeocodeCache.objects.count() == 40
+        postcode = found.first()
+        assert postcode.level == 'suburb'
+        assert postcode.area == f'Suburb {postcode.code:04d}'
+
+    def test_resume_asks_only_for_codes_never_asked(self):
+        """A rerun answers the missing codes from the cache without requests."""
+        self.lookup(FakeSession(), range(1, 21))
+        session = FakeSession()
+        metrics = self.lookup(session, missing_codes(1, 30))
+        assert sorted(session.queries) == [query_for(code) for code in range(21, 31)]
+        assert metrics.counters['requested'] == 10
+        assert metrics.counters['cached'] == len(missing_codes(1, 20))
+
+    def test_retry_empty_asks_again_for_codes_without_result(self):
+        """Only the cached responses without a result are asked for again."""
+        first = self.lookup(FakeSession(), range(1, 21))
+        session = FakeSession(empty=0)
+        self.lookup(session, missing_codes(1, 20), retry_empty=True)
+        assert len(session.queries) == first.counters['empty']
+        assert Postcode.objects.filter(opencage=True).count() == 20
+
+    def test_offline_reranks_from_the_cache(self):
+        """Offline the stored results are picked again from the cache, no requests made."""
+        self.lookup(FakeSession(), range(1, 21))
+        stored = dict(Postcode.objects.values_list('code', 'latitude'))
+        Postcode.objects.update(latitude=0, level='')
+        session = FakeSession()
+        metrics = self.lookup(session, range(1, 31), offline=True)
+        assert session.queries == []
+        assert metrics.counters['uncached'] == 10
+        assert dict(Postcode.objects.values_list('code', 'latitude')) == stored
+        assert not Postcode.objects.filter(level='').exists()
+
+    def test_failed_code_does_not_stop_the_run(self):
+        """A code refused by the geocoder is counted and the others carry on."""
+        session = FakeSession(empty=0, statuses={5: requests.codes.bad_request})
+        metrics = self.lookup(session, range(1, 11))
+        assert metrics.counters['failed'] == 1
+        assert metrics.counters['written'] == 9
+        assert 5 in missing_codes(1, 10)
+
+    def test_quota_stops_the_run_and_keeps_the_results(self):
+        """A 402 ends the run with the results so far written."""
+        session = FakeSession(empty=0, quota=5)
+        metrics = self.lookup(session, range(1, 31), workers=1)
+        assert metrics.counters['quota_spent'] == 1
+        assert metrics.counters['written'] == 5
+        assert len(missing_codes(1, 30)) == 25
@@ -1,35 +1,18 @@
 from django.shortcuts import redirect, render
 from django.urls import reverse
 
-from main.constants import CATEGORY_GAMES, CATEGORY_MOVIES, CATEGORY_TV_SHOWS
-from main.models import Torrent
-from main.selectors import list_old_tv, list_recent_games, list_titles_without_torrents
+from main.constants import JOB_PRUNE
+from main.jobs import enqueue
+from main.selectors import aget_dashboard_stats
 
 
-def home_view(request):
+async def home_view(request):
     """Home view."""
-    titles_without_torrents = list_titles_without_torrents()
-    old_tv = list_old_tv()
-    count_movies = Torrent.objects.filter(category=CATEGORY_MOVIES).count()
-    count_series = Torrent.objects.filter(category=CATEGORY_TV_SHOWS).count()
-    count_games = Torrent.objects.filter(category=CATEGORY_GAMES).count()
-    recent_games = list_recent_games()
-    ctx = {
-        # 'played_games': played_games,
-        'old_tv': old_tv,
-        'titles_without_torrents': titles_without_torrents,
-        'count_movies': count_movies,
-        'count_series': count_series,
-        'count_games': count_games,
-        'recent_games': list(recent_games)[::-1],
-    }
+    ctx = await aget_dashboard_stats()
     return render(request, 'main/home.html', ctx)
 
 
 def clear_tv_view(request):
-    """Clear old tv torrents."""
-    old_tv = list_old_tv()
-    old_tv.delete()
-    titles_without_torrents = list_titles_without_torrents()
-    titles_without_torrents.delete()
+    """Queue a job clearing old tv torrents."""
+    enqueue(JOB_PRUNE)
     return redirect(reverse('home_view'))
@@ -0,0 +1 @@
+"""SQLite backend, see base."""
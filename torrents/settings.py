@@ -9,6 +9,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 import sys
 from pathlib import Path
 
@@ -75,10 +76,36 @@ WSGI_APPLICATION = 'torrents.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
+# Postgres when POSTGRES_DB is set, otherwise sqlite with WAL, relaxed fsync, busy timeout
+# and immediate transactions, see torrents.db.sqlite3
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 60,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'torrents.db.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+
+# Cache
+# Shared between the web and command processes so a scrape can invalidate the dashboard.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
@@ -184,8 +211,21 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        # a line per scraped torrent, see scrape_sites --log-rows
+        'main.scraper.rows': {
+            'level': 'WARNING',
+        },
     },
 }
 
+# scrape metrics as json and prometheus textfile
+METRICS_DIR = BASE_DIR / 'logs'
+
+# reports of the commands' --profile options
+PROFILE_DIR = BASE_DIR / 'logs'
+
+# postcode distances written by postcodedistances --store matrix, with a .codes.npy beside
+DISTANCE_MATRIX_PATH = BASE_DIR / 'distances.npy'
+
 
 OPENCAGE_API_KEY = '44dbf26657974ceda68d55f3077883c6'
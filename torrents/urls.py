@@ -18,10 +18,21 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
-from main import views
+from main import api, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home_view, name='home_view'),
     path('clear/tv', views.clear_tv_view, name='clear_tv_view'),
+    path('api/titles/', api.titles_view, name='api_titles'),
+    path('api/titles/export/', api.titles_export_view, name='api_titles_export'),
+    path('api/titles/<path:text>/', api.title_view, name='api_title'),
+    path('api/torrents/', api.torrents_view, name='api_torrents'),
+    path('api/torrents/export/', api.torrents_export_view, name='api_torrents_export'),
+    path('api/postcodes/nearest/', api.postcodes_nearest_view, name='api_postcodes_nearest'),
+    path(
+        'api/postcodes/<int:code>/within/',
+        api.postcodes_within_view,
+        name='api_postcodes_within',
+    ),
 ]